@@ -0,0 +1,109 @@
+"""Content-addressed cache for meal analysis results.
+
+Entries live in the `llm_analysis_cache` collection, keyed by a SHA-256 of the
+prompt version plus the normalized meal description or the image bytes, so a
+resubmitted photo or a retyped "2 oeufs et une tartine" skips the LLM. Entries
+expire through a TTL index on `expires_at`. The collection is capped at
+`max_entries` by evicting the least recently used documents, and hit/miss
+counters are kept per process.
+"""
+import hashlib
+import logging
+import re
+import unicodedata
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_description(text: str) -> str:
+    """Case, Unicode form and whitespace insensitive form of a meal description"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _WHITESPACE_RE.sub(" ", text).strip(" .!")
+
+
+class AnalysisCache:
+    def __init__(self, collection, prompt_version: str, ttl_seconds: int = 30 * 24 * 3600,
+                 max_entries: int = 50000, evict_every: int = 100):
+        self.collection = collection
+        self.prompt_version = prompt_version
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _key(self, kind: str, payload: bytes) -> str:
+        digest = hashlib.sha256()
+        for part in (self.prompt_version.encode(), kind.encode(), payload):
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def text_key(self, description: str) -> str:
+        return self._key("text", normalize_description(description).encode("utf-8"))
+
+    def image_key(self, image_bytes: bytes) -> str:
+        return self._key("image", image_bytes)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        doc = await self.collection.find_one_and_update(
+            # The TTL monitor runs once a minute, so check expiry here too
+            {"_id": key, "expires_at": {"$gt": now}},
+            {"$set": {"last_used_at": now}, "$inc": {"hits": 1}},
+            projection={"analysis": 1}
+        )
+        if doc is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return doc["analysis"]
+
+    async def put(self, key: str, analysis: Dict[str, Any]) -> None:
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "analysis": analysis,
+                    "prompt_version": self.prompt_version,
+                    "last_used_at": now,
+                    "expires_at": now + self.ttl,
+                },
+                "$setOnInsert": {"created_at": now, "hits": 0},
+            },
+            upsert=True
+        )
+        self.stores += 1
+        if self.stores % self.evict_every == 0:
+            await self.evict()
+
+    async def evict(self) -> int:
+        """Drop the least recently used entries above `max_entries`"""
+        excess = await self.collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return 0
+        oldest = await self.collection.find({}, {"_id": 1}).sort("last_used_at", 1).limit(excess).to_list(excess)
+        result = await self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in oldest]}})
+        self.evictions += result.deleted_count
+        logger.info(f"Analysis cache evicted {result.deleted_count} entries")
+        return result.deleted_count
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "prompt_version": self.prompt_version,
+            "max_entries": self.max_entries,
+            "ttl_seconds": int(self.ttl.total_seconds()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,342 @@
+"""Background jobs for meal analysis.
+
+A GPT-4o analysis takes 5-15 s, too long to hold a mobile HTTP connection
+open under load. In job mode the API enqueues the request and returns a job id
+at once. A bounded pool of in-process workers runs the analyses, and clients
+poll, long-poll or follow the job over server-sent events.
+
+The queue is pluggable:
+
+- `InMemoryJobQueue` (default) keeps jobs in this process. It is the fastest
+  option but only works with a single API replica.
+- `MongoJobQueue` stores jobs in the `analysis_jobs` collection. Any replica
+  can accept, run or report on a job, and jobs whose worker died are
+  re-queued once their lease expires (leases come from `leased_queue`).
+  Workers renew the lease while the handler runs, so a slow analysis
+  (LLM timeout plus retries) is not handed to a second worker.
+"""
+import abc
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from leased_queue import LeasedQueue
+from timestamps import utc_now
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TERMINAL = (DONE, FAILED)
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are waiting for a worker."""
+
+
+class JobFailed(Exception):
+    """Raised by a job handler with a message safe to show to the client."""
+
+
+def new_job(user_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "status": QUEUED,
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class JobQueue(abc.ABC):
+    """Interface shared by the queue backends"""
+
+    # How often a worker renews the lease of a running job; None when jobs have no lease
+    heartbeat_seconds: Optional[float] = None
+
+    @abc.abstractmethod
+    async def submit(self, job: Dict[str, Any]) -> None:
+        """Queue a new job, or raise QueueFull"""
+
+    @abc.abstractmethod
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Next queued job, marked running; may return None after a short wait"""
+
+    @abc.abstractmethod
+    async def complete(self, job: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Record the result of a claimed job"""
+
+    @abc.abstractmethod
+    async def fail(self, job: Dict[str, Any], error: str) -> None:
+        """Record the failure of a claimed job, with a message for the client"""
+
+    @abc.abstractmethod
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job, without its payload"""
+
+    @abc.abstractmethod
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """The job once it is finished, or its current state after `timeout` seconds"""
+
+    async def heartbeat(self, job: Dict[str, Any]) -> bool:
+        """Extend the lease of a running job; False when another worker has taken it over"""
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemoryJobQueue(JobQueue):
+    def __init__(self, max_pending: int = 200, retention_seconds: int = 3600, max_jobs: int = 10000):
+        self.max_pending = max_pending
+        self.retention = timedelta(seconds=retention_seconds)
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._pending: "asyncio.Queue[str]" = asyncio.Queue()
+        self.submitted = 0
+        self.rejected = 0
+
+    def _prune(self) -> None:
+        cutoff = datetime.now(timezone.utc) - self.retention
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if job["status"] not in TERMINAL:
+                continue
+            if job["updated_at"] >= cutoff and len(self._jobs) <= self.max_jobs:
+                break
+            del self._jobs[job_id]
+            self._finished.pop(job_id, None)
+
+    async def submit(self, job: Dict[str, Any]) -> None:
+        if self._pending.qsize() >= self.max_pending:
+            self.rejected += 1
+            raise QueueFull("Analysis queue is full")
+        self._prune()
+        self._jobs[job["id"]] = job
+        self._finished[job["id"]] = asyncio.Event()
+        self._pending.put_nowait(job["id"])
+        self.submitted += 1
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(await self._pending.get())
+        if job is None:
+            return None
+        job.update(status=RUNNING, attempts=job["attempts"] + 1, updated_at=datetime.now(timezone.utc))
+        return dict(job)
+
+    def _finish(self, job_id: str, **fields) -> None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        # The payload (possibly image bytes) is not needed once the job is over
+        job.update(fields, payload=None, updated_at=datetime.now(timezone.utc))
+        self._finished[job_id].set()
+
+    async def complete(self, job: Dict[str, Any], result: Dict[str, Any]) -> None:
+        self._finish(job["id"], status=DONE, result=result)
+
+    async def fail(self, job: Dict[str, Any], error: str) -> None:
+        self._finish(job["id"], status=FAILED, error=error)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        finished = self._finished.get(job_id)
+        if finished is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "pending": self._pending.qsize(),
+            "jobs": len(self._jobs),
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+        }
+
+
+class MongoJobQueue(JobQueue, LeasedQueue):
+    pending_status = QUEUED
+    processing_status = RUNNING
+    dead_status = FAILED
+    error_field = "error"
+    interrupted_error = "Analyse interrompue"
+
+    def __init__(self, collection, max_pending: int = 200, retention_seconds: int = 3600,
+                 lease_seconds: int = 120, max_attempts: int = 2, poll_interval: float = 0.5):
+        LeasedQueue.__init__(self, collection, max_attempts, lease_seconds=lease_seconds)
+        # Renewed three times per lease, so one slow write does not lose the job
+        self.heartbeat_seconds = lease_seconds / 3
+        self.max_pending = max_pending
+        self.retention = timedelta(seconds=retention_seconds)
+        self.poll_interval = poll_interval
+        self.submitted = 0
+        self.rejected = 0
+
+    def _requeue_fields(self, now: datetime) -> Dict[str, Any]:
+        # A replica died mid-job: give the job another worker
+        return {"status": QUEUED, "updated_at": now}
+
+    def _dead_fields(self, now: datetime) -> Dict[str, Any]:
+        return {**super()._dead_fields(now), "payload": None}
+
+    async def submit(self, job: Dict[str, Any]) -> None:
+        pending = await self.collection.count_documents({"status": QUEUED}, limit=self.max_pending)
+        if pending >= self.max_pending:
+            self.rejected += 1
+            raise QueueFull("Analysis queue is full")
+        await self.collection.insert_one({**job, "expires_at": job["created_at"] + self.retention})
+        self.submitted += 1
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        now = utc_now()
+        await self.expire_leases(now)
+        job = await self.claim_one({"status": QUEUED}, [("created_at", 1)], now)
+        if job is None:
+            await asyncio.sleep(self.poll_interval)
+        return job
+
+    async def _finish(self, job: Dict[str, Any], **fields) -> None:
+        now = utc_now()
+        # Matched on the claim: a worker whose lease expired does not overwrite the retry
+        await self.release([job], {**fields, "payload": None, "updated_at": now,
+                                   "expires_at": now + self.retention})
+
+    async def heartbeat(self, job: Dict[str, Any]) -> bool:
+        return await self.renew([job]) > 0
+
+    async def complete(self, job: Dict[str, Any], result: Dict[str, Any]) -> None:
+        await self._finish(job, status=DONE, result=result)
+
+    async def fail(self, job: Dict[str, Any], error: str) -> None:
+        await self._finish(job, status=FAILED, error=error)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"id": job_id}, {"_id": 0, "payload": 0})
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        # Polling keeps this working on standalone servers (change streams need a replica set)
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job["status"] in TERMINAL:
+                return job
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return job
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "mongo",
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "requeued": self.requeued,
+        }
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class JobWorkerPool:
+    """`concurrency` tasks pulling jobs from `queue` and running `handler` on them"""
+
+    def __init__(self, queue: JobQueue, handler: JobHandler, concurrency: int = 4):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self._tasks: List[asyncio.Task] = []
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self, worker: int) -> None:
+        while True:
+            try:
+                job = await self.queue.claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analysis worker {worker} could not claim a job: {e}")
+                await asyncio.sleep(1)
+                continue
+            if job is None:
+                continue
+
+            self.busy += 1
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analysis worker {worker} could not record job {job['id']}: {e}")
+            finally:
+                self.busy -= 1
+
+    async def _heartbeat(self, job: Dict[str, Any]) -> None:
+        # Keeps the job's lease alive however long the handler takes
+        while True:
+            await asyncio.sleep(self.queue.heartbeat_seconds)
+            try:
+                if not await self.queue.heartbeat(job):
+                    logger.warning(f"Analysis job {job['id']} lost its lease to another worker")
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of analysis job {job['id']}: {e}")
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job)) if self.queue.heartbeat_seconds else None
+        try:
+            result = await self.handler(job)
+        except JobFailed as e:
+            self.failed += 1
+            await self.queue.fail(job, str(e))
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Analysis job {job['id']} failed: {e}")
+            await self.queue.fail(job, "Erreur lors de l'analyse")
+        else:
+            self.completed += 1
+            await self.queue.complete(job, result)
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.concurrency,
+            "busy": self.busy,
+            "completed": self.completed,
+            "failed": self.failed,
+            "queue": self.queue.stats(),
+        }
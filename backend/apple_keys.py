@@ -0,0 +1,131 @@
+"""Async, cached store for Sign in with Apple public keys (JWKS).
+
+Parsed RSA keys are cached by `kid` for as long as Apple's Cache-Control
+allows. Shortly before expiry the set is refreshed in the background so logins
+never wait on Apple, and an unknown `kid` (key rotation) triggers at most one
+refetch per `min_refetch_interval` seconds.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from jwt.algorithms import RSAAlgorithm
+
+logger = logging.getLogger(__name__)
+
+APPLE_JWKS_URL = "https://appleid.apple.com/auth/keys"
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class UnknownKeyId(Exception):
+    """Raised when no Apple public key matches the token's `kid`."""
+
+
+def parse_max_age(cache_control: Optional[str]) -> Optional[int]:
+    if not cache_control or "no-store" in cache_control or "no-cache" in cache_control:
+        return None
+    match = _MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+class AppleKeyStore:
+    def __init__(
+        self,
+        jwks_url: str = APPLE_JWKS_URL,
+        default_ttl: int = 3600,
+        min_ttl: int = 60,
+        refresh_ahead: int = 60,
+        min_refetch_interval: int = 30,
+        timeout: float = 5.0,
+    ):
+        self.jwks_url = jwks_url
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self._client = httpx.AsyncClient(timeout=timeout)
+        self._keys: Dict[str, Any] = {}
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._last_fetch = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.fetches = 0
+        self.fetch_errors = 0
+
+    async def get_key(self, kid: str):
+        """Return the public key for `kid`, fetching Apple's JWKS only when needed."""
+        now = time.monotonic()
+        if not self._keys or now >= self._expires_at:
+            await self._refresh(stale_ok=bool(self._keys))
+        elif now >= self._refresh_at:
+            self._schedule_refresh()
+
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._last_fetch >= self.min_refetch_interval:
+            # Apple may have rotated its keys since our last fetch
+            await self._refresh(stale_ok=True, force=True)
+            key = self._keys.get(kid)
+        if key is None:
+            raise UnknownKeyId(kid)
+        return key
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh(stale_ok=True))
+
+    async def _refresh(self, stale_ok: bool, force: bool = False) -> None:
+        async with self._lock:
+            # Another coroutine may have refreshed while we waited for the lock
+            now = time.monotonic()
+            if force:
+                if now - self._last_fetch < self.min_refetch_interval:
+                    return
+            elif self._keys and now < self._refresh_at:
+                return
+
+            self._last_fetch = now
+            self.fetches += 1
+            try:
+                response = await self._client.get(self.jwks_url)
+                response.raise_for_status()
+                keys = {
+                    jwk["kid"]: RSAAlgorithm.from_jwk(jwk)
+                    for jwk in response.json().get("keys", [])
+                    if jwk.get("kid")
+                }
+            except Exception as e:
+                self.fetch_errors += 1
+                if not stale_ok:
+                    raise
+                # Keep serving the keys we have and try again shortly
+                logger.warning(f"Apple JWKS refresh failed, serving cached keys: {e}")
+                self._set_ttl(self.min_ttl)
+                return
+
+            max_age = parse_max_age(response.headers.get("cache-control"))
+            ttl = max(self.min_ttl, max_age if max_age is not None else self.default_ttl)
+            self._keys = keys
+            self._set_ttl(ttl)
+
+    def _set_ttl(self, ttl: float) -> None:
+        now = time.monotonic()
+        self._expires_at = now + ttl
+        self._refresh_at = self._expires_at - min(self.refresh_ahead, ttl / 2)
+
+    async def close(self) -> None:
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        await self._client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": sorted(self._keys),
+            "expires_in_seconds": max(0, round(self._expires_at - time.monotonic())),
+            "fetches": self.fetches,
+            "fetch_errors": self.fetch_errors,
+        }
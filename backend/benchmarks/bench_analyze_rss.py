@@ -0,0 +1,92 @@
+"""
+Benchmark: peak server RSS for JSON/base64 vs multipart meal photo analysis.
+
+Fires --concurrency simultaneous uploads of the same phone-sized photo at a
+running API, first as {"image_base64": ...} to /calories/analyze and then as
+multipart/form-data to /calories/analyze/upload. The uvicorn worker's peak
+RSS (VmHWM) is reset between the two rounds through /proc/<pid>/clear_refs,
+so run this on the server host as the same user (Linux only).
+
+To measure the intake path without spending LLM tokens, start the server
+without EMERGENT_LLM_KEY: requests then end in a 500 after pre-processing,
+which is the part that differs between the two endpoints.
+
+    cd backend && python benchmarks/bench_analyze_rss.py --url http://localhost:8001 \\
+        --pid $(pgrep -f "uvicorn server:app") --email me@example.com --password secret
+"""
+import argparse
+import asyncio
+import base64
+import time
+from pathlib import Path
+
+import httpx
+
+from bench_meal_images import synthetic_photo
+
+
+def read_status(pid: int) -> dict:
+    values = {}
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        key, _, value = line.partition(":")
+        if key in ("VmRSS", "VmHWM"):
+            values[key] = int(value.split()[0]) / 1024  # kB -> MB
+    return values
+
+
+def reset_peak(pid: int):
+    # "5" resets the peak resident set size (VmHWM) to the current RSS
+    Path(f"/proc/{pid}/clear_refs").write_text("5")
+
+
+async def run_round(name, pid, send, concurrency):
+    reset_peak(pid)
+    before = read_status(pid)["VmRSS"]
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(send() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = read_status(pid)
+    codes = {code: statuses.count(code) for code in set(statuses)}
+    print(
+        f"{name:<24} rss before {before:7.1f} MB  peak {after['VmHWM']:7.1f} MB  "
+        f"(+{after['VmHWM'] - before:6.1f} MB)  {elapsed:6.2f} s  statuses {codes}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--pid", type=int, required=True, help="pid of the uvicorn worker process")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--photo", help="JPEG to upload (defaults to a synthetic 12 MP photo)")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    photo = Path(args.photo).read_bytes() if args.photo else synthetic_photo(4032, 3024, 0)
+    payload = base64.b64encode(photo).decode("ascii")
+    print(f"photo: {len(photo) / 1024 ** 2:.1f} MB raw, {len(payload) / 1024 ** 2:.1f} MB base64, x{args.concurrency}")
+
+    async with httpx.AsyncClient(base_url=f"{args.url}/api", timeout=120) as client:
+        login = await client.post("/auth/login", json={"email": args.email, "password": args.password})
+        login.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {login.json()['access_token']}"
+
+        async def send_json():
+            response = await client.post("/calories/analyze", json={"image_base64": payload, "meal_type": "dejeuner"})
+            return response.status_code
+
+        async def send_multipart():
+            response = await client.post(
+                "/calories/analyze/upload",
+                files={"image": ("meal.jpg", photo, "image/jpeg")},
+                data={"meal_type": "dejeuner"}
+            )
+            return response.status_code
+
+        await run_round("JSON + base64", args.pid, send_json, args.concurrency)
+        await run_round("multipart UploadFile", args.pid, send_multipart, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+Benchmark: transactional email rendering cost per message.
+
+Renders --emails messages (think of a programme launch announcement sent to
+the whole user base) with:
+
+- the previous inline f-string (HTML only),
+- EmailTemplates.render with templates compiled once (HTML + plain text),
+- the same templates recompiled on every send (no template cache),
+- precompiled HTML plus html_to_text on every rendered message, i.e. what a
+  text alternative costs when it is not generated ahead of time.
+
+    cd backend && python benchmarks/bench_email_templates.py --emails 20000
+"""
+import argparse
+import time
+
+from common import summarize, BACKEND_DIR
+
+from email_rendering import EmailTemplates, html_to_text
+
+STATIC_CONTEXT = {"brand_name": "Beautyfit By Amel", "brand_color": "#E37E7F", "year": 2025}
+
+
+def legacy_html(first_name, reset_code):
+    return f"""
+                <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+                    <div style="text-align: center; margin-bottom: 30px;">
+                        <h1 style="color: #E37E7F; font-family: 'Playfair Display', serif;">Beautyfit By Amel</h1>
+                    </div>
+                    <p style="color: #333;">Bonjour {first_name} 👋</p>
+                    <p style="color: #666;">Tu as demandé à réinitialiser ton mot de passe. Voici ton code de vérification :</p>
+                    <div style="background: linear-gradient(135deg, #E37E7F, #EE9F80); padding: 20px; border-radius: 12px; text-align: center; margin: 30px 0;">
+                        <span style="font-size: 32px; font-weight: bold; color: white; letter-spacing: 8px;">{reset_code}</span>
+                    </div>
+                    <p style="color: #666;">Ce code expire dans <strong>1 heure</strong>.</p>
+                    <p style="color: #999; font-size: 14px;">Si tu n'as pas demandé cette réinitialisation, ignore simplement cet email.</p>
+                    <hr style="border: none; border-top: 1px solid #eee; margin: 30px 0;">
+                    <p style="color: #999; font-size: 12px; text-align: center;">
+                        © 2025 Beautyfit By Amel - Ton coach fitness personnel
+                    </p>
+                </div>
+                """
+
+
+def measure(fn, emails):
+    samples = []
+    start = time.perf_counter()
+    for n in range(emails):
+        t0 = time.perf_counter()
+        fn(f"Utilisatrice {n}", f"{n % 1000000:06d}")
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=20000)
+    args = parser.parse_args()
+    directory = BACKEND_DIR / "templates" / "email"
+
+    templates = EmailTemplates(directory, STATIC_CONTEXT)
+    start = time.perf_counter()
+    compiled = templates.load()
+    print(f"Startup: compiled {compiled} templates in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def precompiled(first_name, reset_code):
+        return templates.render("password_reset", first_name=first_name, reset_code=reset_code, expires_in="1 heure")
+
+    def recompiled(first_name, reset_code):
+        fresh = EmailTemplates(directory, STATIC_CONTEXT)
+        return fresh.render("password_reset", first_name=first_name, reset_code=reset_code, expires_in="1 heure")
+
+    def text_per_send(first_name, reset_code):
+        html = templates.env.get_template("password_reset.html").render(
+            first_name=first_name, reset_code=reset_code, expires_in="1 heure"
+        )
+        return html, html_to_text(html)
+
+    # Recompiling is orders of magnitude slower: a sample is enough
+    cases = (
+        ("f-string (html only)", legacy_html, args.emails),
+        ("precompiled (html + text)", precompiled, args.emails),
+        ("recompiled each send", recompiled, max(1, args.emails // 100)),
+        ("html + html_to_text per send", text_per_send, args.emails),
+    )
+    for label, fn, emails in cases:
+        samples, elapsed = measure(fn, emails)
+        summarize(label, samples)
+        print(f"{'':<32} {emails / elapsed:,.0f} emails/s")
+
+
+if __name__ == "__main__":
+    main()
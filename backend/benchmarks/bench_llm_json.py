@@ -0,0 +1,89 @@
+"""
+Benchmark: JSON extraction from LLM completions, greedy regex vs single-pass scanner.
+
+Times the previous `re.search(r'\\{[\\s\\S]*\\}')` + json.loads against
+llm_json.extract_json_object on typical, large (--foods items plus chatty
+prose) and malformed completions, and shows whether each one recovered the
+analysis.
+
+    cd backend && python benchmarks/bench_llm_json.py --foods 500 --prose-kb 50
+"""
+import argparse
+import json
+import re
+import time
+
+from common import summarize
+
+from llm_json import extract_json_object
+
+
+def legacy_extract(text):
+    try:
+        match = re.search(r'\{[\s\S]*\}', text)
+        if match:
+            return json.loads(match.group())
+    except json.JSONDecodeError:
+        pass
+    return None
+
+
+def analysis(foods):
+    items = [
+        {"name": f"Aliment {i}", "quantity": "100g", "calories": 100 + i, "proteins": 5.0, "carbs": 10.0, "fats": 2.0}
+        for i in range(foods)
+    ]
+    return json.dumps({
+        "foods": items,
+        "total_calories": sum(item["calories"] for item in items),
+        "total_proteins": 5.0 * foods,
+        "total_carbs": 10.0 * foods,
+        "total_fats": 2.0 * foods,
+        "analysis_text": "Repas équilibré",
+    }, ensure_ascii=False, indent=2)
+
+
+def cases(foods, prose_kb):
+    small = analysis(3)
+    large = analysis(foods)
+    prose = ("Voici quelques conseils nutritionnels pour la suite de la journée. " * (prose_kb * 16))[:prose_kb * 1024]
+    return {
+        "typical (fenced)": f"```json\n{small}\n```",
+        "large + prose": f"Analyse détaillée :\n{large}\n\n{prose}",
+        "trailing braces in prose": f"{small}\nPortions {{moyennes}} et sauces {{non comptées}}.",
+        "stray brace before JSON": f"Note {{ importante :\n{small}",
+        "trailing comma": small.replace("\n}", ",\n}"),
+        "truncated (no closing)": large[:-1],
+        "many unclosed braces": "{ " * (prose_kb * 100) + "fin",
+    }
+
+
+def measure(fn, text, iterations):
+    samples = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn(text)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, result is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--foods", type=int, default=500)
+    parser.add_argument("--prose-kb", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    for name, text in cases(args.foods, args.prose_kb).items():
+        print(f"\n{name} ({len(text) / 1024:.1f} KB)")
+        for label, fn in (
+            ("  regex + json.loads", legacy_extract),
+            ("  extract_json_object", lambda t: extract_json_object(t, required_key="foods")),
+        ):
+            samples, ok = measure(fn, text, args.iterations)
+            summarize(f"{label} [{'ok' if ok else 'FAIL'}]", samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark: meal photo pre-processing (decode, EXIF strip, downsize, re-encode).
+
+Generates phone-sized JPEGs (12 MP by default, with EXIF) or uses the photos
+in --dir, runs them through ImagePreprocessor the way /calories/analyze does
+(base64 in, worker pool), and reports the payload shrink and time per photo,
+plus the throughput when --concurrency requests arrive at once.
+
+    cd backend && python benchmarks/bench_meal_images.py --count 20 --max-edge 1024 --format jpeg
+"""
+import argparse
+import asyncio
+import base64
+import io
+import random
+import time
+from pathlib import Path
+
+from common import summarize
+
+from PIL import Image
+
+from meal_images import ImagePreprocessor
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    # Smooth gradient plus noise compresses roughly like a real food photo
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), rng.randint(20, 60)).convert("RGB")
+    image = Image.blend(image, noise, 0.5)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 CW
+    exif[0x010F] = "BenchPhone"
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=92, exif=exif)
+    return out.getvalue()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", help="folder of real photos (*.jpg, *.jpeg, *.png, *.webp)")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--max-edge", type=int, default=1024)
+    parser.add_argument("--format", choices=["jpeg", "webp"], default="jpeg")
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.dir:
+        paths = [p for p in sorted(Path(args.dir).iterdir()) if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp")]
+        photos = [p.read_bytes() for p in paths[:args.count]]
+    else:
+        photos = [synthetic_photo(4032, 3024, seed) for seed in range(args.count)]
+    payloads = [base64.b64encode(photo).decode("ascii") for photo in photos]
+
+    preprocessor = ImagePreprocessor(args.max_edge, args.format, args.quality, args.workers)
+    try:
+        samples, prepared = [], []
+        for payload in payloads:
+            start = time.perf_counter()
+            prepared.append(await preprocessor.prepare_base64(payload))
+            samples.append((time.perf_counter() - start) * 1000)
+        summarize("prepare (sequential)", samples)
+
+        base64_in = sum(len(p) for p in payloads)
+        base64_out = sum(len(p.base64()) for p in prepared)
+        print(f"base64 payload to LLM: {base64_in / 1024 ** 2:.1f} MB -> {base64_out / 1024 ** 2:.2f} MB "
+              f"({1 - base64_out / base64_in:.1%} smaller, {base64_in / len(payloads) / 1024:.0f} KB -> "
+              f"{base64_out / len(payloads) / 1024:.0f} KB per photo)")
+
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(payload):
+            async with semaphore:
+                await preprocessor.prepare_base64(payload)
+
+        await asyncio.gather(*(one(p) for p in payloads))
+        elapsed = time.perf_counter() - start
+        print(f"concurrent x{args.concurrency} on {args.workers} workers: {len(payloads) / elapsed:.1f} photos/s")
+        print(preprocessor.stats())
+    finally:
+        preprocessor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Benchmark: local nutrition table fast path vs the LLM for text meals.
+
+Runs a corpus of typical meal descriptions through the local food index and
+reports the share answered fully offline, partially (only the remainder goes
+to the LLM) or not at all, with p50/p95 resolution latency. With --llm (needs
+EMERGENT_LLM_KEY) the same descriptions are also sent to GPT-4o so the latency
+saved on locally answered meals can be compared directly.
+
+    cd backend && python benchmarks/bench_nutrition_db.py [--corpus meals.txt] [--llm]
+"""
+import argparse
+import asyncio
+import time
+
+from common import summarize
+
+from nutrition_db import NutritionIndex, FOODS
+
+SAMPLE_MEALS = [
+    "2 oeufs et une tartine",
+    "150g riz, 120g poulet",
+    "Un bol de lait avec des céréales",
+    "3 dattes + un verre de lait",
+    "une banane et un kiwi",
+    "200 g de pâtes avec 1 c à s d'huile d'olive",
+    "2 tranches de pain complet avec du beurre",
+    "chorba",
+    "Café, croissant",
+    "yaourt nature et une pomme",
+    "omelette, salade verte, pain",
+    "pavé de saumon 150g, brocolis, riz",
+    "flocons d'avoine 50g, lait 200ml, miel",
+    "steak haché et frites",
+    "lentilles 200g avec carottes",
+    "thé à la menthe et 5 dattes",
+    "une poignée d'amandes",
+    "jus d'orange et pain au chocolat",
+    "escalope de dinde, haricots verts, semoule",
+    "2 carrés de chocolat noir",
+    "pizza 4 fromages",
+    "salade César",
+    "tajine de poulet aux olives",
+    "burger, frites et coca",
+    "sushi saumon x8",
+    "bol de riz avec du poulet teriyaki",
+    "couscous royal",
+    "crêpe au nutella",
+    "2 oeufs, bacon et pain grillé",
+    "harira et 3 dattes",
+]
+
+
+async def time_llm(descriptions):
+    import server  # only needed for the live comparison
+
+    samples = []
+    for description in descriptions:
+        start = time.perf_counter()
+        await server.call_meal_llm("benchmark", meal_description=description)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="file with one meal description per line (defaults to a built-in sample)")
+    parser.add_argument("--iterations", type=int, default=200, help="passes over the corpus for local timings")
+    parser.add_argument("--llm", action="store_true", help="also time GPT-4o on the corpus (live, costs tokens)")
+    args = parser.parse_args()
+
+    meals = SAMPLE_MEALS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as fh:
+            meals = [line.strip() for line in fh if line.strip()]
+
+    index = NutritionIndex(FOODS)
+    full, partial = [], []
+    for description in meals:
+        result = index.resolve(description)
+        if result.complete:
+            full.append(description)
+        elif result.foods:
+            partial.append(description)
+    total = len(meals)
+    print(f"corpus: {total} meals")
+    print(f"  resolved locally   {len(full):4d}  ({len(full) / total:6.1%})")
+    print(f"  partially local    {len(partial):4d}  ({len(partial) / total:6.1%})")
+    print(f"  LLM only           {total - len(full) - len(partial):4d}  ({(total - len(full) - len(partial)) / total:6.1%})")
+
+    local_samples = []
+    for _ in range(args.iterations):
+        for description in meals:
+            start = time.perf_counter()
+            index.resolve(description)
+            local_samples.append((time.perf_counter() - start) * 1000)
+    local = summarize("local index resolve", local_samples)
+
+    if args.llm:
+        llm = summarize("gpt-4o analysis", await time_llm(full or meals))
+        print(
+            f"latency saved per locally answered meal: "
+            f"p50 {llm['p50'] - local['p50']:.1f} ms, p95 {llm['p95'] - local['p95']:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Benchmark: /calories/today read paths vs the previous Python summing.
+
+Seeds a synthetic user with a heavy meal history in a scratch database, checks
+that every implementation returns the same payload, then times the legacy
+Python summing, the meal_history aggregation and the daily_nutrition rollup.
+
+    cd backend && python benchmarks/bench_today_summary.py --today-meals 80 --history-meals 5000
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from common import summarize, time_async
+
+import nutrition_rollups
+import server
+
+
+async def legacy_today_summary(user):
+    """The pre-aggregation implementation, kept here for comparison"""
+    db = server.db
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    start = f"{today}T00:00:00"
+    end = f"{today}T23:59:59"
+    meals = await db.meal_history.find(
+        {"user_id": user["id"], "created_at": {"$gte": start, "$lte": end}},
+        {"_id": 0}
+    ).to_list(100)
+    total_calories = sum(m.get("total_calories", 0) for m in meals)
+    total_proteins = sum(m.get("total_proteins", 0) for m in meals)
+    total_carbs = sum(m.get("total_carbs", 0) for m in meals)
+    total_fats = sum(m.get("total_fats", 0) for m in meals)
+    user_data = await db.users.find_one({"id": user["id"]}, {"_id": 0})
+    daily_goal = user_data.get("daily_goal", {"calories": 2000, "proteins": 50.0, "carbs": 250.0, "fats": 65.0})
+    return {
+        "date": today,
+        "meals_count": len(meals),
+        "consumed": {
+            "calories": total_calories,
+            "proteins": round(total_proteins, 1),
+            "carbs": round(total_carbs, 1),
+            "fats": round(total_fats, 1)
+        },
+        "goal": daily_goal,
+        "remaining": {
+            "calories": max(0, daily_goal["calories"] - total_calories),
+            "proteins": max(0, round(daily_goal["proteins"] - total_proteins, 1)),
+            "carbs": max(0, round(daily_goal["carbs"] - total_carbs, 1)),
+            "fats": max(0, round(daily_goal["fats"] - total_fats, 1))
+        }
+    }
+
+
+def make_meal(user_id, created_at):
+    foods = [
+        {"name": f"aliment {i}", "quantity": "100g", "calories": 120, "proteins": 4.5, "carbs": 15.2, "fats": 3.1}
+        for i in range(6)
+    ]
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "foods": foods,
+        "total_calories": 720,
+        "total_proteins": 27.0,
+        "total_carbs": 91.2,
+        "total_fats": 18.6,
+        "meal_type": "repas",
+        "analysis_text": "Repas équilibré composé de plusieurs aliments. " * 10,
+        "created_at": created_at.isoformat()
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="beautyfit_bench")
+    parser.add_argument("--today-meals", type=int, default=80)
+    parser.add_argument("--history-meals", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    args = parser.parse_args()
+
+    server.db = server.client[args.db]
+    db = server.db
+    await server.ensure_indexes(db)
+
+    user = {"id": f"bench_{uuid.uuid4().hex[:8]}", "email": "bench@example.com", "daily_goal": {
+        "calories": 1800, "proteins": 90.0, "carbs": 200.0, "fats": 60.0
+    }}
+    await db.users.insert_one(dict(user))
+
+    now = datetime.now(timezone.utc)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    meals = [make_meal(user["id"], midnight + (now - midnight) * (i / args.today_meals)) for i in range(args.today_meals)]
+    meals += [make_meal(user["id"], now - timedelta(days=1 + i % 365)) for i in range(args.history_meals)]
+    await db.meal_history.insert_many(meals)
+
+    try:
+        # No rollups yet, so get_today_summary falls back to the aggregation
+        legacy = await legacy_today_summary(user)
+        aggregated = await server.get_today_summary(user)
+        assert legacy == aggregated, f"payload mismatch:\n{legacy}\n{aggregated}"
+        summarize("python summing (legacy)", await time_async(lambda: legacy_today_summary(user), args.iterations))
+        summarize("server-side aggregation", await time_async(lambda: server.get_today_summary(user), args.iterations))
+
+        # A full rebuild (the scratch database only holds this user) marks rollups as trusted
+        await nutrition_rollups.rebuild_rollups(db)
+        nutrition_rollups.reset_backfill_state()
+        rolled_up = await server.get_today_summary(user)
+        assert legacy == rolled_up, f"payload mismatch:\n{legacy}\n{rolled_up}"
+        summarize("daily_nutrition rollup", await time_async(lambda: server.get_today_summary(user), args.iterations))
+        print(f"\npayloads identical ({args.today_meals} meals today, {args.history_meals} older)")
+    finally:
+        if args.keep:
+            print(f"scratch data kept in database {args.db}")
+        else:
+            await server.client.drop_database(args.db)
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
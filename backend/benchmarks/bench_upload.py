@@ -0,0 +1,79 @@
+"""
+Benchmark: streaming upload pipeline vs the previous shutil.copyfileobj copy.
+
+Writes a source file of --size-mb (1 GB by default), wraps it in a Starlette
+UploadFile the way a parsed multipart body arrives, and stores it with both
+implementations. Alongside throughput it reports the worst event-loop stall
+seen by a 10 ms ticker, which is what other requests on the worker feel.
+
+    cd backend && python benchmarks/bench_upload.py --size-mb 1024
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from common import BACKEND_DIR  # noqa: F401  (puts the backend on sys.path)
+
+from fastapi import UploadFile
+from media_uploads import store_upload
+
+
+async def loop_stall_probe(stop: asyncio.Event, interval: float = 0.01):
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst * 1000
+
+
+async def legacy_store(upload: UploadFile, dest: Path):
+    with open(dest, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
+
+async def measure(name, store, source: Path, size_bytes: int):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_stall_probe(stop))
+    with open(source, "rb") as fh:
+        upload = UploadFile(file=fh, filename=source.name, size=size_bytes)
+        start = time.perf_counter()
+        await store(upload)
+        elapsed = time.perf_counter() - start
+    stop.set()
+    stall_ms = await probe
+    print(f"{name:<28} {size_bytes / elapsed / 1024 ** 2:8.1f} MB/s  {elapsed:7.2f} s  worst loop stall {stall_ms:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--dir", default=None, help="scratch directory (defaults to a temp dir)")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(dir=args.dir))
+    source = work_dir / "source.mp4"
+    size_bytes = args.size_mb * 1024 ** 2
+    try:
+        with open(source, "wb") as fh:
+            block = os.urandom(1024 ** 2)
+            for _ in range(args.size_mb):
+                fh.write(block)
+
+        await measure("shutil.copyfileobj (legacy)", lambda u: legacy_store(u, work_dir / "legacy.mp4"), source, size_bytes)
+        await measure(
+            "store_upload (streaming)",
+            lambda u: store_upload(u, work_dir, "streamed.mp4", max_bytes=size_bytes),
+            source,
+            size_bytes
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""Shared helpers for the benchmark scripts in this folder."""
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Benchmarks import the backend modules (server.py and friends) directly
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name, samples_ms):
+    """Print one aligned result line and return the stats as a dict"""
+    stats = {
+        "n": len(samples_ms),
+        "mean": statistics.fmean(samples_ms),
+        "p50": percentile(samples_ms, 50),
+        "p95": percentile(samples_ms, 95),
+        "max": max(samples_ms),
+    }
+    print(
+        f"{name:<32} n={stats['n']:<6} mean={stats['mean']:9.3f} ms  "
+        f"p50={stats['p50']:9.3f} ms  p95={stats['p95']:9.3f} ms  max={stats['max']:9.3f} ms"
+    )
+    return stats
+
+
+async def time_async(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
@@ -0,0 +1,185 @@
+"""In-process caches shared by the API routes."""
+import asyncio
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds.
+
+    Safe to share between the event loop and worker threads. Hit, miss and
+    eviction counters are kept so the effect of the cache can be checked in
+    production through `stats()`.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches; returns how many were dropped"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class ResponseCache:
+    """Serialized response bodies and their strong ETags, keyed by request URL.
+
+    Meant for public, read-mostly routes: the body is rendered once and then
+    served as-is (or answered with 304) until it expires or is invalidated.
+    Concurrent misses for one key share a single render instead of all
+    querying the database at once when an entry expires under load.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._building: Dict[str, asyncio.Future] = {}
+        # Bumped by clear(): a render that started before it is not stored
+        self._generation = 0
+        self.builds = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        return self._cache.get(key)
+
+    async def get_or_build(self, key: str, build: Callable[[], Awaitable[bytes]]) -> CachedResponse:
+        """The entry for `key`, rendered by `build` on a miss; one render per key at a time"""
+        while True:
+            entry = self._cache.get(key)
+            if entry is not None:
+                return entry
+            pending = self._building.get(key)
+            if pending is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The request rendering it went away: the next waiter renders instead
+
+        future = asyncio.get_running_loop().create_future()
+        # Errors reach the waiters; without any, the exception must not be reported as lost
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._building[key] = future
+        generation = self._generation
+        try:
+            body = await build()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if self._building.get(key) is future:
+                del self._building[key]
+        self.builds += 1
+        entry = CachedResponse(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        if generation == self._generation:
+            self._cache.set(key, entry)
+        future.set_result(entry)
+        return entry
+
+    async def serve(self, request: Request, build: Callable[[], Awaitable[Any]], cache_control: str) -> Response:
+        """A JSON response for `request`, or 304 when If-None-Match has its ETag
+
+        `build` is only awaited on a cache miss and returns the JSON-compatible
+        payload the route would normally return.
+        """
+        async def render() -> bytes:
+            return JSONResponse(content=jsonable_encoder(await build())).body
+
+        key = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        entry = await self.get_or_build(key, render)
+        headers = {"ETag": entry.etag, "Cache-Control": cache_control}
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._building.clear()
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "builds": self.builds, "coalesced": self.coalesced}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against `etag` (RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
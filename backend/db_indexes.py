@@ -0,0 +1,176 @@
+"""Declarative MongoDB index registry.
+
+`INDEX_REGISTRY` lists every index the API relies on, per collection. At
+startup `ensure_indexes` creates whatever is missing, and `verify_indexes`
+reports missing, mismatched and extra indexes so a cluster can be checked
+before it takes traffic:
+
+    python db_indexes.py            # report only, exit code 1 if anything is missing
+    python db_indexes.py --ensure   # create missing indexes, then report
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Unique indexes on optional fields only cover documents where the field is set
+_IS_STRING = {"$type": "string"}
+
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True,
+                   partialFilterExpression={"email": _IS_STRING}),
+        IndexModel([("apple_user_id", ASCENDING)], name="apple_user_id_unique", unique=True,
+                   partialFilterExpression={"apple_user_id": _IS_STRING}),
+    ],
+    "courses": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("category", ASCENDING)], name="category"),
+    ],
+    "purchases": [
+        IndexModel([("user_id", ASCENDING), ("course_id", ASCENDING), ("status", ASCENDING)],
+                   name="user_course_status"),
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True,
+                   partialFilterExpression={"session_id": _IS_STRING}),
+        # One purchase per provider transaction (fulfillment.PurchaseFulfillment upserts on it)
+        IndexModel([("payment_method", ASCENDING), ("external_id", ASCENDING)],
+                   name="payment_method_external_id_unique", unique=True,
+                   partialFilterExpression={"external_id": _IS_STRING}),
+    ],
+    "payment_events": [
+        IndexModel([("provider", ASCENDING), ("event_id", ASCENDING)], name="provider_event_id_unique", unique=True),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+    "meal_history": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Keyset pagination sorts on (created_at, id) within a user
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="user_created_at_id"),
+    ],
+    "daily_nutrition": [
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], name="user_day_unique", unique=True),
+    ],
+    "sessions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("completed_at", DESCENDING), ("id", DESCENDING)],
+                   name="user_completed_at_id"),
+    ],
+    "password_resets": [
+        # Reset codes are looked up on their own, so one code must never belong to two emails
+        IndexModel([("token", ASCENDING)], name="token_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email"),
+        # Mongo's TTL monitor only expires documents whose field is a BSON date
+        IndexModel([("expires", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "llm_analysis_cache": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+        IndexModel([("last_used_at", ASCENDING)], name="last_used_at"),
+    ],
+    "analysis_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "email_outbox": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("claim", ASCENDING)], name="claim", sparse=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "webhook_inbox": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Redeliveries of an event are stored once
+        IndexModel([("provider", ASCENDING), ("event_id", ASCENDING)], name="provider_event_id_unique", unique=True),
+        # The consumer looks for the oldest unfinished event of each ordering key
+        IndexModel([("status", ASCENDING), ("ordering_key", ASCENDING), ("received_at", ASCENDING)],
+                   name="status_ordering_key_received_at"),
+        IndexModel([("claim", ASCENDING)], name="claim", sparse=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+    ],
+    "site_content": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+}
+
+# Options that make two indexes with the same keys behave differently
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _normalize(spec: Dict[str, Any]) -> Dict[str, Any]:
+    key = spec["key"]
+    key = list(key.items()) if hasattr(key, "items") else list(key)
+    normalized = {"key": [[field, direction] for field, direction in key]}
+    for option in _COMPARED_OPTIONS:
+        if spec.get(option) not in (None, False):
+            normalized[option] = spec[option]
+    return json.loads(json.dumps(normalized, default=str))
+
+
+async def verify_indexes(db) -> Dict[str, Any]:
+    """Compare the live indexes with INDEX_REGISTRY, collection by collection"""
+    report = {"ok": True, "collections": {}}
+    for collection, models in INDEX_REGISTRY.items():
+        existing = await db[collection].index_information()
+        existing.pop("_id_", None)
+        expected = {m.document["name"]: _normalize(m.document) for m in models}
+
+        missing = [name for name in expected if name not in existing]
+        mismatched = [
+            name for name in expected
+            if name in existing and _normalize(existing[name]) != expected[name]
+        ]
+        extra = [name for name in existing if name not in expected]
+
+        report["collections"][collection] = {"missing": missing, "mismatched": mismatched, "extra": extra}
+        if missing or mismatched:
+            report["ok"] = False
+    return report
+
+
+async def ensure_indexes(db) -> Dict[str, Any]:
+    """Create every registered index; failures are collected, not raised"""
+    created, errors = [], {}
+    for collection, models in INDEX_REGISTRY.items():
+        for model in models:
+            name = model.document["name"]
+            try:
+                await db[collection].create_indexes([model])
+                created.append(f"{collection}.{name}")
+            except OperationFailure as e:
+                # Typically duplicate data under a unique index, or an existing
+                # index with the same name but different options
+                errors[f"{collection}.{name}"] = str(e)
+                logger.error(f"Could not create index {collection}.{name}: {e}")
+    return {"ensured": created, "errors": errors}
+
+
+async def _main(argv: List[str]) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if "--ensure" in argv:
+            print(json.dumps(await ensure_indexes(db), indent=2))
+        report = await verify_indexes(db)
+        print(json.dumps(report, indent=2))
+        return 0 if report["ok"] else 1
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,287 @@
+"""Transactional email outbox.
+
+Request handlers never call the email API themselves: `EmailOutbox.enqueue`
+writes the message to the `email_outbox` collection and returns. A background
+sender task drains the collection:
+
+- it claims up to `batch_size` due messages at a time under a lease, so
+  several API replicas can drain the same outbox,
+- sends them in one provider call, paced by a token-bucket rate limit,
+- retries transient failures with exponential backoff and jitter,
+- dead-letters messages that fail permanently or run out of attempts
+  (status "dead", kept with their last error; `requeue_dead` sends them again).
+
+Claims, leases, backoff and the sender loop come from `leased_queue`.
+Delivery is at least once: a message whose sender died after the provider
+accepted it is sent again when its lease expires. Sent messages drop their
+body and expire after `retention_seconds` through a TTL index on `expires_at`.
+"""
+import abc
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from leased_queue import LeasedConsumer, PermanentError
+from timestamps import utc_now
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+
+
+class PermanentEmailError(PermanentError):
+    """Raised by a sender when retrying the message cannot succeed."""
+
+
+def new_message(to: List[str], subject: str, html: str, text: Optional[str] = None,
+                kind: str = "transactional") -> Dict[str, Any]:
+    now = utc_now()
+    return {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "to": to,
+        "subject": subject,
+        "html": html,
+        "text": text,
+        "status": PENDING,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "last_error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class RateLimiter:
+    """Token bucket: `rate` acquisitions per second on average, bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waited_seconds = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+                self.waited_seconds += delay
+                await asyncio.sleep(delay)
+
+
+class EmailSender(abc.ABC):
+    """Interface shared by the delivery backends"""
+
+    name = "base"
+    max_batch_size = 100
+
+    @abc.abstractmethod
+    async def send_batch(self, messages: List[Dict[str, Any]]) -> None:
+        """Deliver every message or raise (PermanentEmailError when retrying is pointless)"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name}
+
+
+class ResendEmailSender(EmailSender):
+    """Resend, one API call per batch; the SDK is synchronous, so calls run on a worker thread"""
+
+    name = "resend"
+    max_batch_size = 100  # Resend's batch endpoint limit
+
+    def __init__(self, api_key: str, from_address: str):
+        import resend
+        resend.api_key = api_key
+        self._resend = resend
+        self.from_address = from_address
+
+    def _params(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        params = {"from": self.from_address, "to": message["to"], "subject": message["subject"],
+                  "html": message["html"]}
+        if message.get("text"):
+            params["text"] = message["text"]
+        return params
+
+    async def send_batch(self, messages: List[Dict[str, Any]]) -> None:
+        params = [self._params(message) for message in messages]
+        try:
+            if len(params) == 1:
+                await asyncio.to_thread(self._resend.Emails.send, params[0])
+            else:
+                await asyncio.to_thread(self._resend.Batch.send, params)
+        except self._resend.exceptions.ResendError as e:
+            try:
+                status = int(getattr(e, "code", 0))
+            except (TypeError, ValueError):
+                status = 0
+            # Validation and auth errors will fail again; 429 and 5xx are worth a retry
+            if 400 <= status < 500 and status != 429:
+                raise PermanentEmailError(str(e)) from e
+            raise
+
+
+class FakeEmailSender(EmailSender):
+    """In-memory stand-in for Resend in tests and local runs without an API key
+
+    `fail_times` transient errors are raised before anything is delivered,
+    and messages to an address in `reject` fail permanently.
+    """
+
+    name = "fake"
+
+    def __init__(self, fail_times: int = 0, reject: Optional[List[str]] = None,
+                 latency: float = 0.0, max_batch_size: int = 100, keep: int = 1000):
+        self.fail_times = fail_times
+        self.reject = set(reject or [])
+        self.latency = latency
+        self.max_batch_size = max_batch_size
+        self.sent = deque(maxlen=keep)
+        self.calls = 0
+        self.batches = 0
+
+    async def send_batch(self, messages: List[Dict[str, Any]]) -> None:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise ConnectionError("Fake transient failure")
+        for message in messages:
+            rejected = self.reject.intersection(message["to"])
+            if rejected:
+                raise PermanentEmailError(f"Recipient rejected: {', '.join(sorted(rejected))}")
+        self.batches += 1
+        self.sent.extend(messages)
+        for message in messages:
+            logger.info(f"Fake email to {', '.join(message['to'])}: {message['subject']}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "calls": self.calls, "batches": self.batches, "sent": len(self.sent)}
+
+
+class EmailOutbox(LeasedConsumer):
+    pending_status = PENDING
+    processing_status = SENDING
+    dead_status = DEAD
+    interrupted_error = "Envoi interrompu"
+    name = "Email outbox"
+
+    def __init__(self, collection, sender: EmailSender, batch_size: int = 50, max_attempts: int = 6,
+                 retry_base_seconds: float = 30, retry_max_seconds: float = 3600,
+                 rate_per_second: float = 2.0, lease_seconds: int = 120, poll_interval: float = 5.0,
+                 retention_seconds: int = 7 * 24 * 3600):
+        super().__init__(collection, max_attempts, poll_interval=poll_interval, lease_seconds=lease_seconds,
+                         retry_base_seconds=retry_base_seconds, retry_max_seconds=retry_max_seconds)
+        self.sender = sender
+        self.batch_size = max(1, min(batch_size, sender.max_batch_size))
+        self.limiter = RateLimiter(rate_per_second)
+        self.retention = timedelta(seconds=retention_seconds)
+        self.enqueued = 0
+        self.batches = 0
+        self.sent = 0
+        self.retried = 0
+
+    async def enqueue(self, to: List[str], subject: str, html: str, text: Optional[str] = None,
+                      kind: str = "transactional") -> str:
+        message = new_message(to, subject, html, text, kind)
+        await self.collection.insert_one(message)
+        self.enqueued += 1
+        self.notify()
+        return message["id"]
+
+    async def claim_batch(self) -> List[Dict[str, Any]]:
+        """Lease up to `batch_size` due messages; safe against concurrent senders"""
+        now = utc_now()
+        await self.expire_leases(now)
+        due = {"status": PENDING, "next_attempt_at": {"$lte": now}}
+        candidates = await self.collection.find(due, {"_id": 0, "id": 1}) \
+            .sort("next_attempt_at", 1).to_list(self.batch_size)
+        if not candidates:
+            return []
+        return await self.claim_ids(due, [candidate["id"] for candidate in candidates], now)
+
+    async def _mark_sent(self, batch: List[Dict[str, Any]]) -> None:
+        now = utc_now()
+        self.sent += await self.release(batch, {
+            "status": SENT, "sent_at": now, "updated_at": now, "expires_at": now + self.retention,
+            "html": None, "text": None,
+        })
+
+    async def _mark_failed(self, message: Dict[str, Any], error: str, permanent: bool) -> None:
+        now = utc_now()
+        fields = {"last_error": error[:500], "updated_at": now}
+        if permanent or message["attempts"] >= self.max_attempts:
+            fields["status"] = DEAD
+            self.dead += 1
+            logger.error(f"Email {message['id']} dead-lettered after {message['attempts']} attempts: {error}")
+        else:
+            delay = self.retry_delay(message["attempts"])
+            fields.update(status=PENDING, next_attempt_at=now + timedelta(seconds=delay))
+            self.retried += 1
+        await self.release([message], fields)
+
+    async def process(self, batch: List[Dict[str, Any]]) -> None:
+        await self.send(batch)
+
+    async def send(self, batch: List[Dict[str, Any]]) -> None:
+        """Deliver a claimed batch and record the outcome of every message"""
+        await self.limiter.acquire()
+        self.batches += 1
+        try:
+            await self.sender.send_batch(batch)
+        except PermanentEmailError as e:
+            if len(batch) > 1:
+                # One bad recipient fails the whole batch: send one by one to isolate it
+                for message in batch:
+                    await self.send([message])
+                return
+            await self._mark_failed(batch[0], str(e), permanent=True)
+        except Exception as e:
+            logger.warning(f"Email batch of {len(batch)} failed, will retry: {e}")
+            for message in batch:
+                await self._mark_failed(message, str(e), permanent=False)
+        else:
+            await self._mark_sent(batch)
+
+    async def requeue_dead(self, message_ids: Optional[List[str]] = None) -> int:
+        """Give dead-lettered messages a fresh set of attempts"""
+        query = {"status": DEAD}
+        if message_ids:
+            query["id"] = {"$in": message_ids}
+        now = utc_now()
+        result = await self.collection.update_many(
+            query,
+            {"$set": {"status": PENDING, "attempts": 0, "next_attempt_at": now, "updated_at": now}}
+        )
+        if result.modified_count:
+            self.notify()
+        return result.modified_count
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sender": self.sender.stats(),
+            "batch_size": self.batch_size,
+            "enqueued": self.enqueued,
+            "batches": self.batches,
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead": self.dead,
+            "rate_limit_wait_seconds": round(self.limiter.waited_seconds, 3),
+        }
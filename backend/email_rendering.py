@@ -0,0 +1,143 @@
+"""Transactional email templates.
+
+Emails are Jinja2 templates in `templates/email/` (`<name>.html`, extending
+`base.html`, with a `subject` block). `EmailTemplates.load()` compiles them all
+once at startup: Jinja turns the static markup into constant strings in the
+compiled code, so a send only evaluates the variable parts.
+
+The plain-text alternative is generated from the HTML template *source* at
+load time: markup is converted to text while `{{ ... }}` and `{% ... %}` tags
+are kept, and the result is compiled as `<name>.txt`. Sending therefore never
+parses HTML. A hand-written `<name>.txt` next to the HTML takes precedence.
+Jinja tags inside HTML attributes have no text equivalent and are dropped.
+"""
+import re
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from jinja2 import ChoiceLoader, DictLoader, Environment, FileSystemLoader, StrictUndefined, select_autoescape
+
+from timestamps import utc_now
+
+# Jinja tags are swapped for placeholders so `<` or `>` in an expression never reaches the HTML parser
+_JINJA_TAG = re.compile(r"\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}", re.S)
+_PLACEHOLDER = re.compile("\x00(\\d+)\x00")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+_BLOCK_TAGS = {"p", "div", "h1", "h2", "h3", "h4", "table", "tr", "ul", "ol", "section", "header", "footer"}
+_SKIP_TAGS = {"style", "script", "head", "title"}
+
+
+class RenderedEmail(NamedTuple):
+    subject: str
+    html: str
+    text: str
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip = 0
+        self._links: List[Optional[str]] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag == "hr":
+            self.parts.append("\n----------\n")
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n\n")
+        elif tag == "a":
+            self._links.append(dict(attrs).get("href"))
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n\n")
+        elif tag == "a" and self._links:
+            href = self._links.pop()
+            if href and not href.startswith("mailto:"):
+                self.parts.append(f" ({href})")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(re.sub(r"\s+", " ", data))
+
+
+def html_to_text(source: str) -> str:
+    """Plain-text version of HTML (or of an HTML template, keeping its Jinja tags)"""
+    tags: List[str] = []
+
+    def stash(match):
+        tags.append(match.group(0))
+        return f"\x00{len(tags) - 1}\x00"
+
+    extractor = _TextExtractor()
+    extractor.feed(_JINJA_TAG.sub(stash, source))
+    extractor.close()
+    text = "".join(extractor.parts)
+    lines = [line.strip() for line in text.splitlines()]
+    text = _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip() + "\n"
+    text = _PLACEHOLDER.sub(lambda match: tags[int(match.group(1))], text)
+    # Layouts and includes point at the generated text versions
+    return re.sub(r"""(\{%-?\s*(?:extends|include|import|from)\s+["'][^"']+)\.html(["'])""", r"\1.txt\2", text)
+
+
+class EmailTemplates:
+    def __init__(self, directory: Path, static_context: Optional[Dict[str, Any]] = None):
+        self.directory = Path(directory)
+        self._text_sources: Dict[str, str] = {}
+        self.env = Environment(
+            # Hand-written .txt files win over the generated ones
+            loader=ChoiceLoader([FileSystemLoader(str(self.directory)), DictLoader(self._text_sources)]),
+            autoescape=select_autoescape(enabled_extensions=("html",), default_for_string=False),
+            undefined=StrictUndefined,
+            auto_reload=False,
+            cache_size=-1,
+            trim_blocks=True,
+            lstrip_blocks=True,
+            keep_trailing_newline=False,
+        )
+        self.env.globals.update(static_context or {})
+        self.loaded = False
+        self.renders = 0
+
+    def names(self) -> List[str]:
+        return sorted(path.stem for path in self.directory.glob("*.html") if path.stem != "base")
+
+    def load(self) -> int:
+        """Generate the text versions and compile every template; returns how many were compiled"""
+        for path in self.directory.glob("*.html"):
+            if not (self.directory / f"{path.stem}.txt").exists():
+                self._text_sources[f"{path.stem}.txt"] = html_to_text(path.read_text(encoding="utf-8"))
+        compiled = 0
+        for name in self.env.list_templates(extensions=["html", "txt"]):
+            self.env.get_template(name)
+            compiled += 1
+        self.loaded = True
+        return compiled
+
+    def render(self, name: str, **context: Any) -> RenderedEmail:
+        if not self.loaded:
+            self.load()
+        # Per message, not in the static context: a process running over New Year keeps the footer current
+        context = {"year": utc_now().year, **context}
+        html_template = self.env.get_template(f"{name}.html")
+        subject = "".join(html_template.blocks["subject"](html_template.new_context(context))).strip()
+        self.renders += 1
+        return RenderedEmail(
+            subject=subject,
+            html=html_template.render(context),
+            # Empty blocks leave blank lines behind
+            text=_BLANK_LINES.sub("\n\n", self.env.get_template(f"{name}.txt").render(context)).strip() + "\n",
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"templates": self.names(), "renders": self.renders}
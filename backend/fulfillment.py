@@ -0,0 +1,191 @@
+"""Idempotent purchase fulfillment.
+
+Every payment path (Stripe status polling, Stripe webhooks, Apple IAP
+verification) grants access through `PurchaseFulfillment`, never by inserting
+into `purchases` itself.
+
+- A purchase is keyed by (payment_method, external_id): the Stripe checkout
+  session id or the Apple transaction id. `upsert_purchase` is a single
+  `find_one_and_update(upsert=True)` with `$setOnInsert`, backed by a unique
+  index, so concurrent duplicates (a webhook racing the success page's status
+  poll, a retried request) all end up with the same purchase.
+- Every provider event is logged in `payment_events`, unique on
+  (provider, event_id). An event that was already processed is answered
+  from the log without touching purchases or calling the provider again.
+  An event whose earlier delivery never finished is processed again; the
+  upsert keeps that safe.
+
+Purchases written before external_id existed are found through their legacy
+id field (session_id / apple_transaction_id). Backfill them once with:
+
+    python fulfillment.py --backfill
+"""
+import argparse
+import asyncio
+import logging
+import os
+import uuid
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from timestamps import utc_now
+
+logger = logging.getLogger(__name__)
+
+PROCESSING = "processing"
+DONE = "done"
+
+# payment_method -> field that held the provider's id before external_id
+LEGACY_ID_FIELDS = {
+    "stripe": "session_id",
+    "apple_iap": "apple_transaction_id",
+}
+
+
+class Fulfillment(NamedTuple):
+    purchase_id: Optional[str]
+    created: bool  # this call inserted the purchase
+    replayed: bool  # the event was already processed, nothing was done
+
+
+class PurchaseFulfillment:
+    def __init__(self, purchases, events):
+        self.purchases = purchases
+        self.events = events
+        self.events_logged = 0
+        self.replays = 0
+        self.created = 0
+        self.duplicates = 0
+        self.races = 0
+
+    async def begin_event(self, provider: str, event_id: str, event_type: str,
+                          external_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Log a provider event; returns its record when it was already processed"""
+        now = utc_now()
+        try:
+            await self.events.insert_one({
+                "provider": provider,
+                "event_id": event_id,
+                "event_type": event_type,
+                "external_id": external_id,
+                "status": PROCESSING,
+                "deliveries": 1,
+                "received_at": now,
+                "last_received_at": now,
+            })
+            self.events_logged += 1
+            return None
+        except DuplicateKeyError:
+            record = await self.events.find_one_and_update(
+                {"provider": provider, "event_id": event_id},
+                {"$inc": {"deliveries": 1}, "$set": {"last_received_at": now}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+        if record and record.get("status") == DONE:
+            self.replays += 1
+            return record
+        # The earlier delivery failed or is still running: process it again
+        return None
+
+    async def finish_event(self, provider: str, event_id: str, outcome: str,
+                           purchase_id: Optional[str] = None) -> None:
+        query = {"provider": provider, "event_id": event_id}
+        if outcome != "fulfilled":
+            # Concurrent deliveries of one event: the one that created the purchase keeps its outcome
+            query["status"] = PROCESSING
+        await self.events.update_one(
+            query,
+            {"$set": {"status": DONE, "outcome": outcome, "purchase_id": purchase_id,
+                      "processed_at": utc_now()}},
+        )
+
+    async def upsert_purchase(self, provider: str, external_id: str,
+                              fields: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """The purchase for (provider, external_id), inserted with `fields` if new; returns (purchase, created)"""
+        purchase_id = str(uuid.uuid4())
+        key = {"payment_method": provider, "external_id": external_id}
+        try:
+            purchase = await self.purchases.find_one_and_update(
+                key,
+                {"$setOnInsert": {**fields, "id": purchase_id, "status": "completed", "created_at": utc_now()}},
+                upsert=True,
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Lost a concurrent upsert, or a legacy purchase holds the same session_id
+            self.races += 1
+            legacy_field = LEGACY_ID_FIELDS.get(provider)
+            query = {"payment_method": provider, "$or": [{"external_id": external_id}]}
+            if legacy_field:
+                query["$or"].append({legacy_field: external_id})
+            purchase = await self.purchases.find_one(query, {"_id": 0})
+            if purchase is None:
+                raise
+        created = purchase["id"] == purchase_id
+        if created:
+            self.created += 1
+        else:
+            self.duplicates += 1
+        return purchase, created
+
+    async def fulfill(self, provider: str, external_id: str, fields: Dict[str, Any],
+                      event_id: Optional[str] = None, event_type: str = "purchase") -> Fulfillment:
+        """Grant a purchase once per (provider, external_id), logging the event that triggered it"""
+        if event_id:
+            record = await self.begin_event(provider, event_id, event_type, external_id)
+            if record:
+                return Fulfillment(record.get("purchase_id"), created=False, replayed=True)
+        purchase, created = await self.upsert_purchase(provider, external_id, fields)
+        if event_id:
+            await self.finish_event(provider, event_id, "fulfilled" if created else "duplicate", purchase["id"])
+        return Fulfillment(purchase["id"], created=created, replayed=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "events_logged": self.events_logged,
+            "replays": self.replays,
+            "created": self.created,
+            "duplicates": self.duplicates,
+            "races": self.races,
+        }
+
+
+async def backfill_external_ids(purchases) -> Dict[str, int]:
+    """Copy legacy provider ids into external_id so the unique key covers old purchases"""
+    updated = {}
+    for provider, legacy_field in LEGACY_ID_FIELDS.items():
+        result = await purchases.update_many(
+            {"payment_method": provider, "external_id": {"$exists": False}, legacy_field: {"$type": "string"}},
+            [{"$set": {"external_id": f"${legacy_field}"}}],
+        )
+        updated[provider] = result.modified_count
+    return updated
+
+
+async def _main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Purchase fulfillment maintenance")
+    parser.add_argument("--backfill", action="store_true", help="set external_id on legacy purchases")
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.error("nothing to do (use --backfill)")
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        updated = await backfill_external_ids(client[os.environ['DB_NAME']].purchases)
+        for provider, count in updated.items():
+            print(f"{provider}: {count} purchases backfilled")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
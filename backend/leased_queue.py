@@ -0,0 +1,187 @@
+"""Queues of leased documents in a MongoDB collection.
+
+The email outbox, the webhook inbox and the Mongo analysis job queue keep
+their work items in a collection and hand them to consumers the same way:
+
+- A consumer claims items by switching them to `processing_status` under a
+  random claim token and a `lease_until` deadline. The status check in the
+  update makes an item go to one consumer only.
+- Outcomes are written with `release`, which matches on the claim token: a
+  consumer whose lease expired cannot overwrite the work of the one that
+  took the item over. `renew` pushes the deadline of items still in hand.
+- Items whose lease expired (their consumer died) go back to
+  `pending_status`, or are given up on once they used `max_attempts`.
+- Failed items are retried after `retry_delay`, exponential backoff with jitter.
+
+`LeasedConsumer` adds the background loop that claims and processes
+batches, woken early by `notify` when new work arrives.
+"""
+import abc
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from timestamps import utc_now
+
+logger = logging.getLogger(__name__)
+
+# Fields dropped when an item leaves a consumer's hands
+RELEASED = {"lease_until": "", "claim": ""}
+
+
+class PermanentError(Exception):
+    """Raised by a handler for an item that no retry can process."""
+
+
+def retry_delay(attempts: int, base_seconds: float, max_seconds: float) -> float:
+    """Exponential backoff with jitter: about base * 2^(attempts-1), capped"""
+    delay = min(max_seconds, base_seconds * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class LeasedQueue:
+    """Claims, lease expiry and outcomes of the items in `collection`"""
+
+    pending_status = "pending"
+    processing_status = "processing"
+    dead_status = "dead"
+    error_field = "last_error"
+    interrupted_error = "Traitement interrompu"
+
+    def __init__(self, collection, max_attempts: int, lease_seconds: int = 120,
+                 retry_base_seconds: float = 10, retry_max_seconds: float = 1800):
+        self.collection = collection
+        self.max_attempts = max_attempts
+        self.lease = timedelta(seconds=lease_seconds)
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._next_lease_check: Optional[datetime] = None
+        self.requeued = 0
+        self.dead = 0
+
+    def _requeue_fields(self, now: datetime) -> Dict[str, Any]:
+        return {"status": self.pending_status, "next_attempt_at": now, "updated_at": now}
+
+    def _dead_fields(self, now: datetime) -> Dict[str, Any]:
+        return {"status": self.dead_status, self.error_field: self.interrupted_error, "updated_at": now}
+
+    async def expire_leases(self, now: datetime) -> None:
+        """Requeue the items of consumers that died, or give up on them; runs at most every lease/4"""
+        if self._next_lease_check is not None and now < self._next_lease_check:
+            return
+        self._next_lease_check = now + self.lease / 4
+        expired = {"status": self.processing_status, "lease_until": {"$lt": now}}
+        result = await self.collection.update_many(
+            {**expired, "attempts": {"$lt": self.max_attempts}},
+            {"$set": self._requeue_fields(now), "$unset": RELEASED}
+        )
+        self.requeued += result.modified_count
+        result = await self.collection.update_many(
+            expired, {"$set": self._dead_fields(now), "$unset": RELEASED}
+        )
+        self.dead += result.modified_count
+
+    def _claim_update(self, claim: str, now: datetime) -> Dict[str, Any]:
+        return {"$set": {"status": self.processing_status, "claim": claim, "lease_until": now + self.lease,
+                         "updated_at": now},
+                "$inc": {"attempts": 1}}
+
+    async def claim_ids(self, query: Dict[str, Any], ids: List[str], now: datetime) -> List[Dict[str, Any]]:
+        """Lease the items of `ids` that still match `query`; returns the ones this call got"""
+        claim = str(uuid.uuid4())
+        await self.collection.update_many({**query, "id": {"$in": ids}}, self._claim_update(claim, now))
+        return await self.collection.find({"claim": claim}, {"_id": 0}).to_list(len(ids))
+
+    async def claim_one(self, query: Dict[str, Any], sort: List[Tuple[str, int]], now: datetime,
+                        projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Lease the first item matching `query` in `sort` order, if any"""
+        return await self.collection.find_one_and_update(
+            query, self._claim_update(str(uuid.uuid4()), now), sort=sort,
+            projection={"_id": 0, **(projection or {})}, return_document=ReturnDocument.AFTER
+        )
+
+    async def renew(self, items: List[Dict[str, Any]]) -> int:
+        """Extend the lease of claimed items still in hand; returns how many were renewed"""
+        now = utc_now()
+        result = await self.collection.update_many(
+            {"claim": {"$in": list({item["claim"] for item in items})}, "status": self.processing_status},
+            {"$set": {"lease_until": now + self.lease, "updated_at": now}}
+        )
+        return result.modified_count
+
+    async def release(self, items: List[Dict[str, Any]], fields: Dict[str, Any]) -> int:
+        """Write the outcome of claimed items; those whose lease was lost are left alone"""
+        result = await self.collection.update_many(
+            {"claim": {"$in": list({item["claim"] for item in items})}, "id": {"$in": [item["id"] for item in items]}},
+            {"$set": fields, "$unset": RELEASED}
+        )
+        return result.modified_count
+
+    def retry_delay(self, attempts: int) -> float:
+        return retry_delay(attempts, self.retry_base_seconds, self.retry_max_seconds)
+
+
+class LeasedConsumer(LeasedQueue, abc.ABC):
+    """A `LeasedQueue` drained by one background task"""
+
+    name = "queue"
+
+    def __init__(self, collection, max_attempts: int, poll_interval: float = 5.0, **lease_options):
+        super().__init__(collection, max_attempts, **lease_options)
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @abc.abstractmethod
+    async def claim_batch(self) -> List[Dict[str, Any]]:
+        """Lease the next items due, or return an empty list"""
+
+    @abc.abstractmethod
+    async def process(self, batch: List[Dict[str, Any]]) -> None:
+        """Handle a claimed batch and release every item in it"""
+
+    async def drain(self) -> int:
+        """Process every item due now; returns how many were attempted"""
+        attempted = 0
+        while True:
+            batch = await self.claim_batch()
+            if not batch:
+                return attempted
+            attempted += len(batch)
+            await self.process(batch)
+
+    def notify(self) -> None:
+        """Wake the consumer up, new work is due"""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            # Cleared before looking, so work arriving during the claim is not missed
+            self._wakeup.clear()
+            try:
+                batch = await self.claim_batch()
+                if batch:
+                    await self.process(batch)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.name} consumer failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,259 @@
+"""Admission control and circuit breaking for LLM calls.
+
+When the provider slows down, analysis requests used to pile up on the event
+loop, each holding its decoded image, until memory ran out. Every call now
+goes through `LlmGuard`, which applies these checks in order:
+
+- a circuit breaker that fails fast once the error rate over a rolling
+  window crosses a threshold, then lets a single probe through after a
+  cooldown (half-open);
+- a per-user in-flight limit;
+- a global concurrency cap, with a bounded wait for a free slot;
+- admission by the breaker, once the call holds its slots, so the half-open
+  probe is never stuck in the queue while every other call is turned away;
+- a per-call timeout.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class LlmUnavailable(Exception):
+    """The call was not made or did not finish: breaker open, no free slot or timeout."""
+
+
+class CircuitOpen(LlmUnavailable):
+    pass
+
+
+class LlmBusy(LlmUnavailable):
+    pass
+
+
+class LlmTimeout(LlmUnavailable):
+    pass
+
+
+class UserBusy(Exception):
+    """The user already has the maximum number of LLM calls in flight."""
+
+
+class CircuitBreaker:
+    def __init__(self, error_rate: float = 0.5, min_calls: int = 10,
+                 window_seconds: float = 60, cooldown_seconds: float = 30):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened = 0
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+
+    def current_error_rate(self) -> float:
+        self._trim(time.monotonic())
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def rejecting(self) -> bool:
+        """Whether `allow` would refuse a call right now; admits nothing"""
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at < self.cooldown_seconds
+        return self.state == HALF_OPEN and self._probe_in_flight
+
+    def allow(self) -> Optional[str]:
+        """Admit a call: the state it was admitted under (HALF_OPEN for the probe), or None
+
+        Pass `was_probe=(admitted == HALF_OPEN)` back to `record`, or call
+        `release_probe` if the probe ends without reaching the provider.
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                return None
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                return None
+            self._probe_in_flight = True
+            return HALF_OPEN
+        return CLOSED
+
+    def release_probe(self) -> None:
+        """The probe never reached the provider: let the next call be the probe"""
+        self._probe_in_flight = False
+
+    def record(self, ok: bool, was_probe: bool = False) -> None:
+        """Outcome of a call, judged against the state it was admitted under"""
+        now = time.monotonic()
+        if was_probe:
+            self._probe_in_flight = False
+            if ok:
+                logger.info("LLM circuit closed after a successful probe")
+                self.state = CLOSED
+                self._outcomes.clear()
+            else:
+                self._open(now)
+            return
+        if self.state != CLOSED:
+            # Admitted before the breaker opened: only the probe decides from here
+            return
+
+        self._outcomes.append((now, ok))
+        self._trim(now)
+        failures = sum(1 for _, success in self._outcomes if not success)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        logger.warning(f"LLM circuit opened for {self.cooldown_seconds:g} s")
+        self.state = OPEN
+        self._opened_at = now
+        self.opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error_rate": round(self.current_error_rate(), 4),
+            "window_calls": len(self._outcomes),
+            "threshold": self.error_rate,
+            "opened": self.opened,
+        }
+
+
+class LlmGuard:
+    def __init__(self, max_concurrency: int = 8, per_user_limit: int = 2, call_timeout: float = 30,
+                 queue_timeout: float = 10, breaker: CircuitBreaker = None):
+        self.max_concurrency = max_concurrency
+        self.per_user_limit = per_user_limit
+        self.call_timeout = call_timeout
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._user_slots: Dict[str, asyncio.Semaphore] = {}
+        self._user_refs: Dict[str, int] = {}
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected_user = 0
+        self.rejected_busy = 0
+        self.short_circuited = 0
+        self.fallbacks = 0
+
+    async def _acquire_user(self, user_id: str, wait: bool) -> asyncio.Semaphore:
+        slot = self._user_slots.get(user_id)
+        if slot is None:
+            slot = self._user_slots[user_id] = asyncio.Semaphore(self.per_user_limit)
+        if slot.locked() and not wait:
+            self.rejected_user += 1
+            raise UserBusy(f"{user_id} already has {self.per_user_limit} LLM calls in flight")
+        # Counts holders and waiters, so idle users can be forgotten
+        self._user_refs[user_id] = self._user_refs.get(user_id, 0) + 1
+        try:
+            await slot.acquire()
+        except BaseException:
+            self._drop_user_ref(user_id)
+            raise
+        return slot
+
+    def _drop_user_ref(self, user_id: str) -> None:
+        self._user_refs[user_id] -= 1
+        if not self._user_refs[user_id]:
+            del self._user_refs[user_id]
+            del self._user_slots[user_id]
+
+    def _release_user(self, user_id: str, slot: asyncio.Semaphore) -> None:
+        slot.release()
+        self._drop_user_ref(user_id)
+
+    async def call(self, user_id: str, fn: Callable[[], Awaitable[T]], wait_for_user: bool = False) -> T:
+        """Run `fn()` under the guard
+
+        Interactive requests get UserBusy when the user is at their limit;
+        background work passes `wait_for_user=True` to queue behind it instead.
+        """
+        # Fail fast without queueing while the breaker is open
+        if self.breaker.rejecting():
+            self.short_circuited += 1
+            raise CircuitOpen("LLM circuit is open")
+
+        user_slot = await self._acquire_user(user_id, wait_for_user)
+        try:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_busy += 1
+                raise LlmBusy(f"No LLM slot free within {self.queue_timeout:g} s")
+            finally:
+                self.waiting -= 1
+
+            try:
+                # Admitted only with a slot in hand: the probe goes out at once
+                admitted = self.breaker.allow()
+                if admitted is None:
+                    self.short_circuited += 1
+                    raise CircuitOpen("LLM circuit is open")
+                was_probe = admitted == HALF_OPEN
+
+                self.in_flight += 1
+                self.calls += 1
+                outcome_recorded = False
+                try:
+                    result = await asyncio.wait_for(fn(), self.call_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    self.failures += 1
+                    outcome_recorded = True
+                    self.breaker.record(False, was_probe)
+                    raise LlmTimeout(f"LLM call exceeded {self.call_timeout:g} s")
+                except Exception:
+                    self.failures += 1
+                    outcome_recorded = True
+                    self.breaker.record(False, was_probe)
+                    raise
+                finally:
+                    self.in_flight -= 1
+                    if was_probe and not outcome_recorded:
+                        # Cancelled before the provider answered
+                        self.breaker.release_probe()
+                self.breaker.record(True, was_probe)
+                return result
+            finally:
+                self._slots.release()
+        finally:
+            self._release_user(user_id, user_slot)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "per_user_limit": self.per_user_limit,
+            "call_timeout": self.call_timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected_user": self.rejected_user,
+            "rejected_busy": self.rejected_busy,
+            "short_circuited": self.short_circuited,
+            "fallbacks": self.fallbacks,
+            "breaker": self.breaker.stats(),
+        }
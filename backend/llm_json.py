@@ -0,0 +1,95 @@
+"""Extraction of the JSON object from a chatty LLM completion.
+
+The model is asked for bare JSON but regularly wraps it in ```json fences,
+adds prose before or after it, or mentions braces in that prose. The old
+greedy `\\{[\\s\\S]*\\}` regex backtracked quadratically on long outputs and
+swallowed trailing braces from the prose. `extract_json_object` instead tries
+the C decoder at each candidate brace and, when that fails, scans forward
+once tracking string literals and nesting depth to find the balanced object
+(repairing trailing commas). It returns the first top-level object that
+parses, and gives up after a bounded number of candidates.
+"""
+import json
+import re
+from typing import Any, Optional
+
+# Give up after this many opening braces that never close or do not parse
+MAX_CANDIDATES = 8
+
+_STRUCTURAL_RE = re.compile(r'[{}"\\]')
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_NUMBER_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+_DECODER = json.JSONDecoder()
+
+
+def _balanced_end(text: str, start: int) -> int:
+    """Index just past the object opening at `start`, or -1 if it never closes"""
+    depth = 0
+    in_string = False
+    escaped_at = -1
+    # Jump between structural characters; everything else is skipped in C
+    for match in _STRUCTURAL_RE.finditer(text, start):
+        index = match.start()
+        if index == escaped_at:
+            continue
+        char = text[index]
+        if in_string:
+            if char == "\\":
+                escaped_at = index + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return -1
+
+
+def _loads(candidate: str) -> Any:
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        # Models sometimes leave a trailing comma after the last item
+        return json.loads(_TRAILING_COMMA_RE.sub(r"\1", candidate))
+
+
+def extract_json_object(text: str, required_key: Optional[str] = None) -> Optional[dict]:
+    """First balanced, parseable top-level JSON object in `text` (having `required_key`), or None"""
+    position = 0
+    for _ in range(MAX_CANDIDATES):
+        start = text.find("{", position)
+        if start == -1:
+            return None
+        try:
+            # Well-formed JSON: the C decoder finds the end of the object by itself
+            value, end = _DECODER.raw_decode(text, start)
+        except json.JSONDecodeError:
+            end = _balanced_end(text, start)
+            if end == -1:
+                # Unclosed brace (truncated output, or a stray brace in prose before the JSON)
+                position = start + 1
+                continue
+            try:
+                value = _loads(text[start:end])
+            except json.JSONDecodeError:
+                # Balanced but not JSON, e.g. "{portion moyenne}" in prose: resume after it
+                position = end
+                continue
+        # After an unclosed brace the next candidate may be a nested object of a truncated answer
+        if isinstance(value, dict) and (required_key is None or required_key in value):
+            return value
+        position = end
+    return None
+
+
+def coerce_number(value: Any) -> Any:
+    """'150 kcal' -> 150.0, '12,5 g' -> 12.5; anything else is returned unchanged"""
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value)
+        if match:
+            return float(match.group().replace(",", "."))
+    return value
@@ -0,0 +1,161 @@
+"""Pre-processing of meal photos before they are sent for analysis.
+
+Phone photos arrive at full resolution (often 3-6 MB once base64 encoded).
+Each one is decoded once on a small worker pool (Pillow releases the GIL while
+decoding and resampling), rotated according to its EXIF orientation, stripped
+of metadata, downsized to `max_edge` and re-encoded as JPEG or WebP. A 64-bit
+difference hash (dHash) of the result is computed in the same pass so later
+stages can spot near-identical photos without decoding again.
+"""
+import asyncio
+import base64
+import binascii
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, NamedTuple, Union
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+
+
+class InvalidImage(Exception):
+    """Raised when the payload cannot be decoded as an image."""
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    format: str
+    width: int
+    height: int
+    original_bytes: int
+    phash: str
+    elapsed_ms: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("ascii")
+
+
+def dhash(image: Image.Image, size: int = 8) -> str:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a tiny grayscale copy"""
+    pixels = list(image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def decode_base64(payload: str) -> bytes:
+    # Accept data URLs as well as bare base64
+    if payload.startswith("data:"):
+        payload = payload.partition(",")[2]
+    try:
+        return base64.b64decode(payload)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidImage(f"Invalid base64 image: {e}")
+
+
+class ImagePreprocessor:
+    def __init__(self, max_edge: int = 1024, fmt: str = "jpeg", quality: int = 85,
+                 max_workers: int = 2, max_pixels: int = 50_000_000):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported image format: {fmt}")
+        self.max_edge = max_edge
+        self.format = fmt
+        self.quality = quality
+        self.max_workers = max_workers
+        self.max_pixels = max_pixels
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="meal-image")
+        self.processed = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_ms = 0.0
+
+    def _prepare(self, source: Union[bytes, BinaryIO], original_bytes: int) -> PreparedImage:
+        start = time.perf_counter()
+        try:
+            image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+            if image.width * image.height > self.max_pixels:
+                raise InvalidImage(f"Image too large: {image.width}x{image.height}")
+            # For JPEG, let the decoder downscale by a power of two while decoding
+            image.draft("RGB", (self.max_edge, self.max_edge))
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+            raise InvalidImage(f"Unreadable image: {e}")
+
+        out = io.BytesIO()
+        # A fresh save without exif= drops all metadata (GPS, device, timestamps)
+        image.save(out, FORMATS[self.format], quality=self.quality, optimize=self.format == "jpeg")
+        return PreparedImage(
+            data=out.getvalue(),
+            format=self.format,
+            width=image.width,
+            height=image.height,
+            original_bytes=original_bytes,
+            phash=dhash(image),
+            elapsed_ms=(time.perf_counter() - start) * 1000,
+        )
+
+    def _prepare_base64(self, payload: str) -> PreparedImage:
+        raw = decode_base64(payload)
+        return self._prepare(raw, len(raw))
+
+    def _prepare_file(self, fileobj: BinaryIO) -> PreparedImage:
+        fileobj.seek(0, io.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(0)
+        return self._prepare(fileobj, size)
+
+    async def _run(self, fn, *args) -> PreparedImage:
+        try:
+            prepared = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except InvalidImage:
+            self.failed += 1
+            raise
+        self.processed += 1
+        self.bytes_in += prepared.original_bytes
+        self.bytes_out += len(prepared.data)
+        self.total_ms += prepared.elapsed_ms
+        return prepared
+
+    async def prepare(self, raw: bytes) -> PreparedImage:
+        return await self._run(self._prepare, raw, len(raw))
+
+    async def prepare_file(self, fileobj: BinaryIO) -> PreparedImage:
+        """Decode straight from a file object, e.g. a multipart upload's spooled file"""
+        return await self._run(self._prepare_file, fileobj)
+
+    async def prepare_base64(self, payload: str) -> PreparedImage:
+        # Decoding happens on the worker too, multi-megabyte strings included
+        return await self._run(self._prepare_base64, payload)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_edge": self.max_edge,
+            "format": self.format,
+            "quality": self.quality,
+            "max_workers": self.max_workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "avg_ms": round(self.total_ms / self.processed, 2) if self.processed else 0.0,
+        }
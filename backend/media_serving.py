@@ -0,0 +1,168 @@
+"""Range-aware file responses for course videos.
+
+Mobile players seek constantly, so video files are served with byte-range
+support (206 / 416, If-Range), strong ETags and long-lived caching. When the
+ASGI server implements the `http.response.zerocopysend` extension the body is
+sent with sendfile; otherwise it is streamed in chunks read on the thread pool.
+"""
+import os
+import stat as stat_module
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from caching import etag_matches
+
+CHUNK_SIZE = 256 * 1024
+
+VIDEO_MEDIA_TYPES = {
+    "mp4": "video/mp4",
+    "m4v": "video/mp4",
+    "mov": "video/quicktime",
+    "webm": "video/webm",
+    "mkv": "video/x-matroska",
+}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def strong_etag(st: os.stat_result) -> str:
+    # Files are written once under a unique name and never modified in place
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into inclusive (start, end)
+
+    Returns None when the header should be ignored (other units, several
+    ranges or an invalid range such as 5-3: the full body is served). Raises
+    RangeNotSatisfiable for valid ranges that start past the end of the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    if size == 0:
+        raise RangeNotSatisfiable()
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def _if_range_matches(if_range: str, etag: str, st: os.stat_result) -> bool:
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Strong comparison only: weak validators never satisfy If-Range
+        return if_range == etag
+    try:
+        return int(parsedate_to_datetime(if_range).timestamp()) == int(st.st_mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+class RangeFileResponse(Response):
+    """Sends `count` bytes of `path` starting at `offset`"""
+
+    def __init__(self, path: Path, offset: int, count: int, status_code: int, headers: dict, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        fh = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": fh,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+
+            fh.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(fh.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; terminate the response cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await anyio.to_thread.run_sync(fh.close)
+
+
+def media_response(request: Request, path: Path, cache_control: str) -> Response:
+    """Build a 200/206/304/404/416 response for `path` honouring the request's conditionals"""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return Response(status_code=404)
+    if not stat_module.S_ISREG(st.st_mode):
+        return Response(status_code=404)
+
+    size = st.st_size
+    etag = strong_etag(st)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Content-Type": VIDEO_MEDIA_TYPES.get(path.suffix.lstrip(".").lower(), "application/octet-stream"),
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header:
+        if_range = request.headers.get("if-range")
+        if if_range is None or _if_range_matches(if_range, etag, st):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    send_body = request.method != "HEAD"
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return RangeFileResponse(path, 0, size, 200, headers, send_body)
+
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return RangeFileResponse(path, start, end - start + 1, 206, headers, send_body)
@@ -0,0 +1,92 @@
+"""Streaming storage for admin uploads (course videos, thumbnails, site images).
+
+Uploads are copied chunk by chunk on the thread pool, so a multi-hundred
+megabyte video never blocks the event loop. The size limit is enforced while
+streaming, a SHA-256 is computed on the fly, and the file only appears under
+its final name once it is complete (temp file + atomic rename in the same
+directory). The declared content type is checked before anything is written.
+"""
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import BinaryIO, NamedTuple, Optional
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its size limit."""
+
+
+class UnsupportedUploadType(Exception):
+    """Raised when an upload's content type is not the expected kind."""
+
+
+class StoredUpload(NamedTuple):
+    filename: str
+    path: Path
+    size: int
+    sha256: str
+
+
+def _copy_chunk(source: BinaryIO, target: BinaryIO, digest, chunk_size: int) -> int:
+    # Read, hash and write in one thread hop; hashlib releases the GIL on large buffers
+    chunk = source.read(chunk_size)
+    if chunk:
+        digest.update(chunk)
+        target.write(chunk)
+    return len(chunk)
+
+
+def _finalize(target: BinaryIO, temp_path: Path, final_path: Path) -> None:
+    target.flush()
+    os.fsync(target.fileno())
+    target.close()
+    os.replace(temp_path, final_path)
+
+
+def _discard(target: BinaryIO, temp_path: Path) -> None:
+    target.close()
+    temp_path.unlink(missing_ok=True)
+
+
+async def store_upload(
+    upload: UploadFile,
+    dest_dir: Path,
+    filename: str,
+    max_bytes: int,
+    chunk_size: int = CHUNK_SIZE,
+    content_type_prefix: Optional[str] = None,
+) -> StoredUpload:
+    """Stream `upload` into `dest_dir / filename`, enforcing `max_bytes` and `content_type_prefix` ("video/")"""
+    if content_type_prefix and not (upload.content_type or "").startswith(content_type_prefix):
+        raise UnsupportedUploadType(f"{upload.filename} is {upload.content_type}, not {content_type_prefix}*")
+    # Starlette knows the size once the multipart body has been parsed
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"{upload.filename} exceeds {max_bytes} bytes")
+
+    final_path = dest_dir / filename
+    temp_path = dest_dir / f".{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    await upload.seek(0)
+    target = await run_in_threadpool(open, temp_path, "wb")
+    try:
+        while True:
+            copied = await run_in_threadpool(_copy_chunk, upload.file, target, digest, chunk_size)
+            if not copied:
+                break
+            size += copied
+            if size > max_bytes:
+                raise UploadTooLarge(f"{upload.filename} exceeds {max_bytes} bytes")
+        await run_in_threadpool(_finalize, target, temp_path, final_path)
+    except BaseException:
+        await run_in_threadpool(_discard, target, temp_path)
+        raise
+
+    return StoredUpload(filename=filename, path=final_path, size=size, sha256=digest.hexdigest())
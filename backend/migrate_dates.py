@@ -0,0 +1,161 @@
+"""Online migration of legacy ISO-string timestamps to BSON dates.
+
+Walks each collection in `_id` order, in small batches, and rewrites the
+string timestamps listed in MIGRATED_FIELDS as dates. Progress is
+checkpointed in the `migrations` collection, so an interrupted run resumes
+where it stopped. Every update is conditional on the field still holding the
+string it was read with, so it never overwrites a value the app wrote in the
+meantime, and the app can keep serving traffic (with
+LEGACY_STRING_TIMESTAMPS=true) while it runs:
+
+    python migrate_dates.py                          # every collection
+    python migrate_dates.py --collection meal_history --batch-size 200 --pause 0.1
+    python migrate_dates.py --status                 # strings left per collection
+    python migrate_dates.py --restart                # ignore checkpoints, rescan
+
+Once --status reports nothing left (re-run with --restart after the last
+replica writing strings is gone), set LEGACY_STRING_TIMESTAMPS=false.
+"""
+import argparse
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from timestamps import utc_now, to_utc
+
+MIGRATION_ID = "timestamps_to_dates"
+
+# Collection -> timestamp fields the app used to write as ISO strings
+MIGRATED_FIELDS = {
+    "users": ["created_at", "last_login"],
+    "password_resets": ["expires"],
+    "courses": ["created_at"],
+    "payment_transactions": ["created_at"],
+    "purchases": ["created_at"],
+    "site_content": ["updated_at"],
+    "meal_history": ["created_at"],
+    "sessions": ["completed_at"],
+    "daily_nutrition": ["updated_at", "rebuilt_at"],
+}
+
+
+def string_fields_query(fields: List[str]) -> Dict[str, Any]:
+    return {"$or": [{field: {"$type": "string"}} for field in fields]}
+
+
+def conversion(doc: Dict[str, Any], fields: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Conditional filter/update turning the document's string timestamps into dates
+
+    None when nothing in the document can be converted (already dates, or
+    strings that are not ISO timestamps; those are left for a human to look at).
+    """
+    expected = {"_id": doc["_id"]}
+    converted = {}
+    for field in fields:
+        value = doc.get(field)
+        if not isinstance(value, str):
+            continue
+        try:
+            parsed = to_utc(value)
+        except ValueError:
+            continue
+        if parsed is None:
+            continue
+        expected[field] = value
+        converted[field] = parsed
+    if not converted:
+        return None
+    return {"filter": expected, "update": {"$set": converted}}
+
+
+async def migrate_collection(db, name: str, fields: List[str], batch_size: int = 500,
+                             pause: float = 0.0, restart: bool = False) -> Dict[str, Any]:
+    """Convert one collection, resuming from its checkpoint unless `restart`"""
+    checkpoint_id = f"{MIGRATION_ID}:{name}"
+    checkpoint = None if restart else await db.migrations.find_one({"_id": checkpoint_id})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    converted = checkpoint.get("converted", 0) if checkpoint else 0
+    skipped = checkpoint.get("skipped", 0) if checkpoint else 0
+
+    projection = {field: 1 for field in fields}
+    while True:
+        query = string_fields_query(fields)
+        if last_id is not None:
+            query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+        batch = await db[name].find(query, projection).sort("_id", 1).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            change = conversion(doc, fields)
+            if change is None:
+                skipped += 1
+            else:
+                operations.append(UpdateOne(change["filter"], change["update"]))
+        if operations:
+            result = await db[name].bulk_write(operations, ordered=False)
+            # A document the app rewrote since it was read no longer matches: nothing to do
+            converted += result.modified_count
+
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "converted": converted, "skipped": skipped,
+                      "done": False, "updated_at": utc_now()}},
+            upsert=True
+        )
+        if pause:
+            # Leaves room for application traffic between batches
+            await asyncio.sleep(pause)
+
+    await db.migrations.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"converted": converted, "skipped": skipped, "done": True, "updated_at": utc_now()}},
+        upsert=True
+    )
+    return {"converted": converted, "skipped": skipped}
+
+
+async def remaining_strings(db) -> Dict[str, int]:
+    """Documents per collection still holding at least one string timestamp"""
+    return {
+        name: await db[name].count_documents(string_fields_query(fields))
+        for name, fields in MIGRATED_FIELDS.items()
+    }
+
+
+async def _main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Convert ISO-string timestamps to BSON dates")
+    parser.add_argument("--collection", choices=sorted(MIGRATED_FIELDS), help="only migrate this collection")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and scan from the start")
+    parser.add_argument("--status", action="store_true", help="only report what is left to convert")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        if not args.status:
+            names = [args.collection] if args.collection else list(MIGRATED_FIELDS)
+            for name in names:
+                result = await migrate_collection(
+                    db, name, MIGRATED_FIELDS[name], args.batch_size, args.pause, args.restart
+                )
+                print(f"{name}: converted {result['converted']}, skipped {result['skipped']} unparseable")
+        for name, count in (await remaining_strings(db)).items():
+            print(f"{name}: {count} documents with string timestamps left")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,265 @@
+"""Local food composition index for text meal descriptions.
+
+Common foods are resolved offline from per-100 g values (Ciqual-style averages)
+with French aliases and simple quantity parsing ("2 oeufs", "150g riz", "un bol
+de lait"). Descriptions whose items all match never reach the LLM; otherwise
+only the unmatched items are sent to it.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+
+class Food(NamedTuple):
+    name: str
+    kcal: float       # per 100 g
+    proteins: float   # g per 100 g
+    carbs: float      # g per 100 g
+    fats: float       # g per 100 g
+    portion_g: float  # one piece / usual portion
+    aliases: Tuple[str, ...]
+    liquid: bool = False  # measured in ml (1 ml counted as 1 g)
+
+
+FOODS = [
+    # Eggs, dairy
+    Food("Oeuf", 143, 12.6, 0.7, 9.5, 50, ("oeuf", "oeuf dur", "oeuf au plat", "egg")),
+    Food("Omelette", 154, 10.6, 0.6, 12.0, 120, ("omelette",)),
+    Food("Lait demi-écrémé", 46, 3.3, 4.8, 1.6, 250, ("lait", "lait demi ecreme"), liquid=True),
+    Food("Yaourt nature", 61, 3.5, 4.7, 3.3, 125, ("yaourt", "yaourt nature", "yogourt", "yoghourt")),
+    Food("Fromage blanc", 75, 7.5, 4.0, 3.2, 100, ("fromage blanc",)),
+    Food("Fromage", 360, 24.0, 0.5, 29.0, 30, ("fromage", "emmental", "comte", "gruyere")),
+    Food("Fromage frais", 240, 7.0, 3.5, 22.0, 30, ("fromage frais", "kiri", "vache qui rit")),
+    Food("Beurre", 717, 0.9, 0.1, 81.0, 10, ("beurre",)),
+    # Bread, cereals, starches
+    Food("Pain", 270, 9.0, 55.0, 1.5, 40, ("pain", "baguette", "pain blanc")),
+    Food("Pain complet", 245, 9.7, 45.0, 3.0, 40, ("pain complet", "pain aux cereales")),
+    Food("Tartine", 270, 9.0, 55.0, 1.5, 35, ("tartine", "tranche de pain")),
+    Food("Pain de mie", 265, 8.0, 49.0, 4.0, 25, ("pain de mie",)),
+    Food("Croissant", 406, 8.2, 45.8, 21.0, 60, ("croissant",)),
+    Food("Pain au chocolat", 420, 7.5, 47.0, 22.0, 70, ("pain au chocolat", "chocolatine")),
+    Food("Riz cuit", 130, 2.7, 28.0, 0.3, 150, ("riz", "riz blanc", "riz cuit", "riz basmati")),
+    Food("Pâtes cuites", 157, 5.8, 30.9, 0.9, 200, ("pates", "pates cuites", "spaghetti", "spaghettis", "macaroni", "penne", "tagliatelles")),
+    Food("Semoule cuite", 112, 3.8, 23.2, 0.2, 150, ("semoule", "couscous", "semoule de couscous")),
+    Food("Flocons d'avoine", 372, 13.5, 58.7, 7.0, 40, ("flocons d'avoine", "flocon d'avoine", "avoine", "porridge")),
+    Food("Céréales", 380, 7.5, 80.0, 3.0, 30, ("cereales", "corn flakes")),
+    Food("Pomme de terre", 80, 2.0, 17.0, 0.1, 150, ("pomme de terre", "patate", "pommes de terre vapeur")),
+    Food("Frites", 312, 3.4, 41.0, 15.0, 150, ("frites",)),
+    Food("Lentilles cuites", 116, 9.0, 20.0, 0.4, 150, ("lentilles", "lentille")),
+    Food("Pois chiches", 164, 8.9, 27.4, 2.6, 150, ("pois chiches", "pois chiche")),
+    # Meat, fish
+    Food("Poulet", 165, 31.0, 0.0, 3.6, 120, ("poulet", "blanc de poulet", "filet de poulet", "escalope de poulet")),
+    Food("Dinde", 135, 29.0, 0.0, 1.7, 120, ("dinde", "escalope de dinde", "blanc de dinde")),
+    Food("Steak haché 5%", 137, 21.0, 0.0, 5.0, 100, ("steak hache", "steak", "boeuf hache")),
+    Food("Agneau", 250, 25.0, 0.0, 16.0, 120, ("agneau", "viande d'agneau")),
+    Food("Jambon", 115, 19.0, 1.0, 3.5, 40, ("jambon", "jambon blanc", "jambon de dinde")),
+    Food("Saumon", 208, 20.0, 0.0, 13.0, 120, ("saumon", "pave de saumon")),
+    Food("Thon", 116, 26.0, 0.0, 1.0, 100, ("thon", "thon au naturel")),
+    Food("Crevettes", 99, 24.0, 0.2, 0.3, 100, ("crevettes", "crevette")),
+    # Vegetables
+    Food("Salade verte", 15, 1.4, 2.9, 0.2, 80, ("salade", "salade verte", "laitue")),
+    Food("Tomate", 18, 0.9, 3.9, 0.2, 120, ("tomate",)),
+    Food("Concombre", 15, 0.7, 3.6, 0.1, 150, ("concombre",)),
+    Food("Carotte", 41, 0.9, 9.6, 0.2, 80, ("carotte", "carottes rapees")),
+    Food("Courgette", 17, 1.2, 3.1, 0.3, 150, ("courgette",)),
+    Food("Brocoli", 34, 2.8, 6.6, 0.4, 150, ("brocoli", "brocolis")),
+    Food("Haricots verts", 31, 1.8, 7.0, 0.1, 150, ("haricots verts", "haricot vert")),
+    Food("Avocat", 160, 2.0, 8.5, 14.7, 150, ("avocat",)),
+    Food("Soupe de légumes", 35, 1.2, 6.0, 0.8, 250, ("soupe", "soupe de legumes", "veloute"), liquid=True),
+    Food("Chorba", 60, 3.5, 7.0, 2.0, 300, ("chorba", "chorba frik", "harira"), liquid=True),
+    # Fruits
+    Food("Banane", 89, 1.1, 22.8, 0.3, 120, ("banane",)),
+    Food("Pomme", 52, 0.3, 13.8, 0.2, 150, ("pomme",)),
+    Food("Orange", 47, 0.9, 11.8, 0.1, 150, ("orange",)),
+    Food("Fraises", 32, 0.7, 7.7, 0.3, 150, ("fraise", "fraises")),
+    Food("Datte", 282, 2.5, 75.0, 0.4, 8, ("datte", "dattes", "datte medjool")),
+    Food("Kiwi", 61, 1.1, 14.7, 0.5, 75, ("kiwi",)),
+    # Nuts, fats, sweets
+    Food("Amandes", 579, 21.0, 21.6, 49.9, 30, ("amandes", "amande")),
+    Food("Noix", 654, 15.2, 13.7, 65.2, 30, ("noix",)),
+    Food("Huile d'olive", 884, 0.0, 0.0, 100.0, 10, ("huile", "huile d'olive")),
+    Food("Miel", 304, 0.3, 82.4, 0.0, 20, ("miel",)),
+    Food("Confiture", 250, 0.4, 60.0, 0.1, 20, ("confiture",)),
+    Food("Chocolat noir", 546, 4.9, 61.0, 31.0, 20, ("chocolat", "chocolat noir", "carre de chocolat")),
+    Food("Biscuit", 450, 6.0, 70.0, 16.0, 10, ("biscuit", "gateau sec")),
+    # Drinks
+    Food("Jus d'orange", 45, 0.7, 10.4, 0.2, 200, ("jus d'orange", "jus", "jus de fruit"), liquid=True),
+    Food("Café", 2, 0.1, 0.0, 0.0, 150, ("cafe", "expresso", "cafe noir"), liquid=True),
+    Food("Thé", 1, 0.0, 0.2, 0.0, 200, ("the", "the vert", "the a la menthe"), liquid=True),
+    Food("Eau", 0, 0.0, 0.0, 0.0, 250, ("eau", "verre d'eau"), liquid=True),
+]
+
+NUMBER_WORDS = {
+    "un": 1, "une": 1, "deux": 2, "trois": 3, "quatre": 4, "cinq": 5, "six": 6,
+    "sept": 7, "huit": 8, "neuf": 9, "dix": 10, "douze": 12, "demi": 0.5, "une demi": 0.5,
+}
+
+# Vague amounts: (pieces with a piece unit, share of the usual portion without one).
+# "quelques tranches" are 3 slices, but "quelques amandes" is a few nuts, not 3 handfuls.
+VAGUE_QUANTITIES = {
+    "quelques": (3, 0.5),
+    "un peu": (1, 0.5),
+}
+
+# Unit -> grams; None means "one portion of the food"
+UNITS = {
+    "g": 1, "gr": 1, "gramme": 1, "grammes": 1, "kg": 1000,
+    "ml": 1, "cl": 10, "dl": 100, "l": 1000, "litre": 1000, "litres": 1000,
+    "cuillere a soupe": 15, "cuilleres a soupe": 15, "cas": 15, "c a s": 15,
+    "cuillere a cafe": 5, "cuilleres a cafe": 5, "cac": 5, "c a c": 5,
+    "bol": 250, "bols": 250, "verre": 200, "verres": 200, "tasse": 200, "tasses": 200,
+    "assiette": 300, "assiettes": 300, "poignee": 30, "poignees": 30,
+    "tranche": None, "tranches": None, "portion": None, "portions": None,
+    "part": None, "parts": None, "morceau": None, "morceaux": None,
+}
+MASS_UNITS = ("g", "gr", "gramme", "grammes", "kg")
+VOLUME_UNITS = ("ml", "cl", "dl", "l", "litre", "litres")
+
+# A comma between digits is a decimal comma ("1,5 kg"), not a separator
+_SPLIT_RE = re.compile(r"\s*(?:(?<!\d),|,(?!\d)|;|\+|\n|\bet\b|\bavec\b|\bpuis\b)\s*")
+_NUMBER = r"\d+(?:[.,]\d+)?"
+_QTY_WORDS = sorted(map(re.escape, [*NUMBER_WORDS, *VAGUE_QUANTITIES]), key=len, reverse=True)
+_QTY_RE = re.compile(
+    r"^(?P<qty>" + _NUMBER + "|" + "|".join(_QTY_WORDS) + r")?\s*"
+    # A unit ends the word: the "l" of "l'eau" or "lait" is not litres
+    r"(?:(?P<unit>" + "|".join(sorted(map(re.escape, UNITS), key=len, reverse=True)) + r")(?![a-z']))?\s*"
+    r"(?:de |d'|des |du |de la )?(?P<food>.*)$"
+)
+_ARTICLE_RE = re.compile(r"^(?:le |la |les |l'|du |des |de la |de l'|mon |ma |mes )")
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("œ", "oe").replace("’", "'")
+    text = "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+    text = re.sub(r"[^a-z0-9',.+;\n ]", " ", text)
+    return re.sub(r"\s+", " ", text).strip(" .")
+
+
+def _singular(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word[-1] in "sx" else word
+
+
+class LocalResolution(NamedTuple):
+    foods: List[Dict[str, Any]]
+    unmatched: List[str]
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.foods) and not self.unmatched
+
+
+class NutritionIndex:
+    def __init__(self, foods: List[Food]):
+        self._aliases: Dict[str, Food] = {}
+        for food in foods:
+            for alias in (food.name, *food.aliases):
+                key = normalize(alias)
+                self._aliases.setdefault(key, food)
+                self._aliases.setdefault(" ".join(_singular(w) for w in key.split()), food)
+        self.resolved_locally = 0
+        self.resolved_partially = 0
+        self.unresolved = 0
+
+    def lookup(self, name: str) -> Optional[Food]:
+        name = _ARTICLE_RE.sub("", name).strip()
+        return self._aliases.get(name) or self._aliases.get(" ".join(_singular(w) for w in name.split()))
+
+    def _parse_item(self, item: str) -> Optional[Dict[str, Any]]:
+        match = _QTY_RE.match(item)
+        if not match:
+            return None
+        food = self.lookup(match.group("food").strip())
+        if food is None:
+            return None
+
+        qty_text, unit = match.group("qty"), match.group("unit")
+        unit_grams = UNITS.get(unit) if unit else None
+        qty = 1.0
+        if qty_text in VAGUE_QUANTITIES:
+            pieces, portion_share = VAGUE_QUANTITIES[qty_text]
+            qty = pieces if unit else portion_share
+        elif qty_text:
+            qty = NUMBER_WORDS.get(qty_text) or float(qty_text.replace(",", "."))
+        grams = qty * (unit_grams if unit_grams is not None else food.portion_g)
+
+        amount = f"{grams:g}{'ml' if food.liquid or unit in VOLUME_UNITS else 'g'}"
+        if unit in MASS_UNITS or unit in VOLUME_UNITS:
+            quantity = amount
+        else:
+            count = qty_text if qty_text in VAGUE_QUANTITIES else f"{qty:g}"
+            quantity = f"{count} {unit} ({amount})" if unit else f"{count} ({amount})"
+
+        ratio = grams / 100
+        return {
+            "name": food.name,
+            "quantity": quantity,
+            "calories": int(round(food.kcal * ratio)),
+            "proteins": round(food.proteins * ratio, 1),
+            "carbs": round(food.carbs * ratio, 1),
+            "fats": round(food.fats * ratio, 1),
+        }
+
+    def resolve(self, description: str) -> LocalResolution:
+        """Split a description into items and resolve the ones the index knows"""
+        foods, unmatched = [], []
+        for raw_item in _SPLIT_RE.split(description):
+            item = normalize(raw_item)
+            if not item:
+                continue
+            parsed = self._parse_item(item)
+            if parsed:
+                foods.append(parsed)
+            else:
+                unmatched.append(raw_item.strip())
+
+        if foods and not unmatched:
+            self.resolved_locally += 1
+        elif foods:
+            self.resolved_partially += 1
+        else:
+            self.unresolved += 1
+        return LocalResolution(foods, unmatched)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.resolved_locally + self.resolved_partially + self.unresolved
+        return {
+            "foods": len({food.name for food in self._aliases.values()}),
+            "resolved_locally": self.resolved_locally,
+            "resolved_partially": self.resolved_partially,
+            "unresolved": self.unresolved,
+            "local_share": round(self.resolved_locally / total, 4) if total else 0.0,
+        }
+
+
+def summarize_foods(foods: List[Dict[str, Any]], analysis_text: str) -> Dict[str, Any]:
+    """Analysis payload (same shape as the LLM's) for a list of food items"""
+    return {
+        "foods": foods,
+        "total_calories": sum(f["calories"] for f in foods),
+        "total_proteins": round(sum(f["proteins"] for f in foods), 1),
+        "total_carbs": round(sum(f["carbs"] for f in foods), 1),
+        "total_fats": round(sum(f["fats"] for f in foods), 1),
+        "analysis_text": analysis_text,
+    }
+
+
+def describe_foods(foods: List[Dict[str, Any]]) -> str:
+    return ", ".join(f"{f['name']} ({f['quantity']})" for f in foods)
+
+
+def merge_analyses(local_foods: List[Dict[str, Any]], llm_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """One analysis from the items the table resolved and the LLM's analysis of the rest"""
+    analysis_text = f"Estimation à partir de la table nutritionnelle : {describe_foods(local_foods)}."
+    if llm_analysis.get("analysis_text"):
+        analysis_text += " " + llm_analysis["analysis_text"]
+    return {
+        "foods": local_foods + list(llm_analysis.get("foods", [])),
+        "total_calories": sum(f["calories"] for f in local_foods) + llm_analysis.get("total_calories", 0),
+        "total_proteins": round(sum(f["proteins"] for f in local_foods) + llm_analysis.get("total_proteins", 0.0), 1),
+        "total_carbs": round(sum(f["carbs"] for f in local_foods) + llm_analysis.get("total_carbs", 0.0), 1),
+        "total_fats": round(sum(f["fats"] for f in local_foods) + llm_analysis.get("total_fats", 0.0), 1),
+        "analysis_text": analysis_text,
+    }
+
+
+nutrition_index = NutritionIndex(FOODS)
@@ -0,0 +1,200 @@
+"""Per-day nutrition rollups in the `daily_nutrition` collection.
+
+One small document per (user_id, day) holds the meal count and the summed
+calories/macros for that UTC day. Meal writes and deletes keep it current with
+`$inc`, so daily summaries read one document instead of scanning
+`meal_history`. `rebuild_rollups` regenerates the documents from
+`meal_history` for backfill and repair:
+
+    python nutrition_rollups.py rebuild                 # every user
+    python nutrition_rollups.py rebuild --user <id>     # a single user
+
+Rollups only hold what was applied since they started being maintained, so
+they are not trusted until a full rebuild has completed (recorded in the
+`migrations` collection). Until then the readers return None and callers
+aggregate `meal_history` instead.
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from timestamps import utc_now, utc_day, day_expression
+
+# Rollup field -> meal_history field
+ROLLUP_FIELDS = {
+    "calories": "total_calories",
+    "proteins": "total_proteins",
+    "carbs": "total_carbs",
+    "fats": "total_fats",
+}
+
+EMPTY_TOTALS = {"meals_count": 0, "calories": 0, "proteins": 0, "carbs": 0, "fats": 0}
+
+BACKFILL_MARKER = "nutrition_rollups_backfill"
+BACKFILL_RECHECK_SECONDS = 60.0
+
+# Once the backfill is done it stays done; until then it is re-checked every BACKFILL_RECHECK_SECONDS
+_backfilled = False
+_backfill_checked_at: Optional[float] = None
+
+
+async def rollups_ready(db) -> bool:
+    """Whether a full rebuild has run, so that every day with meals has a complete rollup"""
+    global _backfilled, _backfill_checked_at
+    if _backfilled:
+        return True
+    now = time.monotonic()
+    if _backfill_checked_at is not None and now - _backfill_checked_at < BACKFILL_RECHECK_SECONDS:
+        return False
+    _backfill_checked_at = now
+    _backfilled = await db.migrations.find_one({"_id": BACKFILL_MARKER}, {"_id": 1}) is not None
+    return _backfilled
+
+
+def reset_backfill_state() -> None:
+    global _backfilled, _backfill_checked_at
+    _backfilled = False
+    _backfill_checked_at = None
+
+
+def meal_day(meal: Dict[str, Any]) -> str:
+    """UTC day (YYYY-MM-DD) a meal counts towards"""
+    return utc_day(meal["created_at"])
+
+
+async def apply_meal(db, meal: Dict[str, Any], sign: int = 1) -> None:
+    """Add (sign=1) or remove (sign=-1) a meal from its day's rollup
+
+    A removal never creates a rollup: without one there is nothing to
+    subtract from, and a negative document would hide the day's other meals.
+    """
+    increments = {"meals_count": sign}
+    for field, meal_field in ROLLUP_FIELDS.items():
+        increments[field] = sign * meal.get(meal_field, 0)
+    await db.daily_nutrition.update_one(
+        {"user_id": meal["user_id"], "day": meal_day(meal)},
+        {"$inc": increments, "$set": {"updated_at": utc_now()}},
+        upsert=sign > 0
+    )
+
+
+async def apply_meals(db, meals: List[Dict[str, Any]]) -> None:
+    """Add several meals with one bulk write: one $inc per (user, day)"""
+    grouped: Dict[tuple, Dict[str, Any]] = {}
+    for meal in meals:
+        increments = grouped.setdefault((meal["user_id"], meal_day(meal)), {"meals_count": 0})
+        increments["meals_count"] += 1
+        for field, meal_field in ROLLUP_FIELDS.items():
+            increments[field] = increments.get(field, 0) + meal.get(meal_field, 0)
+    if not grouped:
+        return
+    now = utc_now()
+    await db.daily_nutrition.bulk_write([
+        UpdateOne({"user_id": user_id, "day": day}, {"$inc": increments, "$set": {"updated_at": now}}, upsert=True)
+        for (user_id, day), increments in grouped.items()
+    ], ordered=False)
+
+
+def _totals(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # Repeated float $inc/-$inc leaves tiny residues once a day is emptied
+    if doc.get("meals_count", 0) <= 0:
+        return dict(EMPTY_TOTALS)
+    totals = {"meals_count": doc["meals_count"]}
+    for field in ROLLUP_FIELDS:
+        totals[field] = doc.get(field, 0)
+    return totals
+
+
+async def get_day_totals(db, user_id: str, day: str) -> Optional[Dict[str, Any]]:
+    """Totals for one day, or None when they must be aggregated from meal_history
+
+    That is the case before the backfill has run, and for a day without a
+    rollup (no meals yet).
+    """
+    if not await rollups_ready(db):
+        return None
+    doc = await db.daily_nutrition.find_one({"user_id": user_id, "day": day}, {"_id": 0})
+    return _totals(doc) if doc else None
+
+
+async def get_range_totals(db, user_id: str, start_day: str, end_day: str) -> Optional[List[Dict[str, Any]]]:
+    """Per-day totals between two days (inclusive), oldest first; None before the backfill"""
+    if not await rollups_ready(db):
+        return None
+    docs = await db.daily_nutrition.find(
+        {"user_id": user_id, "day": {"$gte": start_day, "$lte": end_day}},
+        {"_id": 0}
+    ).sort("day", 1).to_list(None)
+    return [{"day": doc["day"], **_totals(doc)} for doc in docs]
+
+
+async def rebuild_rollups(db, user_id: Optional[str] = None) -> Dict[str, int]:
+    """Regenerate rollups from meal_history, for one user or everyone
+
+    Rollups are replaced in place with $merge, so daily summaries keep working
+    while the rebuild runs. Rollups for days that no longer have any meals are
+    removed afterwards. A meal logged while the rebuild is running can be
+    missed, so run it off-peak or re-run it for the affected user.
+    """
+    run_at = utc_now()
+    scope = {"user_id": user_id} if user_id else {}
+    pipeline = [
+        {"$match": scope},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "day": day_expression("$created_at")},
+            "meals_count": {"$sum": 1},
+            **{field: {"$sum": f"${meal_field}"} for field, meal_field in ROLLUP_FIELDS.items()}
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "day": "$_id.day",
+            "meals_count": 1,
+            **{field: 1 for field in ROLLUP_FIELDS},
+            "updated_at": {"$literal": run_at},
+            "rebuilt_at": {"$literal": run_at}
+        }},
+        {"$merge": {
+            "into": "daily_nutrition",
+            "on": ["user_id", "day"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+    await db.meal_history.aggregate(pipeline).to_list(None)
+
+    stale = await db.daily_nutrition.delete_many({**scope, "rebuilt_at": {"$ne": run_at}})
+    rebuilt = await db.daily_nutrition.count_documents({**scope, "rebuilt_at": run_at})
+    if user_id is None:
+        # Every day with meals now has a complete rollup: readers can trust them
+        await db.migrations.update_one(
+            {"_id": BACKFILL_MARKER}, {"$set": {"completed_at": run_at}}, upsert=True
+        )
+    return {"rebuilt": rebuilt, "removed": stale.deleted_count}
+
+
+async def _main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Maintain daily_nutrition rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", help="only rebuild this user's rollups")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        result = await rebuild_rollups(client[os.environ['DB_NAME']], args.user)
+        print(f"Rebuilt {result['rebuilt']} daily rollups, removed {result['removed']} stale ones")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
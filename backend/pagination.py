@@ -0,0 +1,82 @@
+"""Keyset pagination for history endpoints.
+
+Pages are ordered newest first on (<timestamp field>, id), and the cursor is
+an opaque, URL-safe token that encodes the last item of the previous page.
+Each page is a single index range scan on (user_id, <field>, id), however far
+back the client scrolls, unlike skip/limit.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Hard cap on the page size a client may ask for
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor cannot be decoded."""
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(sort_value: Any, item_id: str) -> str:
+    raw = json.dumps([_encode_value(sort_value), item_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, item_id = json.loads(raw)
+        return _decode_value(sort_value), str(item_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+
+def clamp_page_size(limit: int, max_page_size: int = MAX_PAGE_SIZE) -> int:
+    return max(1, min(limit, max_page_size))
+
+
+async def fetch_page(
+    collection,
+    query: Dict[str, Any],
+    sort_field: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    legacy_strings: bool = False,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of `query`, newest first, and the cursor of the next page (None on the last one)
+
+    With `legacy_strings`, the sort field may still hold ISO strings next to
+    BSON dates (see timestamps.py). Descending, all dates sort before all
+    strings, so pages after a date cursor also take in every string value.
+    """
+    if cursor:
+        sort_value, item_id = decode_cursor(cursor)
+        after = [
+            {sort_field: {"$lt": sort_value}},
+            {sort_field: sort_value, "id": {"$lt": item_id}},
+        ]
+        if legacy_strings and isinstance(sort_value, datetime):
+            after.append({sort_field: {"$type": "string"}})
+        query = {"$and": [query, {"$or": after}]}
+
+    # One extra document tells whether another page exists
+    items = await collection.find(query, projection).sort([(sort_field, -1), ("id", -1)]).to_list(limit + 1)
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(items[-1][sort_field], items[-1]["id"])
@@ -0,0 +1,85 @@
+"""bcrypt hashing on a dedicated, size-limited thread pool.
+
+bcrypt is deliberately slow (~250 ms at cost 12) and releases the GIL while it
+works, so running it on a small executor keeps the event loop responsive. The
+number of hashes waiting for a worker is capped: once the queue is full new
+calls fail fast with `HasherBusy` instead of piling up behind a login burst.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_queue: int = 32):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def _run(self, fn, *args):
+        # Only touched from the event loop thread, so a plain counter is enough
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise HasherBusy("Password hashing queue is full")
+        self._in_flight += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except Exception:
+            # e.g. a malformed stored hash; cancelled calls count as neither
+            self.failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+        self.completed += 1
+        return result
+
+    def _hash(self, password: str) -> str:
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+    @staticmethod
+    def _verify(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self._verify, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True when `hashed` was produced with a different cost factor."""
+        try:
+            # Modular crypt format: $2b$<cost>$<salt+hash>
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            logger.warning("Unrecognised password hash format")
+            return False
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rounds": self.rounds,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,301 @@
+"""App-scoped Stripe Checkout client.
+
+A single `StripeCheckoutClient` lives for the whole process: it is created
+with the app and closed on shutdown, so calls to Stripe reuse pooled
+keep-alive connections and TLS sessions instead of building a new client per
+request.
+
+Every call has connect and read timeouts. Network errors, 409, 429, 5xx and
+`Stripe-Should-Retry: true` are retried with exponential backoff, and
+`Stripe-Should-Retry: false` is honoured. A POST keeps the same
+Idempotency-Key across its retries, so a retried request never creates a
+second checkout session. `api_base` points the client elsewhere: a proxy, or
+a local mock server in tests.
+
+The platform's shared `sk_test_emergent` key is only accepted by the Emergent
+Stripe proxy, never by api.stripe.com. Without an explicit `api_base` the
+client picks the proxy for that key and Stripe for any other; an explicit
+base that cannot work with the key raises at construction, so a
+misconfigured deployment fails at startup instead of returning 502 on every
+checkout. That key comes without a webhook secret, so by default its
+webhooks are accepted unsigned and their checkout sessions re-read from
+Stripe before anything is granted.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+STRIPE_API_BASE = "https://api.stripe.com"
+EMERGENT_PROXY_BASE = "https://integrations.emergentagent.com/stripe"
+EMERGENT_KEY_PREFIX = "sk_test_emergent"
+
+
+def default_api_base(api_key: str) -> str:
+    """The base URL that accepts `api_key`: the Emergent proxy for its shared key, Stripe otherwise"""
+    return EMERGENT_PROXY_BASE if api_key.startswith(EMERGENT_KEY_PREFIX) else STRIPE_API_BASE
+
+
+def check_api_base(api_key: str, api_base: str) -> None:
+    """Raise ValueError when `api_key` cannot authenticate against `api_base`"""
+    base = api_base.rstrip("/")
+    if api_key.startswith(EMERGENT_KEY_PREFIX) and base == STRIPE_API_BASE:
+        raise ValueError(f"{EMERGENT_KEY_PREFIX} keys only work through the Emergent proxy ({EMERGENT_PROXY_BASE}), "
+                         f"not {STRIPE_API_BASE}: set STRIPE_API_BASE or use a real Stripe key")
+    if base == EMERGENT_PROXY_BASE and not api_key.startswith(EMERGENT_KEY_PREFIX):
+        raise ValueError(f"The Emergent proxy ({EMERGENT_PROXY_BASE}) only accepts {EMERGENT_KEY_PREFIX} keys: "
+                         f"unset STRIPE_API_BASE to call {STRIPE_API_BASE} with this key")
+
+
+class PaymentError(Exception):
+    """Raised when Stripe rejects a request or cannot be reached."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class InvalidSignature(Exception):
+    """Raised when a webhook's Stripe-Signature does not match its payload."""
+
+
+class CheckoutSession(NamedTuple):
+    session_id: str
+    url: str
+
+
+class CheckoutStatus(NamedTuple):
+    session_id: str
+    status: str  # open, complete, expired
+    payment_status: str  # paid, unpaid, no_payment_required
+    amount_total: Optional[int]
+    currency: Optional[str]
+    metadata: Dict[str, str]
+
+
+class WebhookEvent(NamedTuple):
+    event_id: Optional[str]
+    event_type: str
+    session_id: Optional[str]
+    payment_status: Optional[str]
+    metadata: Dict[str, str]
+
+
+def encode_form(params: Dict[str, Any], prefix: str = "") -> List[tuple]:
+    """Stripe's form encoding: nested dicts and lists become key[sub][0]=value pairs"""
+    pairs = []
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if isinstance(value, dict):
+            pairs.extend(encode_form(value, name))
+        elif isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                if isinstance(item, dict):
+                    pairs.extend(encode_form(item, f"{name}[{index}]"))
+                else:
+                    pairs.append((f"{name}[{index}]", str(item)))
+        elif isinstance(value, bool):
+            pairs.append((name, "true" if value else "false"))
+        elif value is not None:
+            pairs.append((name, str(value)))
+    return pairs
+
+
+def verify_webhook(payload: bytes, signature_header: Optional[str], secret: str,
+                   tolerance: int = 300, now: Optional[float] = None) -> Dict[str, Any]:
+    """Check a Stripe-Signature header (t=...,v1=...) and return the parsed event"""
+    if not signature_header:
+        raise InvalidSignature("Missing Stripe-Signature header")
+    timestamp, signatures = None, []
+    for item in signature_header.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise InvalidSignature("Malformed Stripe-Signature header")
+    expected = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise InvalidSignature("Signature mismatch")
+    if abs((now if now is not None else time.time()) - int(timestamp)) > tolerance:
+        raise InvalidSignature("Timestamp outside the tolerance window")
+    return json.loads(payload)
+
+
+def checkout_session_id(event: Dict[str, Any]) -> Optional[str]:
+    """Id of the checkout session an event is about, if any"""
+    obj = (event.get("data") or {}).get("object") or {}
+    return obj.get("id") if obj.get("object") == "checkout.session" else None
+
+
+class StripeCheckoutClient:
+    def __init__(
+        self,
+        api_key: str,
+        api_base: Optional[str] = None,
+        webhook_secret: Optional[str] = None,
+        allow_unsigned_webhooks: Optional[bool] = None,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 2,
+        retry_base_seconds: float = 0.5,
+        retry_max_seconds: float = 5.0,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+    ):
+        api_base = api_base or default_api_base(api_key)
+        check_api_base(api_key, api_base)
+        self.api_base = api_base.rstrip("/")
+        self.webhook_secret = webhook_secret
+        if allow_unsigned_webhooks is None:
+            # The Emergent proxy key has no webhook secret; any other key is expected to have one
+            allow_unsigned_webhooks = not webhook_secret and api_key.startswith(EMERGENT_KEY_PREFIX)
+        self.allow_unsigned_webhooks = allow_unsigned_webhooks
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._client = httpx.AsyncClient(
+            base_url=self.api_base,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections),
+        )
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    def _should_retry(self, response: httpx.Response) -> bool:
+        hint = response.headers.get("Stripe-Should-Retry")
+        if hint is not None:
+            return hint == "true"
+        return response.status_code in (409, 429) or response.status_code >= 500
+
+    def _retry_delay(self, attempt: int) -> float:
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        headers = {}
+        if method == "POST":
+            headers["Idempotency-Key"] = str(uuid.uuid4())
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                if method == "POST":
+                    response = await self._client.post(path, data=dict(encode_form(params or {})), headers=headers)
+                else:
+                    response = await self._client.request(method, path, params=encode_form(params or {}))
+            except httpx.TransportError as e:
+                # Connect errors and timeouts: with the idempotency key a retried POST is safe
+                error = PaymentError(f"Stripe unreachable: {e.__class__.__name__}")
+                retry = True
+            else:
+                if response.status_code < 400:
+                    return response.json()
+                try:
+                    message = response.json()["error"]["message"]
+                except (ValueError, KeyError, TypeError):
+                    message = response.text[:200]
+                error = PaymentError(message, response.status_code)
+                retry = self._should_retry(response)
+            if not retry or attempt == self.max_retries:
+                self.errors += 1
+                raise error
+            self.retries += 1
+            delay = self._retry_delay(attempt)
+            logger.warning(f"Stripe {method} {path} failed ({error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def create_checkout_session(
+        self,
+        amount: float,
+        currency: str,
+        product_name: str,
+        success_url: str,
+        cancel_url: str,
+        metadata: Optional[Dict[str, str]] = None,
+        payment_methods: Optional[List[str]] = None,
+    ) -> CheckoutSession:
+        session = await self._request("POST", "/v1/checkout/sessions", {
+            "mode": "payment",
+            "success_url": success_url,
+            "cancel_url": cancel_url,
+            "payment_method_types": payment_methods or ["card"],
+            "line_items": [{
+                "quantity": 1,
+                "price_data": {
+                    "currency": currency,
+                    "unit_amount": int(round(amount * 100)),
+                    "product_data": {"name": product_name},
+                },
+            }],
+            "metadata": metadata or {},
+        })
+        return CheckoutSession(session_id=session["id"], url=session["url"])
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatus:
+        session = await self._request("GET", f"/v1/checkout/sessions/{session_id}")
+        return CheckoutStatus(
+            session_id=session["id"],
+            status=session.get("status") or "open",
+            payment_status=session.get("payment_status") or "unpaid",
+            amount_total=session.get("amount_total"),
+            currency=session.get("currency"),
+            metadata=session.get("metadata") or {},
+        )
+
+    def verify_event(self, payload: bytes, signature_header: Optional[str]) -> Dict[str, Any]:
+        """The webhook's event, with its signature checked
+
+        Without a webhook secret events are refused, unless unsigned webhooks
+        are allowed: explicitly, or by default for the Emergent proxy key.
+        `resolve_event` then re-reads their session from Stripe.
+        """
+        if self.webhook_secret:
+            event = verify_webhook(payload, signature_header, self.webhook_secret)
+        elif not self.allow_unsigned_webhooks:
+            raise InvalidSignature("No webhook secret configured")
+        else:
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                raise InvalidSignature("Unreadable webhook body")
+        if not isinstance(event, dict) or not event.get("id"):
+            raise InvalidSignature("Webhook event without an id")
+        return event
+
+    async def resolve_event(self, event: Dict[str, Any]) -> WebhookEvent:
+        """Authenticated checkout details of an event returned by `verify_event`
+
+        Without a webhook secret the body cannot be trusted, so the session it
+        names is re-read from Stripe; a session Stripe does not know raises
+        PaymentError with status 404, which no retry will fix.
+        """
+        obj = (event.get("data") or {}).get("object") or {}
+        if obj.get("object") == "checkout.session" and obj.get("id") and not self.webhook_secret:
+            status = await self.get_checkout_status(obj["id"])
+            obj = {**obj, "payment_status": status.payment_status, "metadata": status.metadata}
+        return WebhookEvent(
+            event_id=event.get("id"),
+            event_type=event.get("type", ""),
+            session_id=checkout_session_id(event),
+            payment_status=obj.get("payment_status"),
+            metadata=obj.get("metadata") or {},
+        )
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "retries": self.retries, "errors": self.errors}
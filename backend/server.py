@@ -1,33 +1,57 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Header, UploadFile, File, Form
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr, ConfigDict
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, ValidationError, BeforeValidator
+from typing import List, Optional, Dict, Any, Annotated
 import uuid
+import copy
+import json
 from datetime import datetime, timezone, timedelta
 import jwt
-import bcrypt
-import shutil
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+import asyncio
 from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
 import base64
-import json
-import re
-import resend
 import secrets
+from caching import TTLCache, ResponseCache
+from password_hasher import PasswordHasher, HasherBusy
+from apple_keys import AppleKeyStore, UnknownKeyId, APPLE_JWKS_URL
+from db_indexes import ensure_indexes, verify_indexes
+import nutrition_rollups
+from media_uploads import store_upload, UploadTooLarge, UnsupportedUploadType
+from media_serving import media_response
+from analysis_cache import AnalysisCache
+from nutrition_db import nutrition_index, summarize_foods, describe_foods, merge_analyses
+from meal_images import ImagePreprocessor, PreparedImage, InvalidImage
+from llm_json import extract_json_object, coerce_number
+from llm_guard import LlmGuard, CircuitBreaker, LlmUnavailable, UserBusy
+from pagination import fetch_page, clamp_page_size, InvalidCursor
+from timestamps import utc_now, to_utc, to_iso, utc_day, day_bounds, range_filter
+from email_outbox import EmailOutbox, ResendEmailSender, FakeEmailSender
+from email_rendering import EmailTemplates
+from payments import StripeCheckoutClient, PaymentError, InvalidSignature, checkout_session_id
+from fulfillment import PurchaseFulfillment
+from webhook_inbox import WebhookInbox
+from leased_queue import PermanentError
+from analysis_jobs import (
+    InMemoryJobQueue, MongoJobQueue, JobWorkerPool, JobFailed, QueueFull, new_job, TERMINAL
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (timestamps are BSON dates, read back as aware UTC datetimes)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # JWT Config
@@ -37,6 +61,34 @@ JWT_EXPIRATION_HOURS = 24
 
 # Stripe Config
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY', 'sk_test_emergent')
+STRIPE_API_BASE_URL = os.environ.get('STRIPE_API_BASE')  # a proxy, or a mock server in tests; unset picks the one matching the key
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+# Unsigned webhooks (their sessions are re-read from Stripe): unset accepts them only
+# for the Emergent proxy key, which has no webhook secret; any other key needs the secret
+STRIPE_ALLOW_UNSIGNED_WEBHOOKS = {'true': True, 'false': False}.get(
+    os.environ.get('STRIPE_ALLOW_UNSIGNED_WEBHOOKS', '').lower()
+)
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_TIMEOUT_SECONDS', '10'))
+STRIPE_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_CONNECT_TIMEOUT_SECONDS', '5'))
+STRIPE_MAX_RETRIES = int(os.environ.get('STRIPE_MAX_RETRIES', '2'))
+STRIPE_MAX_CONNECTIONS = int(os.environ.get('STRIPE_MAX_CONNECTIONS', '20'))
+# One client for the app's lifetime: pooled keep-alive connections to Stripe
+stripe_checkout = StripeCheckoutClient(
+    STRIPE_API_KEY,
+    api_base=STRIPE_API_BASE_URL,
+    webhook_secret=STRIPE_WEBHOOK_SECRET,
+    allow_unsigned_webhooks=STRIPE_ALLOW_UNSIGNED_WEBHOOKS,
+    timeout=STRIPE_TIMEOUT_SECONDS,
+    connect_timeout=STRIPE_CONNECT_TIMEOUT_SECONDS,
+    max_retries=STRIPE_MAX_RETRIES,
+    max_connections=STRIPE_MAX_CONNECTIONS
+)
+# Webhooks are stored and acknowledged, then processed in the background per checkout session
+WEBHOOK_INBOX_BATCH_SIZE = int(os.environ.get('WEBHOOK_INBOX_BATCH_SIZE', '20'))
+WEBHOOK_INBOX_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_INBOX_MAX_ATTEMPTS', '8'))
+WEBHOOK_INBOX_RETRY_BASE_SECONDS = float(os.environ.get('WEBHOOK_INBOX_RETRY_BASE_SECONDS', '10'))
+# Every payment path grants access through here: one purchase per provider transaction
+fulfillment = PurchaseFulfillment(db.purchases, db.payment_events)
 
 # Admin password (simple auth for admin)
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'amel2024admin')
@@ -44,17 +96,106 @@ ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'amel2024admin')
 # Emergent LLM Key for GPT-4o
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
 
+# Meal analysis cache (persistent, content addressed)
+ANALYSIS_CACHE_TTL_SECONDS = int(os.environ.get('ANALYSIS_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', '50000'))
+MEAL_IMAGE_MAX_EDGE = int(os.environ.get('MEAL_IMAGE_MAX_EDGE', '1024'))
+MEAL_IMAGE_FORMAT = os.environ.get('MEAL_IMAGE_FORMAT', 'jpeg')
+MEAL_IMAGE_QUALITY = int(os.environ.get('MEAL_IMAGE_QUALITY', '85'))
+MEAL_IMAGE_WORKERS = int(os.environ.get('MEAL_IMAGE_WORKERS', '2'))
+MAX_MEAL_IMAGE_BYTES = int(os.environ.get('MAX_MEAL_IMAGE_BYTES', str(15 * 1024 * 1024)))
+MAX_BATCH_MEALS = int(os.environ.get('MAX_BATCH_MEALS', '10'))
+ANALYSIS_JOB_QUEUE = os.environ.get('ANALYSIS_JOB_QUEUE', 'memory')  # memory | mongo (several replicas)
+ANALYSIS_JOB_WORKERS = int(os.environ.get('ANALYSIS_JOB_WORKERS', '4'))
+ANALYSIS_JOB_MAX_PENDING = int(os.environ.get('ANALYSIS_JOB_MAX_PENDING', '200'))
+ANALYSIS_JOB_RETENTION_SECONDS = int(os.environ.get('ANALYSIS_JOB_RETENTION_SECONDS', '3600'))
+ANALYSIS_JOB_MAX_WAIT_SECONDS = float(os.environ.get('ANALYSIS_JOB_MAX_WAIT_SECONDS', '30'))
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+LLM_PER_USER_LIMIT = int(os.environ.get('LLM_PER_USER_LIMIT', '2'))
+LLM_CALL_TIMEOUT_SECONDS = float(os.environ.get('LLM_CALL_TIMEOUT_SECONDS', '30'))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '10'))
+LLM_BREAKER_ERROR_RATE = float(os.environ.get('LLM_BREAKER_ERROR_RATE', '0.5'))
+LLM_BREAKER_MIN_CALLS = int(os.environ.get('LLM_BREAKER_MIN_CALLS', '10'))
+LLM_BREAKER_WINDOW_SECONDS = float(os.environ.get('LLM_BREAKER_WINDOW_SECONDS', '60'))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('LLM_BREAKER_COOLDOWN_SECONDS', '30'))
+# When the LLM is unavailable, save the food-table estimate of the items it matched instead of a 503
+LLM_FALLBACK_ENABLED = os.environ.get('LLM_FALLBACK_ENABLED', 'true').lower() == 'true'
+
 # Resend Email Config
 RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
 FROM_EMAIL = os.environ.get('FROM_EMAIL', 'contact@beautyfitbyamel.fr')
-if RESEND_API_KEY:
-    resend.api_key = RESEND_API_KEY
+
+# Email outbox (handlers enqueue, a background task sends; "fake" only logs)
+EMAIL_SENDER = os.environ.get('EMAIL_SENDER', 'resend' if RESEND_API_KEY else 'fake')
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', '50'))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', '6'))
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get('EMAIL_OUTBOX_RETRY_BASE_SECONDS', '30'))
+EMAIL_OUTBOX_RATE_PER_SECOND = float(os.environ.get('EMAIL_OUTBOX_RATE_PER_SECOND', '2'))  # Resend default limit
+if EMAIL_SENDER == "resend":
+    email_sender = ResendEmailSender(RESEND_API_KEY, f"Beautyfit By Amel <{FROM_EMAIL}>")
+else:
+    email_sender = FakeEmailSender()
+email_templates = EmailTemplates(ROOT_DIR / "templates" / "email", {
+    "brand_name": "Beautyfit By Amel",
+    "brand_color": "#E37E7F"
+})
+email_outbox = EmailOutbox(
+    db.email_outbox,
+    email_sender,
+    batch_size=EMAIL_OUTBOX_BATCH_SIZE,
+    max_attempts=EMAIL_OUTBOX_MAX_ATTEMPTS,
+    retry_base_seconds=EMAIL_OUTBOX_RETRY_BASE_SECONDS,
+    rate_per_second=EMAIL_OUTBOX_RATE_PER_SECOND
+)
+
+# Timestamps written before the switch to BSON dates are ISO strings; until
+# migrate_dates.py has run, range queries also match the string form
+LEGACY_STRING_TIMESTAMPS = os.environ.get('LEGACY_STRING_TIMESTAMPS', 'true').lower() == 'true'
+
+# Authenticated user cache (bounded LRU, entries expire after the TTL).
+# The cache is per process: invalidate() only clears this worker's copy. With
+# several workers or replicas, a deleted, blocked or re-passworded user can
+# still authenticate on another worker until its entry expires, so keep the
+# TTL short (0 disables the cache).
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '30'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+user_cache = TTLCache(maxsize=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL_SECONDS)
+
+# Public catalog response cache (courses, categories, site content)
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', '300'))
+CATALOG_CACHE_CONTROL = os.environ.get('CATALOG_CACHE_CONTROL', 'public, max-age=60')
+catalog_cache = ResponseCache(maxsize=256, ttl=CATALOG_CACHE_TTL_SECONDS)
+
+# Password hashing (bcrypt runs on its own bounded thread pool)
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_MAX_WORKERS = int(os.environ.get('BCRYPT_MAX_WORKERS', '2'))
+BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', '32'))
+password_hasher = PasswordHasher(
+    rounds=BCRYPT_ROUNDS,
+    max_workers=BCRYPT_MAX_WORKERS,
+    max_queue=BCRYPT_MAX_QUEUE
+)
+
+# Sign in with Apple public keys (cached, refreshed in the background)
+apple_key_store = AppleKeyStore(jwks_url=os.environ.get('APPLE_JWKS_URL', APPLE_JWKS_URL))
 
 # Upload directories
 UPLOAD_DIR = ROOT_DIR / "uploads"
 VIDEOS_DIR = UPLOAD_DIR / "videos"
 THUMBNAILS_DIR = UPLOAD_DIR / "thumbnails"
 
+# Upload size limits, enforced while streaming
+MAX_VIDEO_UPLOAD_BYTES = int(os.environ.get('MAX_VIDEO_UPLOAD_BYTES', str(4 * 1024 ** 3)))
+MAX_IMAGE_UPLOAD_BYTES = int(os.environ.get('MAX_IMAGE_UPLOAD_BYTES', str(20 * 1024 ** 2)))
+
+# Course video serving: purchase checks are cached briefly per (user, course)
+MEDIA_ACCESS_CACHE_TTL_SECONDS = float(os.environ.get('MEDIA_ACCESS_CACHE_TTL_SECONDS', '300'))
+# <video> URLs carry a short-lived token scoped to one course, never the session JWT
+MEDIA_TOKEN_TTL_SECONDS = int(os.environ.get('MEDIA_TOKEN_TTL_SECONDS', '300'))
+MEDIA_TOKEN_AUDIENCE = "media"
+media_owner_cache = TTLCache(maxsize=1024, ttl=60)
+media_access_cache = TTLCache(maxsize=10000, ttl=MEDIA_ACCESS_CACHE_TTL_SECONDS)
+
 # Ensure directories exist
 VIDEOS_DIR.mkdir(parents=True, exist_ok=True)
 THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
@@ -68,9 +209,6 @@ async def health_check():
     """Health check endpoint for Kubernetes liveness/readiness probes"""
     return {"status": "healthy", "service": "beautyfit-api"}
 
-# Mount static files for uploads
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
-
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -86,6 +224,9 @@ logger = logging.getLogger(__name__)
 
 # ==================== MODELS ====================
 
+# Timestamps are stored as datetimes (or legacy strings) and returned as ISO 8601 strings
+IsoDatetime = Annotated[str, BeforeValidator(to_iso)]
+
 class UserCreate(BaseModel):
     email: EmailStr
     password: str
@@ -102,7 +243,7 @@ class UserResponse(BaseModel):
     email: str
     first_name: str
     fitness_goal: Optional[str] = None
-    created_at: str
+    created_at: IsoDatetime
 
 class TokenResponse(BaseModel):
     access_token: str
@@ -132,7 +273,7 @@ class CourseResponse(BaseModel):
     video_url: Optional[str] = None
     teaser_url: Optional[str] = None
     thumbnail_url: Optional[str] = None
-    created_at: str
+    created_at: IsoDatetime
 
 class PurchaseResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -143,7 +284,7 @@ class PurchaseResponse(BaseModel):
     amount: float
     payment_method: str
     status: str
-    created_at: str
+    created_at: IsoDatetime
 
 class NotificationSettings(BaseModel):
     enabled: bool = True
@@ -213,7 +354,22 @@ class CalorieAnalysisResponse(BaseModel):
     total_fats: float
     meal_type: str
     analysis_text: str
-    created_at: str
+    created_at: IsoDatetime
+
+class BatchAnalysisRequest(BaseModel):
+    # Checked while the items are validated: an oversized batch is a 422 after MAX_BATCH_MEALS + 1 items
+    meals: List[CalorieAnalysisRequest] = Field(..., max_length=MAX_BATCH_MEALS)
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: str  # ok, error
+    meal: Optional[CalorieAnalysisResponse] = None
+    error: Optional[str] = None
+
+class BatchAnalysisResponse(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
 
 class MealHistoryResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -224,8 +380,8 @@ class MealHistoryResponse(BaseModel):
     total_carbs: float
     total_fats: float
     meal_type: str
-    analysis_text: str
-    created_at: str
+    analysis_text: Optional[str] = None  # only with ?include_analysis=true
+    created_at: IsoDatetime
 
 class DailyGoal(BaseModel):
     calories: int = 2000
@@ -256,7 +412,7 @@ class SessionRecord(BaseModel):
     steps: int
     duration_minutes: int
     phases_completed: int
-    completed_at: str
+    completed_at: IsoDatetime
 
 class UserStatsResponse(BaseModel):
     total_steps: int
@@ -330,7 +486,7 @@ class SiteContent(BaseModel):
     marquee: MarqueeContent
     colors: ColorTheme
     logo_url: str
-    updated_at: Optional[str] = None
+    updated_at: Optional[IsoDatetime] = None
 
 class SiteContentUpdate(BaseModel):
     hero: Optional[HeroContent] = None
@@ -341,11 +497,41 @@ class SiteContentUpdate(BaseModel):
 
 # ==================== HELPERS ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# Keep references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
+async def rehash_password(user_id: str, password: str, old_hash: str):
+    """Re-hash a password stored with an outdated bcrypt cost factor"""
+    try:
+        new_hash = await password_hasher.hash(password)
+        # Only replaces the hash that was verified: a reset or change made meanwhile wins
+        result = await db.users.update_one({"id": user_id, "password_hash": old_hash},
+                                           {"$set": {"password_hash": new_hash}})
+        if result.modified_count != 1:
+            logger.info(f"Password rehash skipped for user {user_id}: password changed meanwhile")
+            return
+        user_cache.invalidate(user_id)
+        logger.info(f"Password rehashed with cost {password_hasher.rounds} for user {user_id}")
+    except Exception as e:
+        logger.warning(f"Password rehash failed for user {user_id}: {e}")
 
 def create_token(user_id: str, email: str) -> str:
     payload = {
@@ -363,15 +549,27 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await db.users.find_one({"id": user_id}, {"_id": 0})
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user_id, user)
+        # Handlers mutate the user dict, so never hand out the cached object
+        return copy.deepcopy(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def serve_cached(request: Request, build) -> Response:
+    """Serve a public JSON body from catalog_cache, answering If-None-Match with 304
+    
+    `build` is only awaited on a cache miss (once for concurrent misses) and
+    must return the JSON-compatible payload the route would normally return.
+    """
+    return await catalog_cache.serve(request, build, CATALOG_CACHE_CONTROL)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=TokenResponse)
@@ -381,12 +579,12 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     user_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = utc_now()
     
     user_doc = {
         "id": user_id,
         "email": user_data.email,
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await hash_password(user_data.password),
         "first_name": user_data.first_name,
         "fitness_goal": user_data.fitness_goal,
         "created_at": now,
@@ -416,9 +614,12 @@ async def login(credentials: UserLogin):
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not verify_password(credentials.password, user["password_hash"]):
+    if not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    if password_hasher.needs_rehash(user["password_hash"]):
+        spawn_background(rehash_password(user["id"], credentials.password, user["password_hash"]))
+    
     token = create_token(user["id"], user["email"])
     user_response = UserResponse(
         id=user["id"],
@@ -441,9 +642,10 @@ async def google_auth(request: GoogleAuthRequest):
             {"email": request.email},
             {"$set": {
                 "google_picture": request.picture,
-                "last_login": datetime.now(timezone.utc).isoformat()
+                "last_login": utc_now()
             }}
         )
+        user_cache.invalidate(existing_user["id"])
         user = existing_user
     else:
         # Create new user from Google auth
@@ -456,7 +658,7 @@ async def google_auth(request: GoogleAuthRequest):
             "first_name": first_name,
             "google_picture": request.picture,
             "auth_provider": "google",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         }
         await db.users.insert_one(user)
         if "_id" in user:
@@ -478,10 +680,6 @@ async def google_auth(request: GoogleAuthRequest):
 @api_router.post("/auth/apple", response_model=TokenResponse)
 async def apple_auth(request: AppleAuthRequest):
     """Handle Sign in with Apple authentication"""
-    import requests
-    from jwt.algorithms import RSAAlgorithm
-    from cryptography.hazmat.primitives import serialization
-    
     try:
         # Decode the identity token header to get the key ID
         unverified_header = jwt.get_unverified_header(request.identity_token)
@@ -490,31 +688,16 @@ async def apple_auth(request: AppleAuthRequest):
         if not kid:
             raise HTTPException(status_code=401, detail="Invalid token: missing key ID")
         
-        # Fetch Apple's public keys
-        apple_keys_response = requests.get("https://appleid.apple.com/auth/keys")
-        apple_keys = apple_keys_response.json()
-        
-        # Find the correct public key
-        public_key_info = None
-        for key in apple_keys.get("keys", []):
-            if key.get("kid") == kid:
-                public_key_info = key
-                break
-        
-        if not public_key_info:
+        # Get Apple's public key for this kid (cached)
+        try:
+            public_key = await apple_key_store.get_key(kid)
+        except UnknownKeyId:
             raise HTTPException(status_code=401, detail="Unable to find matching public key")
         
-        # Convert JWK to PEM format
-        public_key = RSAAlgorithm.from_jwk(json.dumps(public_key_info))
-        public_key_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        
         # Decode and verify the token
         decoded_token = jwt.decode(
             request.identity_token,
-            public_key_pem,
+            public_key,
             algorithms=["RS256"],
             audience="com.beautyfit.amel"
         )
@@ -538,9 +721,10 @@ async def apple_auth(request: AppleAuthRequest):
                 {"id": existing_user["id"]},
                 {"$set": {
                     "apple_user_id": apple_user_id,
-                    "last_login": datetime.now(timezone.utc).isoformat()
+                    "last_login": utc_now()
                 }}
             )
+            user_cache.invalidate(existing_user["id"])
             user = existing_user
         else:
             # Create new user from Apple auth
@@ -553,7 +737,7 @@ async def apple_auth(request: AppleAuthRequest):
                 "first_name": first_name,
                 "apple_user_id": apple_user_id,
                 "auth_provider": "apple",
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": utc_now()
             }
             await db.users.insert_one(user)
             if "_id" in user:
@@ -572,6 +756,8 @@ async def apple_auth(request: AppleAuthRequest):
         
         return TokenResponse(access_token=token, user=user_response)
         
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError as e:
@@ -587,54 +773,32 @@ async def forgot_password(request: ForgotPasswordRequest):
         # Return same message to prevent email enumeration
         return {"message": "Si l'email existe, un lien de réinitialisation sera envoyé"}
     
-    # Generate a secure reset code (6 digits)
-    reset_code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
     expires = datetime.now(timezone.utc) + timedelta(hours=1)
-    
     await db.password_resets.delete_many({"email": request.email})
-    await db.password_resets.insert_one({
-        "email": request.email,
-        "token": reset_code,
-        "expires": expires.isoformat(),
-        "used": False
-    })
     
-    # Send email via Resend
-    if RESEND_API_KEY:
+    # Generate a secure reset code (6 digits); codes are unique, since reset-password looks them up alone
+    for attempt in range(5):
+        reset_code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
         try:
-            resend.Emails.send({
-                "from": f"Beautyfit By Amel <{FROM_EMAIL}>",
-                "to": [request.email],
-                "subject": "Réinitialisation de ton mot de passe - Beautyfit",
-                "html": f"""
-                <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <div style="text-align: center; margin-bottom: 30px;">
-                        <h1 style="color: #E37E7F; font-family: 'Playfair Display', serif;">Beautyfit By Amel</h1>
-                    </div>
-                    
-                    <p style="color: #333;">Bonjour {user.get('first_name', 'toi')} 👋</p>
-                    
-                    <p style="color: #666;">Tu as demandé à réinitialiser ton mot de passe. Voici ton code de vérification :</p>
-                    
-                    <div style="background: linear-gradient(135deg, #E37E7F, #EE9F80); padding: 20px; border-radius: 12px; text-align: center; margin: 30px 0;">
-                        <span style="font-size: 32px; font-weight: bold; color: white; letter-spacing: 8px;">{reset_code}</span>
-                    </div>
-                    
-                    <p style="color: #666;">Ce code expire dans <strong>1 heure</strong>.</p>
-                    
-                    <p style="color: #999; font-size: 14px;">Si tu n'as pas demandé cette réinitialisation, ignore simplement cet email.</p>
-                    
-                    <hr style="border: none; border-top: 1px solid #eee; margin: 30px 0;">
-                    
-                    <p style="color: #999; font-size: 12px; text-align: center;">
-                        © 2025 Beautyfit By Amel - Ton coach fitness personnel
-                    </p>
-                </div>
-                """
+            await db.password_resets.insert_one({
+                "email": request.email,
+                "token": reset_code,
+                "expires": expires,
+                "used": False
             })
-            logger.info(f"Password reset email sent to {request.email}")
-        except Exception as e:
-            logger.error(f"Failed to send reset email: {e}")
+            break
+        except DuplicateKeyError:
+            if attempt == 4:
+                raise
+    
+    # Queued: the outbox sender delivers it (and retries) in the background
+    email = email_templates.render(
+        "password_reset",
+        first_name=user.get('first_name') or 'toi',
+        reset_code=reset_code,
+        expires_in="1 heure"
+    )
+    await email_outbox.enqueue([request.email], email.subject, email.html, email.text, kind="password_reset")
     
     return {"message": "Si l'email existe, un code de réinitialisation sera envoyé"}
 
@@ -648,14 +812,17 @@ async def reset_password(request: ResetPasswordRequest):
     if not reset:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
     
-    expires = datetime.fromisoformat(reset["expires"])
+    expires = to_utc(reset["expires"])
     if datetime.now(timezone.utc) > expires:
         raise HTTPException(status_code=400, detail="Token expired")
     
-    await db.users.update_one(
+    user = await db.users.find_one_and_update(
         {"email": reset["email"]},
-        {"$set": {"password_hash": hash_password(request.new_password)}}
+        {"$set": {"password_hash": await hash_password(request.new_password)}},
+        projection={"_id": 0, "id": 1}
     )
+    if user:
+        user_cache.invalidate(user["id"])
     
     await db.password_resets.update_one(
         {"token": request.token},
@@ -681,6 +848,7 @@ async def update_profile(update: ProfileUpdate, user: dict = Depends(get_current
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if update_data:
         await db.users.update_one({"id": user["id"]}, {"$set": update_data})
+        user_cache.invalidate(user["id"])
     
     updated_user = await db.users.find_one({"id": user["id"]}, {"_id": 0})
     return UserResponse(
@@ -726,42 +894,54 @@ async def update_notification_settings(
         {"id": user["id"]},
         {"$set": {"notification_settings": current}}
     )
+    user_cache.invalidate(user["id"])
     
     return NotificationSettings(**current)
 
 @api_router.delete("/user/account")
 async def delete_account(user: dict = Depends(get_current_user)):
     await db.users.delete_one({"id": user["id"]})
+    user_cache.invalidate(user["id"])
     await db.purchases.delete_many({"user_id": user["id"]})
+    revoke_media_access(user["id"])
     return {"message": "Account deleted successfully"}
 
 # ==================== COURSES ROUTES ====================
 
 @api_router.get("/courses", response_model=List[CourseResponse])
-async def get_courses(category: Optional[str] = None):
-    query = {}
-    if category:
-        query["category"] = category
+async def get_courses(request: Request, category: Optional[str] = None):
+    async def build():
+        query = {}
+        if category:
+            query["category"] = category
+        
+        courses = await db.courses.find(query, {"_id": 0}).to_list(100)
+        return [CourseResponse(**c).model_dump() for c in courses]
     
-    courses = await db.courses.find(query, {"_id": 0}).to_list(100)
-    return courses
+    return await serve_cached(request, build)
 
 @api_router.get("/courses/categories")
-async def get_categories():
-    categories = await db.courses.distinct("category")
-    return {"categories": categories}
+async def get_categories(request: Request):
+    async def build():
+        categories = await db.courses.distinct("category")
+        return {"categories": categories}
+    
+    return await serve_cached(request, build)
 
 @api_router.get("/courses/{course_id}", response_model=CourseResponse)
-async def get_course(course_id: str):
-    course = await db.courses.find_one({"id": course_id}, {"_id": 0})
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    return course
+async def get_course(request: Request, course_id: str):
+    async def build():
+        course = await db.courses.find_one({"id": course_id}, {"_id": 0})
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
+        return CourseResponse(**course).model_dump()
+    
+    return await serve_cached(request, build)
 
 @api_router.post("/courses", response_model=CourseResponse)
 async def create_course(course: CourseCreate):
     course_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = utc_now()
     
     course_doc = {
         "id": course_id,
@@ -770,6 +950,8 @@ async def create_course(course: CourseCreate):
     }
     
     await db.courses.insert_one(course_doc)
+    catalog_cache.clear()
+    media_owner_cache.clear()
     return CourseResponse(**course_doc)
 
 @api_router.get("/user/courses", response_model=List[CourseResponse])
@@ -798,6 +980,27 @@ async def check_course_access(course_id: str, user: dict = Depends(get_current_u
     })
     return {"has_access": purchase is not None}
 
+@api_router.post("/courses/{course_id}/media-token")
+async def create_media_token(course_id: str, user: dict = Depends(get_current_user)):
+    """Short-lived token for the course video URL (`?token=`); checked against purchases, not cached"""
+    purchase = await db.purchases.find_one(
+        {"user_id": user["id"], "course_id": course_id, "status": "completed"},
+        {"_id": 1}
+    )
+    if not purchase:
+        raise HTTPException(status_code=403, detail="Course not purchased")
+    payload = {
+        "sub": user["id"],
+        "course_id": course_id,
+        # Session decoding (get_current_user) rejects tokens with an audience
+        "aud": MEDIA_TOKEN_AUDIENCE,
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=MEDIA_TOKEN_TTL_SECONDS)
+    }
+    return {
+        "token": jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM),
+        "expires_in": MEDIA_TOKEN_TTL_SECONDS
+    }
+
 # ==================== PAYMENT ROUTES ====================
 
 COURSE_PRICES = {}
@@ -810,7 +1013,6 @@ async def get_course_price(course_id: str) -> float:
 
 @api_router.post("/payments/stripe/checkout")
 async def create_stripe_checkout(
-    request: Request,
     checkout_data: CheckoutRequest,
     user: dict = Depends(get_current_user)
 ):
@@ -832,28 +1034,28 @@ async def create_stripe_checkout(
     success_url = f"{host_url}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{host_url}/courses/{checkout_data.course_id}"
     
-    webhook_url = f"{str(request.base_url)}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-    
     metadata = {
         "user_id": user["id"],
         "course_id": checkout_data.course_id,
         "course_title": course["title"]
     }
     
-    checkout_request = CheckoutSessionRequest(
-        amount=amount,
-        currency="eur",
-        success_url=success_url,
-        cancel_url=cancel_url,
-        metadata=metadata,
-        payment_methods=["card", "link"]
-    )
-    
-    session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
+    try:
+        session = await stripe_checkout.create_checkout_session(
+            amount=amount,
+            currency="eur",
+            product_name=course["title"],
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata=metadata,
+            payment_methods=["card", "link"]
+        )
+    except PaymentError as e:
+        logger.error(f"Stripe checkout creation failed: {e}")
+        raise HTTPException(status_code=502, detail="Le paiement est temporairement indisponible")
     
     transaction_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
+    now = utc_now()
     
     await db.payment_transactions.insert_one({
         "id": transaction_id,
@@ -872,9 +1074,17 @@ async def create_stripe_checkout(
     
     return {"checkout_url": session.url, "session_id": session.session_id}
 
+def stripe_purchase_fields(transaction: dict) -> dict:
+    return {
+        "user_id": transaction["user_id"],
+        "course_id": transaction["course_id"],
+        "course_title": transaction["course_title"],
+        "amount": transaction["amount"],
+        "session_id": transaction["session_id"]
+    }
+
 @api_router.get("/payments/stripe/status/{session_id}")
 async def get_stripe_status(
-    request: Request,
     session_id: str,
     user: dict = Depends(get_current_user)
 ):
@@ -893,11 +1103,8 @@ async def get_stripe_status(
             "course_id": transaction["course_id"]
         }
     
-    webhook_url = f"{str(request.base_url)}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-    
     try:
-        status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
+        status = await stripe_checkout.get_checkout_status(session_id)
         
         await db.payment_transactions.update_one(
             {"session_id": session_id},
@@ -908,26 +1115,10 @@ async def get_stripe_status(
         )
         
         if status.payment_status == "paid":
-            existing = await db.purchases.find_one({
-                "session_id": session_id,
-                "status": "completed"
-            })
-            
-            if not existing:
-                purchase_id = str(uuid.uuid4())
-                now = datetime.now(timezone.utc).isoformat()
-                
-                await db.purchases.insert_one({
-                    "id": purchase_id,
-                    "user_id": transaction["user_id"],
-                    "course_id": transaction["course_id"],
-                    "course_title": transaction["course_title"],
-                    "amount": transaction["amount"],
-                    "payment_method": "stripe",
-                    "session_id": session_id,
-                    "status": "completed",
-                    "created_at": now
-                })
+            await fulfillment.fulfill(
+                "stripe", session_id, stripe_purchase_fields(transaction),
+                event_id=f"status:{session_id}", event_type="checkout.session.status_paid"
+            )
         
         return {
             "status": status.status,
@@ -944,58 +1135,69 @@ async def get_stripe_status(
 
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
+    """Verify and store the event, then acknowledge; the webhook inbox consumer does the rest"""
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
-    webhook_url = f"{str(request.base_url)}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
-    
     try:
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
+        event = stripe_checkout.verify_event(body, signature)
+    except InvalidSignature as e:
+        logger.warning(f"Rejected Stripe webhook: {e}")
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    
+    # If this fails the request fails too, and Stripe delivers the event again
+    await webhook_inbox.receive(
+        "stripe", event.get("id"), event.get("type", ""), checkout_session_id(event), body.decode("utf-8")
+    )
+    return {"status": "received"}
+
+async def process_stripe_event(event: dict):
+    """Handle a stored Stripe event; raising makes the inbox retry it"""
+    try:
+        webhook_response = await stripe_checkout.resolve_event(json.loads(event["payload"]))
+    except PaymentError as e:
+        if e.status == 404:
+            raise PermanentError(f"Unknown checkout session: {e}")
+        raise
+    event_id = webhook_response.event_id
+    
+    # The event log outlives the inbox's retention; an explicit replay runs again
+    if event_id and await fulfillment.begin_event(
+        "stripe", event_id, webhook_response.event_type, webhook_response.session_id
+    ) and not event["replays"]:
+        return
+    
+    outcome, purchase_id = "ignored", None
+    if webhook_response.event_type == "checkout.session.completed" and webhook_response.payment_status == "paid":
+        session_id = webhook_response.session_id
+        
+        transaction = await db.payment_transactions.find_one_and_update(
+            {"session_id": session_id},
+            {"$set": {
+                "status": "complete",
+                "payment_status": "paid"
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
         
-        if webhook_response.event_type == "checkout.session.completed":
-            session_id = webhook_response.session_id
-            metadata = webhook_response.metadata
-            
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {"$set": {
-                    "status": "complete",
-                    "payment_status": "paid"
-                }}
+        outcome = "unknown_session"
+        if transaction:
+            purchase, created = await fulfillment.upsert_purchase(
+                "stripe", session_id, stripe_purchase_fields(transaction)
             )
-            
-            transaction = await db.payment_transactions.find_one(
-                {"session_id": session_id},
-                {"_id": 0}
-            )
-            
-            if transaction:
-                existing = await db.purchases.find_one({
-                    "session_id": session_id,
-                    "status": "completed"
-                })
-                
-                if not existing:
-                    purchase_id = str(uuid.uuid4())
-                    now = datetime.now(timezone.utc).isoformat()
-                    
-                    await db.purchases.insert_one({
-                        "id": purchase_id,
-                        "user_id": transaction["user_id"],
-                        "course_id": transaction["course_id"],
-                        "course_title": transaction["course_title"],
-                        "amount": transaction["amount"],
-                        "payment_method": "stripe",
-                        "session_id": session_id,
-                        "status": "completed",
-                        "created_at": now
-                    })
-        
-        return {"status": "processed"}
-    except Exception as e:
-        logger.error(f"Webhook error: {e}")
-        return {"status": "error", "message": str(e)}
+            outcome, purchase_id = ("fulfilled" if created else "duplicate"), purchase["id"]
+    
+    if event_id:
+        await fulfillment.finish_event("stripe", event_id, outcome, purchase_id)
+
+webhook_inbox = WebhookInbox(
+    db.webhook_inbox,
+    process_stripe_event,
+    batch_size=WEBHOOK_INBOX_BATCH_SIZE,
+    max_attempts=WEBHOOK_INBOX_MAX_ATTEMPTS,
+    retry_base_seconds=WEBHOOK_INBOX_RETRY_BASE_SECONDS
+)
 
 # PayPal placeholder (basic implementation)
 @api_router.post("/payments/paypal/create")
@@ -1034,7 +1236,7 @@ async def seed_data():
             "thumbnail_url": "https://customer-assets.emergentagent.com/job_amelcoach/artifacts/300dg799_IMG_7778.jpeg",
             "teaser_url": None,
             "video_url": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         },
         {
             "id": str(uuid.uuid4()),
@@ -1047,7 +1249,7 @@ async def seed_data():
             "thumbnail_url": "https://images.unsplash.com/photo-1571019614242-c5c5dee9f50b?w=600",
             "teaser_url": "https://www.w3schools.com/html/mov_bbb.mp4",
             "video_url": "https://www.w3schools.com/html/mov_bbb.mp4",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         },
         {
             "id": str(uuid.uuid4()),
@@ -1060,7 +1262,7 @@ async def seed_data():
             "thumbnail_url": "https://images.unsplash.com/photo-1571019613454-1cb2f99b2d8b?w=600",
             "teaser_url": "https://www.w3schools.com/html/mov_bbb.mp4",
             "video_url": "https://www.w3schools.com/html/mov_bbb.mp4",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         },
         {
             "id": str(uuid.uuid4()),
@@ -1073,7 +1275,7 @@ async def seed_data():
             "thumbnail_url": "https://images.unsplash.com/photo-1518611012118-696072aa579a?w=600",
             "teaser_url": "https://www.w3schools.com/html/mov_bbb.mp4",
             "video_url": "https://www.w3schools.com/html/mov_bbb.mp4",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         },
         {
             "id": str(uuid.uuid4()),
@@ -1086,7 +1288,7 @@ async def seed_data():
             "thumbnail_url": "https://images.unsplash.com/photo-1544367567-0f2fcb009e0b?w=600",
             "teaser_url": "https://www.w3schools.com/html/mov_bbb.mp4",
             "video_url": "https://www.w3schools.com/html/mov_bbb.mp4",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         },
         {
             "id": str(uuid.uuid4()),
@@ -1099,7 +1301,7 @@ async def seed_data():
             "thumbnail_url": "https://images.unsplash.com/photo-1434608519344-49d77a699e1d?w=600",
             "teaser_url": "https://www.w3schools.com/html/mov_bbb.mp4",
             "video_url": "https://www.w3schools.com/html/mov_bbb.mp4",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         },
         {
             "id": str(uuid.uuid4()),
@@ -1112,11 +1314,13 @@ async def seed_data():
             "thumbnail_url": "https://images.unsplash.com/photo-1574680096145-d05b474e2155?w=600",
             "teaser_url": "https://www.w3schools.com/html/mov_bbb.mp4",
             "video_url": "https://www.w3schools.com/html/mov_bbb.mp4",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": utc_now()
         }
     ]
     
     await db.courses.insert_many(courses)
+    catalog_cache.clear()
+    media_owner_cache.clear()
     return {"message": "Data seeded successfully", "courses_created": len(courses)}
 
 @api_router.post("/init-ramadan-course")
@@ -1137,10 +1341,12 @@ async def init_ramadan_course():
         "thumbnail_url": "https://customer-assets.emergentagent.com/job_amelcoach/artifacts/300dg799_IMG_7778.jpeg",
         "teaser_url": None,
         "video_url": None,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": utc_now()
     }
     
     await db.courses.insert_one(ramadan_course)
+    catalog_cache.clear()
+    media_owner_cache.clear()
     return {"message": "Ramadan course created", "course_id": "prog_ramadan"}
 
 # ==================== ADMIN ROUTES ====================
@@ -1185,45 +1391,58 @@ async def get_admin_user(credentials: HTTPAuthorizationCredentials = Depends(sec
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def upload_extension(filename: str, default: str) -> str:
+    """File extension of an uploaded file name, restricted to [a-z0-9]"""
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return ext if ext.isalnum() and len(ext) <= 10 else default
+
+UPLOAD_TYPE_ERRORS = {"video/": "File must be a video", "image/": "File must be an image"}
+
+async def save_upload(upload: UploadFile, dest_dir: Path, filename: str, max_bytes: int, content_type_prefix: str):
+    try:
+        return await store_upload(upload, dest_dir, filename, max_bytes, content_type_prefix=content_type_prefix)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes // (1024 * 1024)} MB)")
+    except UnsupportedUploadType:
+        raise HTTPException(status_code=400, detail=UPLOAD_TYPE_ERRORS[content_type_prefix])
+
+def discard_uploads(paths: List[Path]) -> None:
+    """Delete files stored for a request that failed afterwards"""
+    for path in paths:
+        try:
+            path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not delete orphaned upload {path}: {e}")
+
 @api_router.post("/admin/upload/video")
 async def upload_video(
     file: UploadFile = File(...),
     admin: dict = Depends(get_admin_user)
 ):
-    if not file.content_type.startswith("video/"):
-        raise HTTPException(status_code=400, detail="File must be a video")
-    
     # Generate unique filename
-    file_ext = file.filename.split(".")[-1] if "." in file.filename else "mp4"
+    file_ext = upload_extension(file.filename, "mp4")
     filename = f"{uuid.uuid4()}.{file_ext}"
-    file_path = VIDEOS_DIR / filename
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stream file to disk
+    stored = await save_upload(file, VIDEOS_DIR, filename, MAX_VIDEO_UPLOAD_BYTES, "video/")
     
     # Return the URL
-    return {"url": f"/uploads/videos/{filename}", "filename": filename}
+    return {"url": f"/uploads/videos/{filename}", "filename": filename, "size": stored.size, "sha256": stored.sha256}
 
 @api_router.post("/admin/upload/thumbnail")
 async def upload_thumbnail(
     file: UploadFile = File(...),
     admin: dict = Depends(get_admin_user)
 ):
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
     # Generate unique filename
-    file_ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
+    file_ext = upload_extension(file.filename, "jpg")
     filename = f"{uuid.uuid4()}.{file_ext}"
-    file_path = THUMBNAILS_DIR / filename
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stream file to disk
+    stored = await save_upload(file, THUMBNAILS_DIR, filename, MAX_IMAGE_UPLOAD_BYTES, "image/")
     
     # Return the URL
-    return {"url": f"/uploads/thumbnails/{filename}", "filename": filename}
+    return {"url": f"/uploads/thumbnails/{filename}", "filename": filename, "size": stored.size, "sha256": stored.sha256}
 
 @api_router.post("/admin/courses", response_model=CourseResponse)
 async def admin_create_course(
@@ -1242,53 +1461,59 @@ async def admin_create_course(
     admin: dict = Depends(get_admin_user)
 ):
     course_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
-    
-    # Handle video upload
-    final_video_url = video_url
-    if video and video.filename:
-        file_ext = video.filename.split(".")[-1] if "." in video.filename else "mp4"
-        filename = f"{course_id}_video.{file_ext}"
-        file_path = VIDEOS_DIR / filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(video.file, buffer)
-        final_video_url = f"/uploads/videos/{filename}"
-    
-    # Handle teaser upload
-    final_teaser_url = teaser_url
-    if teaser and teaser.filename:
-        file_ext = teaser.filename.split(".")[-1] if "." in teaser.filename else "mp4"
-        filename = f"{course_id}_teaser.{file_ext}"
-        file_path = VIDEOS_DIR / filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(teaser.file, buffer)
-        final_teaser_url = f"/uploads/videos/{filename}"
-    
-    # Handle thumbnail upload
-    final_thumbnail_url = thumbnail_url
-    if thumbnail and thumbnail.filename:
-        file_ext = thumbnail.filename.split(".")[-1] if "." in thumbnail.filename else "jpg"
-        filename = f"{course_id}_thumb.{file_ext}"
-        file_path = THUMBNAILS_DIR / filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(thumbnail.file, buffer)
-        final_thumbnail_url = f"/uploads/thumbnails/{filename}"
+    now = utc_now()
     
-    course_doc = {
-        "id": course_id,
-        "title": title,
-        "description": description,
-        "category": category,
-        "duration_minutes": duration_minutes,
-        "level": level,
-        "price": price,
-        "video_url": final_video_url,
-        "teaser_url": final_teaser_url,
-        "thumbnail_url": final_thumbnail_url,
-        "created_at": now
-    }
+    # Files stored so far are deleted if a later one (or the insert) fails
+    stored_paths: List[Path] = []
+    try:
+        # Handle video upload
+        final_video_url = video_url
+        if video and video.filename:
+            file_ext = upload_extension(video.filename, "mp4")
+            filename = f"{course_id}_video.{file_ext}"
+            stored = await save_upload(video, VIDEOS_DIR, filename, MAX_VIDEO_UPLOAD_BYTES, "video/")
+            stored_paths.append(stored.path)
+            final_video_url = f"/uploads/videos/{filename}"
+        
+        # Handle teaser upload
+        final_teaser_url = teaser_url
+        if teaser and teaser.filename:
+            file_ext = upload_extension(teaser.filename, "mp4")
+            filename = f"{course_id}_teaser.{file_ext}"
+            stored = await save_upload(teaser, VIDEOS_DIR, filename, MAX_VIDEO_UPLOAD_BYTES, "video/")
+            stored_paths.append(stored.path)
+            final_teaser_url = f"/uploads/videos/{filename}"
+        
+        # Handle thumbnail upload
+        final_thumbnail_url = thumbnail_url
+        if thumbnail and thumbnail.filename:
+            file_ext = upload_extension(thumbnail.filename, "jpg")
+            filename = f"{course_id}_thumb.{file_ext}"
+            stored = await save_upload(thumbnail, THUMBNAILS_DIR, filename, MAX_IMAGE_UPLOAD_BYTES, "image/")
+            stored_paths.append(stored.path)
+            final_thumbnail_url = f"/uploads/thumbnails/{filename}"
+        
+        course_doc = {
+            "id": course_id,
+            "title": title,
+            "description": description,
+            "category": category,
+            "duration_minutes": duration_minutes,
+            "level": level,
+            "price": price,
+            "video_url": final_video_url,
+            "teaser_url": final_teaser_url,
+            "thumbnail_url": final_thumbnail_url,
+            "created_at": now
+        }
+        
+        await db.courses.insert_one(course_doc)
+    except BaseException:
+        discard_uploads(stored_paths)
+        raise
     
-    await db.courses.insert_one(course_doc)
+    catalog_cache.clear()
+    media_owner_cache.clear()
     return CourseResponse(**course_doc)
 
 @api_router.put("/admin/courses/{course_id}", response_model=CourseResponse)
@@ -1304,6 +1529,8 @@ async def admin_update_course(
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if update_data:
         await db.courses.update_one({"id": course_id}, {"$set": update_data})
+        catalog_cache.clear()
+        media_owner_cache.clear()
     
     updated_course = await db.courses.find_one({"id": course_id}, {"_id": 0})
     return CourseResponse(**updated_course)
@@ -1334,6 +1561,8 @@ async def admin_delete_course(
             thumb_path.unlink()
     
     await db.courses.delete_one({"id": course_id})
+    catalog_cache.clear()
+    media_owner_cache.clear()
     return {"message": "Course deleted successfully"}
 
 @api_router.get("/admin/courses", response_model=List[CourseResponse])
@@ -1341,6 +1570,123 @@ async def admin_get_all_courses(admin: dict = Depends(get_admin_user)):
     courses = await db.courses.find({}, {"_id": 0}).to_list(100)
     return courses
 
+@api_router.get("/admin/metrics")
+async def admin_get_metrics(admin: dict = Depends(get_admin_user)):
+    """In-process cache and worker counters for this API instance"""
+    return {
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "apple_keys": apple_key_store.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "media_access_cache": media_access_cache.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "nutrition_db": nutrition_index.stats(),
+        "meal_images": image_preprocessor.stats(),
+        "analysis_jobs": analysis_workers.stats(),
+        "llm_guard": llm_guard.stats(),
+        "email_outbox": email_outbox.stats(),
+        "email_templates": email_templates.stats(),
+        "payments": stripe_checkout.stats(),
+        "fulfillment": fulfillment.stats(),
+        "webhook_inbox": webhook_inbox.stats()
+    }
+
+@api_router.post("/admin/email-outbox/requeue-dead")
+async def admin_requeue_dead_emails(admin: dict = Depends(get_admin_user)):
+    """Send dead-lettered emails again with a fresh set of attempts"""
+    return {"requeued": await email_outbox.requeue_dead()}
+
+@api_router.post("/admin/webhooks/replay-dead")
+async def admin_replay_dead_webhooks(admin: dict = Depends(get_admin_user)):
+    """Process dead-lettered webhook events again with a fresh set of attempts"""
+    return {"replayed": await webhook_inbox.replay()}
+
+@api_router.get("/admin/indexes")
+async def admin_get_indexes(admin: dict = Depends(get_admin_user)):
+    """Report missing, mismatched and extra Mongo indexes"""
+    return await verify_indexes(db)
+
+# ==================== MEDIA ROUTES ====================
+
+async def media_owner(filename: str) -> Optional[dict]:
+    """Course that uses /uploads/videos/{filename}, and whether as video or teaser"""
+    owner = media_owner_cache.get(filename)
+    if owner is None:
+        url = f"/uploads/videos/{filename}"
+        # A file that is any course's full video stays gated, even if another course uses it as teaser
+        course = await db.courses.find_one({"video_url": url}, {"_id": 0, "id": 1})
+        gated = course is not None
+        if not gated:
+            course = await db.courses.find_one({"teaser_url": url}, {"_id": 0, "id": 1})
+        owner = {"course_id": course["id"] if course else None, "gated": gated}
+        media_owner_cache.set(filename, owner)
+    return owner
+
+def revoke_media_access(user_id: str) -> None:
+    """Drop cached video grants of a user; call after any write that removes purchases"""
+    media_access_cache.invalidate_where(lambda key: key[0] == user_id)
+
+def check_media_token(token: str, course_id: str) -> None:
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], audience=MEDIA_TOKEN_AUDIENCE)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("course_id") != course_id:
+        raise HTTPException(status_code=403, detail="Course not purchased")
+
+async def has_media_access(token: Optional[str], course_id: str) -> bool:
+    """Purchase check for a session JWT sent in the Authorization header"""
+    if not token:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") == "admin":
+        return True
+    
+    key = (payload.get("sub"), course_id)
+    if media_access_cache.get(key):
+        return True
+    purchase = await db.purchases.find_one(
+        {"user_id": payload.get("sub"), "course_id": course_id, "status": "completed"},
+        {"_id": 1}
+    )
+    # Only grants are cached so a fresh purchase is playable right away
+    if purchase:
+        media_access_cache.set(key, True)
+    return purchase is not None
+
+@app.api_route("/uploads/videos/{filename}", methods=["GET", "HEAD"])
+async def serve_video(filename: str, request: Request, token: Optional[str] = None):
+    """Serve course videos with Range support; full videos require a purchase
+    
+    `<video>` elements cannot send headers, so they pass a media token from
+    POST /courses/{course_id}/media-token as the `token` query parameter.
+    The session JWT is only accepted in the Authorization header.
+    """
+    if filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    owner = await media_owner(filename)
+    if owner["gated"]:
+        auth = request.headers.get("authorization", "")
+        bearer = auth[7:] if auth.lower().startswith("bearer ") else None
+        if bearer:
+            if not await has_media_access(bearer, owner["course_id"]):
+                raise HTTPException(status_code=403, detail="Course not purchased")
+        elif token:
+            check_media_token(token, owner["course_id"])
+        else:
+            raise HTTPException(status_code=401, detail="Authentication required")
+        cache_control = "private, max-age=31536000, immutable"
+    else:
+        cache_control = "public, max-age=31536000, immutable"
+    
+    return media_response(request, VIDEOS_DIR / filename, cache_control)
+
 # ==================== SITE CONTENT MANAGEMENT ====================
 
 DEFAULT_SITE_CONTENT = {
@@ -1398,20 +1744,24 @@ DEFAULT_SITE_CONTENT = {
 }
 
 @api_router.get("/site-content")
-async def get_site_content():
+async def get_site_content(request: Request):
     """Get site content - public endpoint"""
-    content = await db.site_content.find_one({"id": "main"}, {"_id": 0})
-    if not content:
-        return DEFAULT_SITE_CONTENT
-    return content
+    async def build():
+        content = await db.site_content.find_one({"id": "main"}, {"_id": 0})
+        if not content:
+            return DEFAULT_SITE_CONTENT
+        return content
+    
+    return await serve_cached(request, build)
 
 @api_router.get("/admin/site-content")
 async def admin_get_site_content(admin: dict = Depends(get_admin_user)):
     """Get site content for admin"""
     content = await db.site_content.find_one({"id": "main"}, {"_id": 0})
     if not content:
-        # Initialize with default content
-        await db.site_content.insert_one(DEFAULT_SITE_CONTENT)
+        # Initialize with default content (insert a copy: Mongo adds an _id)
+        await db.site_content.insert_one(dict(DEFAULT_SITE_CONTENT))
+        catalog_cache.clear()
         return DEFAULT_SITE_CONTENT
     return content
 
@@ -1427,13 +1777,14 @@ async def admin_update_site_content(
         existing = DEFAULT_SITE_CONTENT.copy()
     
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = utc_now()
     
     await db.site_content.update_one(
         {"id": "main"},
         {"$set": update_data},
         upsert=True
     )
+    catalog_cache.clear()
     
     updated = await db.site_content.find_one({"id": "main"}, {"_id": 0})
     return updated
@@ -1446,9 +1797,10 @@ async def admin_update_hero(
     """Update hero section"""
     await db.site_content.update_one(
         {"id": "main"},
-        {"$set": {"hero": hero.model_dump(), "updated_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {"hero": hero.model_dump(), "updated_at": utc_now()}},
         upsert=True
     )
+    catalog_cache.clear()
     return {"message": "Hero updated", "hero": hero}
 
 @api_router.put("/admin/site-content/programs")
@@ -1459,9 +1811,10 @@ async def admin_update_programs(
     """Update programs"""
     await db.site_content.update_one(
         {"id": "main"},
-        {"$set": {"programs": [p.model_dump() for p in programs], "updated_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {"programs": [p.model_dump() for p in programs], "updated_at": utc_now()}},
         upsert=True
     )
+    catalog_cache.clear()
     return {"message": "Programs updated", "programs": programs}
 
 @api_router.put("/admin/site-content/colors")
@@ -1472,9 +1825,10 @@ async def admin_update_colors(
     """Update color theme"""
     await db.site_content.update_one(
         {"id": "main"},
-        {"$set": {"colors": colors.model_dump(), "updated_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {"colors": colors.model_dump(), "updated_at": utc_now()}},
         upsert=True
     )
+    catalog_cache.clear()
     return {"message": "Colors updated", "colors": colors}
 
 @api_router.post("/admin/upload/image")
@@ -1483,42 +1837,21 @@ async def admin_upload_image(
     admin: dict = Depends(get_admin_user)
 ):
     """Upload image for site content"""
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
-    file_ext = file.filename.split(".")[-1] if "." in file.filename else "jpg"
+    file_ext = upload_extension(file.filename, "jpg")
     filename = f"site_{uuid.uuid4()}.{file_ext}"
-    file_path = THUMBNAILS_DIR / filename
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    stored = await save_upload(file, THUMBNAILS_DIR, filename, MAX_IMAGE_UPLOAD_BYTES, "image/")
     
-    return {"url": f"/uploads/thumbnails/{filename}", "filename": filename}
+    return {"url": f"/uploads/thumbnails/{filename}", "filename": filename, "size": stored.size, "sha256": stored.sha256}
 
 # ==================== ROOT ====================
 
 # ==================== CALORIE TRACKER ROUTES ====================
 
-@api_router.post("/calories/analyze", response_model=CalorieAnalysisResponse)
-async def analyze_meal_calories(
-    request: CalorieAnalysisRequest,
-    user: dict = Depends(get_current_user)
-):
-    """Analyze a meal photo or text description and return nutritional information using GPT-4o"""
-    if not EMERGENT_LLM_KEY:
-        raise HTTPException(status_code=500, detail="AI service not configured")
-    
-    # Validate that we have either image or text
-    if not request.image_base64 and not request.meal_description:
-        raise HTTPException(status_code=400, detail="Veuillez fournir une image ou une description du repas")
-    
-    try:
-        # Initialize GPT-4o chat
-        session_id = f"calorie_analysis_{user['id']}_{uuid.uuid4().hex[:8]}"
-        
-        # Different system message based on input type
-        if request.meal_description:
-            system_msg = """Tu es un expert nutritionniste. Analyse la description du repas fournie par l'utilisateur.
+# Bump when the prompts change so cached analyses are not reused
+CALORIE_PROMPT_VERSION = "1"
+
+MEAL_TEXT_SYSTEM_PROMPT = """Tu es un expert nutritionniste. Analyse la description du repas fournie par l'utilisateur.
 Pour chaque aliment mentionné, estime:
 - Le nom de l'aliment
 - La quantité approximative (en grammes ou portions standard)
@@ -1538,8 +1871,8 @@ Réponds UNIQUEMENT en JSON valide avec ce format exact:
     "total_fats": 3.0,
     "analysis_text": "Description courte du repas analysé"
 }"""
-        else:
-            system_msg = """Tu es un expert nutritionniste. Analyse l'image du repas et identifie tous les aliments visibles.
+
+MEAL_IMAGE_SYSTEM_PROMPT = """Tu es un expert nutritionniste. Analyse l'image du repas et identifie tous les aliments visibles.
 Pour chaque aliment, estime:
 - Le nom de l'aliment
 - La quantité approximative (en grammes ou portions)
@@ -1559,120 +1892,571 @@ Réponds UNIQUEMENT en JSON valide avec ce format exact:
     "total_fats": 3.0,
     "analysis_text": "Description courte du repas analysé"
 }"""
-        
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=session_id,
-            system_message=system_msg
+
+analysis_cache = AnalysisCache(
+    db.llm_analysis_cache,
+    prompt_version=CALORIE_PROMPT_VERSION,
+    ttl_seconds=ANALYSIS_CACHE_TTL_SECONDS,
+    max_entries=ANALYSIS_CACHE_MAX_ENTRIES
+)
+
+llm_guard = LlmGuard(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    per_user_limit=LLM_PER_USER_LIMIT,
+    call_timeout=LLM_CALL_TIMEOUT_SECONDS,
+    queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS,
+    breaker=CircuitBreaker(
+        error_rate=LLM_BREAKER_ERROR_RATE,
+        min_calls=LLM_BREAKER_MIN_CALLS,
+        window_seconds=LLM_BREAKER_WINDOW_SECONDS,
+        cooldown_seconds=LLM_BREAKER_COOLDOWN_SECONDS
+    )
+)
+
+image_preprocessor = ImagePreprocessor(
+    max_edge=MEAL_IMAGE_MAX_EDGE,
+    fmt=MEAL_IMAGE_FORMAT,
+    quality=MEAL_IMAGE_QUALITY,
+    max_workers=MEAL_IMAGE_WORKERS
+)
+
+MACRO_FIELDS = ("proteins", "carbs", "fats")
+
+def parse_food_item(item: Any) -> Optional[dict]:
+    if not isinstance(item, dict):
+        return None
+    candidate = {field: coerce_number(item.get(field)) for field in ("calories",) + MACRO_FIELDS}
+    if isinstance(candidate["calories"], float):
+        candidate["calories"] = round(candidate["calories"])
+    candidate["name"] = item.get("name")
+    candidate["quantity"] = str(item.get("quantity") or "1 portion")
+    try:
+        return FoodItem.model_validate(candidate).model_dump()
+    except ValidationError:
+        return None
+
+def parse_meal_analysis(response: str) -> Optional[dict]:
+    """Extract and validate the JSON analysis from an AI response, None if there is none"""
+    data = extract_json_object(response, required_key="foods")
+    if data is None:
+        logger.error(f"Failed to parse AI response: {response}")
+        return None
+    
+    foods = [food for food in map(parse_food_item, data.get("foods") or []) if food]
+    if not foods:
+        logger.error(f"AI response has no valid food items: {response}")
+        return None
+    if len(foods) < len(data.get("foods") or []):
+        logger.warning(f"Dropped {len(data['foods']) - len(foods)} invalid food items from AI response")
+    
+    # The per-food values are what the user sees: totals must add up to them
+    totals = {"total_calories": sum(f["calories"] for f in foods)}
+    for field in MACRO_FIELDS:
+        totals[f"total_{field}"] = round(sum(f[field] for f in foods), 1)
+    for key, computed in totals.items():
+        reported = coerce_number(data.get(key))
+        tolerance = 1 if key == "total_calories" else 0.5
+        if not isinstance(reported, (int, float)) or abs(reported - computed) > tolerance:
+            logger.info(f"AI {key} {reported!r} disagrees with its foods ({computed}), using the sum")
+    
+    return {
+        "foods": foods,
+        **totals,
+        "analysis_text": str(data.get("analysis_text") or "")
+    }
+
+async def call_meal_llm(user_id: str, meal_description: Optional[str] = None, image_base64: Optional[str] = None) -> Optional[dict]:
+    """Ask GPT-4o for a nutritional analysis of a meal description or photo"""
+    session_id = f"calorie_analysis_{user_id}_{uuid.uuid4().hex[:8]}"
+    
+    # Different system message based on input type
+    chat = LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=session_id,
+        system_message=MEAL_TEXT_SYSTEM_PROMPT if meal_description else MEAL_IMAGE_SYSTEM_PROMPT
+    )
+    chat.with_model("openai", "gpt-4o")
+    
+    # Create message based on input type
+    if meal_description:
+        # Text-based analysis
+        user_message = UserMessage(
+            text=f"Analyse ce repas et donne-moi les informations nutritionnelles en JSON: {meal_description}"
         )
-        chat.with_model("openai", "gpt-4o")
-        
-        # Create message based on input type
-        if request.meal_description:
-            # Text-based analysis
-            user_message = UserMessage(
-                text=f"Analyse ce repas et donne-moi les informations nutritionnelles en JSON: {request.meal_description}"
-            )
+    else:
+        # Image-based analysis
+        image_content = ImageContent(image_base64=image_base64)
+        user_message = UserMessage(
+            text="Analyse ce repas et donne-moi les informations nutritionnelles détaillées en JSON.",
+            file_contents=[image_content]
+        )
+    
+    response = await chat.send_message(user_message)
+    return parse_meal_analysis(response)
+
+async def prepare_meal_image(image_base64: Optional[str] = None, upload: Optional[UploadFile] = None) -> PreparedImage:
+    """Decode, strip and shrink a meal photo (base64 or multipart) on the image worker pool"""
+    try:
+        if upload is not None:
+            image = await image_preprocessor.prepare_file(upload.file)
         else:
-            # Image-based analysis
-            image_content = ImageContent(image_base64=request.image_base64)
-            user_message = UserMessage(
-                text="Analyse ce repas et donne-moi les informations nutritionnelles détaillées en JSON.",
-                file_contents=[image_content]
-            )
-        
-        response = await chat.send_message(user_message)
-        
-        # Parse JSON response
-        try:
-            # Try to extract JSON from the response
-            json_match = re.search(r'\{[\s\S]*\}', response)
-            if json_match:
-                analysis_data = json.loads(json_match.group())
-            else:
-                raise ValueError("No JSON found in response")
-        except (json.JSONDecodeError, ValueError) as e:
-            logger.error(f"Failed to parse AI response: {response}")
-            # Provide default response if parsing fails
-            analysis_data = {
-                "foods": [{"name": "Repas non identifié", "quantity": "1 portion", "calories": 400, "proteins": 15.0, "carbs": 50.0, "fats": 15.0}],
-                "total_calories": 400,
-                "total_proteins": 15.0,
-                "total_carbs": 50.0,
-                "total_fats": 15.0,
-                "analysis_text": "Impossible d'analyser précisément ce repas. Estimation approximative fournie."
-            }
-        
-        # Save to database
-        meal_id = str(uuid.uuid4())
-        now = datetime.now(timezone.utc).isoformat()
-        
-        meal_doc = {
-            "id": meal_id,
-            "user_id": user["id"],
-            "foods": analysis_data.get("foods", []),
-            "total_calories": analysis_data.get("total_calories", 0),
-            "total_proteins": analysis_data.get("total_proteins", 0.0),
-            "total_carbs": analysis_data.get("total_carbs", 0.0),
-            "total_fats": analysis_data.get("total_fats", 0.0),
-            "meal_type": request.meal_type,
-            "analysis_text": analysis_data.get("analysis_text", ""),
-            "created_at": now
-        }
-        
-        await db.meal_history.insert_one(meal_doc)
-        
-        return CalorieAnalysisResponse(**meal_doc)
+            image = await image_preprocessor.prepare_base64(image_base64)
+    except InvalidImage as e:
+        logger.warning(f"Rejected meal photo: {e}")
+        raise HTTPException(status_code=400, detail="Image illisible, veuillez réessayer avec une autre photo")
+    logger.info(
+        f"Meal photo {image.original_bytes} -> {len(image.data)} bytes "
+        f"({image.width}x{image.height} {image.format}) in {image.elapsed_ms:.1f} ms"
+    )
+    return image
+
+async def analyze_with_llm(user_id: str, meal_description: Optional[str] = None, image: Optional[PreparedImage] = None,
+                           wait_for_user: bool = False) -> dict:
+    """LLM analysis of a meal, served from the analysis cache when possible
+
+    Raises LlmUnavailable when the LLM cannot be reached; callers decide
+    whether a local estimate can stand in for it. Nothing made up is ever
+    returned, since whatever this returns is saved as the user's meal.
+    """
+    if meal_description:
+        cache_key = analysis_cache.text_key(meal_description)
+    else:
+        # Pre-processing is deterministic, so the same photo always yields the same bytes
+        cache_key = analysis_cache.image_key(image.data)
+    try:
+        cached = await analysis_cache.get(cache_key)
+    except Exception as e:
+        logger.warning(f"Analysis cache lookup failed: {e}")
+        cached = None
+    if cached is not None:
+        return cached
+    
+    if not EMERGENT_LLM_KEY:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    try:
+        analysis_data = await llm_guard.call(
+            user_id,
+            lambda: call_meal_llm(user_id, meal_description, image.base64() if image else None),
+            wait_for_user=wait_for_user
+        )
+    except UserBusy:
+        raise HTTPException(status_code=429, detail="Une analyse est déjà en cours, veuillez patienter")
+    except LlmUnavailable as e:
+        logger.warning(f"LLM unavailable for {user_id}: {e}")
+        raise
+    if analysis_data is None:
+        # Unparseable answer: fail rather than log invented calories (never cached)
+        raise HTTPException(status_code=502, detail="Impossible d'analyser ce repas, réessaie avec plus de détails")
+    
+    try:
+        await analysis_cache.put(cache_key, analysis_data)
+    except Exception as e:
+        logger.warning(f"Analysis cache store failed: {e}")
+    return analysis_data
+
+async def analyze_meal(user_id: str, meal_description: Optional[str] = None, image: Optional[PreparedImage] = None,
+                       wait_for_user: bool = False) -> dict:
+    """Nutritional analysis of a meal: local food table first, LLM for whatever it does not know"""
+    local = nutrition_index.resolve(meal_description) if meal_description else None
+    if local and local.complete:
+        return summarize_foods(local.foods, "Estimation à partir de la table nutritionnelle : " + describe_foods(local.foods))
+    
+    try:
+        if not meal_description:
+            return await analyze_with_llm(user_id, image=image, wait_for_user=wait_for_user)
+        if not local.foods:
+            return await analyze_with_llm(user_id, meal_description, wait_for_user=wait_for_user)
+        # Only the items the table could not resolve go to the LLM
+        remainder = await analyze_with_llm(user_id, ", ".join(local.unmatched), wait_for_user=wait_for_user)
+    except LlmUnavailable:
+        if not (LLM_FALLBACK_ENABLED and local and local.foods):
+            raise HTTPException(status_code=503, detail="Service d'analyse momentanément indisponible")
+        # Only what the table actually matched is counted; the rest is named, not guessed
+        llm_guard.fallbacks += 1
+        return summarize_foods(local.foods, (
+            "Service d'analyse momentanément indisponible. Estimation partielle à partir de la table "
+            f"nutritionnelle : {describe_foods(local.foods)}. Non estimé : {', '.join(local.unmatched)}."
+        ))
+    return merge_analyses(local.foods, remainder)
+
+def build_meal_doc(user_id: str, analysis_data: dict, meal_type: str, meal_id: Optional[str] = None) -> dict:
+    return {
+        "id": meal_id or str(uuid.uuid4()),
+        "user_id": user_id,
+        "foods": analysis_data.get("foods", []),
+        "total_calories": analysis_data.get("total_calories", 0),
+        "total_proteins": analysis_data.get("total_proteins", 0.0),
+        "total_carbs": analysis_data.get("total_carbs", 0.0),
+        "total_fats": analysis_data.get("total_fats", 0.0),
+        "meal_type": meal_type,
+        "analysis_text": analysis_data.get("analysis_text", ""),
+        "created_at": utc_now()
+    }
+
+async def save_meal(meal_doc: dict):
+    await db.meal_history.insert_one(meal_doc)
+    await nutrition_rollups.apply_meal(db, meal_doc)
+
+async def save_meal_once(meal_doc: dict) -> dict:
+    """Store a meal whose id is derived from its source unless it already is; returns the stored meal
+    
+    Analysis jobs can run more than once (a worker lost its lease), and each
+    run must not log the meal or count it in the daily rollup again.
+    """
+    try:
+        result = await db.meal_history.update_one({"id": meal_doc["id"]}, {"$setOnInsert": meal_doc}, upsert=True)
+        inserted = result.upserted_id is not None
+    except DuplicateKeyError:
+        inserted = False  # a concurrent run stored it first
+    if not inserted:
+        return await db.meal_history.find_one({"id": meal_doc["id"]}, {"_id": 0})
+    await nutrition_rollups.apply_meal(db, meal_doc)
+    return meal_doc
+
+async def record_analyzed_meal(
+    user_id: str,
+    meal_type: str,
+    meal_description: Optional[str] = None,
+    image: Optional[PreparedImage] = None,
+    response: Optional[Response] = None,
+    wait_for_user: bool = False,
+    meal_id: Optional[str] = None
+) -> CalorieAnalysisResponse:
+    """Analyze a meal and log it; with a `meal_id` the meal is logged at most once"""
+    if image and response is not None:
+        response.headers["Server-Timing"] = f'image;dur={image.elapsed_ms:.1f};desc="saved {image.bytes_saved} bytes"'
+    analysis_data = await analyze_meal(user_id, meal_description, image, wait_for_user)
+    
+    # Save to database (cache hits still log a new meal)
+    meal_doc = build_meal_doc(user_id, analysis_data, meal_type, meal_id)
+    if image:
+        meal_doc["image_phash"] = image.phash
+    if meal_id:
+        meal_doc = await save_meal_once(meal_doc)
+    else:
+        await save_meal(meal_doc)
+    
+    return CalorieAnalysisResponse(**meal_doc)
+
+@api_router.post("/calories/analyze", response_model=CalorieAnalysisResponse)
+async def analyze_meal_calories(
+    request: CalorieAnalysisRequest,
+    response: Response,
+    user: dict = Depends(get_current_user)
+):
+    """Analyze a meal photo or text description and return nutritional information using GPT-4o"""
+    # Validate that we have either image or text
+    if not request.image_base64 and not request.meal_description:
+        raise HTTPException(status_code=400, detail="Veuillez fournir une image ou une description du repas")
+    
+    try:
+        image = None
+        if not request.meal_description:
+            image = await prepare_meal_image(image_base64=request.image_base64)
+        return await record_analyzed_meal(user["id"], request.meal_type, request.meal_description, image, response)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing meal: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur lors de l'analyse: {str(e)}")
 
-@api_router.get("/calories/history", response_model=List[MealHistoryResponse])
+@api_router.post("/calories/analyze/upload", response_model=CalorieAnalysisResponse)
+async def analyze_meal_upload(
+    response: Response,
+    image: UploadFile = File(...),
+    meal_type: str = Form("repas"),
+    user: dict = Depends(get_current_user)
+):
+    """Analyze a meal photo sent as multipart/form-data (no base64 round trip)"""
+    # Starlette spools the part to a temp file, so only the decoder ever holds the pixels
+    if image.size is not None and image.size > MAX_MEAL_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="Image trop volumineuse")
+    
+    try:
+        prepared = await prepare_meal_image(upload=image)
+        return await record_analyzed_meal(user["id"], meal_type, image=prepared, response=response)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing meal upload: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur lors de l'analyse: {str(e)}")
+    finally:
+        await image.close()
+
+async def analyze_batch_item(user_id: str, item: CalorieAnalysisRequest) -> dict:
+    if not item.image_base64 and not item.meal_description:
+        raise HTTPException(status_code=400, detail="Veuillez fournir une image ou une description du repas")
+    image = None
+    if not item.meal_description:
+        image = await prepare_meal_image(image_base64=item.image_base64)
+    # Items of one batch queue behind the user's LLM limit instead of failing on it
+    analysis_data = await analyze_meal(user_id, item.meal_description, image, wait_for_user=True)
+    meal_doc = build_meal_doc(user_id, analysis_data, item.meal_type)
+    if image:
+        meal_doc["image_phash"] = image.phash
+    return meal_doc
+
+@api_router.post("/calories/analyze/batch", response_model=BatchAnalysisResponse)
+async def analyze_meal_batch(
+    request: BatchAnalysisRequest,
+    user: dict = Depends(get_current_user)
+):
+    """Analyze several meals at once; each item succeeds or fails on its own"""
+    if not request.meals:
+        raise HTTPException(status_code=400, detail="Aucun repas à analyser")
+    outcomes = await asyncio.gather(
+        *(analyze_batch_item(user["id"], item) for item in request.meals),
+        return_exceptions=True
+    )
+    
+    errors: Dict[int, str] = {}
+    docs: Dict[int, dict] = {}
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, HTTPException):
+            errors[index] = outcome.detail
+        elif isinstance(outcome, Exception):
+            logger.error(f"Error analyzing batch meal {index}: {outcome}")
+            errors[index] = "Erreur lors de l'analyse"
+        else:
+            docs[index] = outcome
+    
+    if docs:
+        order = list(docs)
+        try:
+            await db.meal_history.insert_many([docs[index] for index in order], ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                index = order[write_error["index"]]
+                logger.error(f"Failed to save batch meal {index}: {write_error.get('errmsg')}")
+                errors[index] = "Erreur lors de l'enregistrement"
+                docs.pop(index)
+        await nutrition_rollups.apply_meals(db, list(docs.values()))
+    
+    results = []
+    for index in range(len(request.meals)):
+        if index in docs:
+            results.append(BatchItemResult(index=index, status="ok", meal=CalorieAnalysisResponse(**docs[index])))
+        else:
+            results.append(BatchItemResult(index=index, status="error", error=errors[index]))
+    return BatchAnalysisResponse(results=results, succeeded=len(docs), failed=len(errors))
+
+# Job mode: the POST returns at once and a worker pool runs the analysis
+
+class AnalysisJobResponse(BaseModel):
+    id: str
+    status: str  # queued, running, done, failed
+    created_at: IsoDatetime
+    updated_at: IsoDatetime
+    result: Optional[CalorieAnalysisResponse] = None
+    error: Optional[str] = None
+
+def job_response(job: dict) -> AnalysisJobResponse:
+    return AnalysisJobResponse(
+        id=job["id"],
+        status=job["status"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+        result=job.get("result"),
+        error=job.get("error")
+    )
+
+async def run_analysis_job(job: dict) -> dict:
+    payload = job["payload"]
+    image = PreparedImage(**payload["image"]) if payload.get("image") else None
+    # A job re-run after its lease expired reuses the meal the first run logged
+    meal_id = job["id"]
+    stored = await db.meal_history.find_one({"id": meal_id}, {"_id": 0})
+    if stored:
+        return jsonable_encoder(CalorieAnalysisResponse(**stored))
+    try:
+        # Queued jobs wait for the user's LLM slot instead of failing on it
+        meal = await record_analyzed_meal(
+            job["user_id"], payload["meal_type"], payload.get("meal_description"), image, wait_for_user=True,
+            meal_id=meal_id
+        )
+    except HTTPException as e:
+        raise JobFailed(e.detail)
+    return jsonable_encoder(meal)
+
+if ANALYSIS_JOB_QUEUE == "mongo":
+    analysis_job_queue = MongoJobQueue(
+        db.analysis_jobs,
+        max_pending=ANALYSIS_JOB_MAX_PENDING,
+        retention_seconds=ANALYSIS_JOB_RETENTION_SECONDS
+    )
+else:
+    analysis_job_queue = InMemoryJobQueue(
+        max_pending=ANALYSIS_JOB_MAX_PENDING,
+        retention_seconds=ANALYSIS_JOB_RETENTION_SECONDS
+    )
+analysis_workers = JobWorkerPool(analysis_job_queue, run_analysis_job, concurrency=ANALYSIS_JOB_WORKERS)
+
+async def enqueue_analysis_job(user_id: str, meal_type: str, meal_description: Optional[str] = None,
+                               image: Optional[PreparedImage] = None) -> AnalysisJobResponse:
+    job = new_job(user_id, {
+        "meal_type": meal_type,
+        "meal_description": meal_description,
+        "image": image._asdict() if image else None
+    })
+    try:
+        await analysis_job_queue.submit(job)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Trop d'analyses en cours, veuillez réessayer dans un instant")
+    return job_response(job)
+
+async def get_user_job(job_id: str, user_id: str, wait: float = 0) -> dict:
+    if wait > 0:
+        job = await analysis_job_queue.wait(job_id, min(wait, ANALYSIS_JOB_MAX_WAIT_SECONDS))
+    else:
+        job = await analysis_job_queue.get(job_id)
+    if not job or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Analyse non trouvée")
+    return job
+
+@api_router.post("/calories/analyze/jobs", response_model=AnalysisJobResponse, status_code=202)
+async def create_analysis_job(
+    request: CalorieAnalysisRequest,
+    user: dict = Depends(get_current_user)
+):
+    """Queue a meal analysis and return its job id immediately"""
+    if not request.image_base64 and not request.meal_description:
+        raise HTTPException(status_code=400, detail="Veuillez fournir une image ou une description du repas")
+    
+    image = None
+    if not request.meal_description:
+        image = await prepare_meal_image(image_base64=request.image_base64)
+    return await enqueue_analysis_job(user["id"], request.meal_type, request.meal_description, image)
+
+@api_router.post("/calories/analyze/jobs/upload", response_model=AnalysisJobResponse, status_code=202)
+async def create_analysis_job_upload(
+    image: UploadFile = File(...),
+    meal_type: str = Form("repas"),
+    user: dict = Depends(get_current_user)
+):
+    """Queue the analysis of a multipart meal photo and return its job id immediately"""
+    if image.size is not None and image.size > MAX_MEAL_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="Image trop volumineuse")
+    try:
+        prepared = await prepare_meal_image(upload=image)
+    finally:
+        await image.close()
+    return await enqueue_analysis_job(user["id"], meal_type, image=prepared)
+
+@api_router.get("/calories/analyze/jobs/{job_id}", response_model=AnalysisJobResponse)
+async def get_analysis_job(
+    job_id: str,
+    wait: float = 0,
+    user: dict = Depends(get_current_user)
+):
+    """Job status; with ?wait=N, long-poll up to N seconds for the result"""
+    return job_response(await get_user_job(job_id, user["id"], wait))
+
+@api_router.get("/calories/analyze/jobs/{job_id}/events")
+async def stream_analysis_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Server-sent events: one event per status change, the last one carries the result"""
+    job = await get_user_job(job_id, user["id"])
+    
+    async def events():
+        current, last_status = job, None
+        while current is not None:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                data = job_response(current).model_dump_json()
+                yield f"event: {last_status}\ndata: {data}\n\n"
+            else:
+                # Keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            if last_status in TERMINAL:
+                break
+            current = await analysis_job_queue.wait(job_id, 15)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+async def history_page(response: Response, collection, query: dict, sort_field: str, limit: int,
+                       cursor: Optional[str], projection: dict) -> List[dict]:
+    """One history page; the next page's cursor goes in the X-Next-Cursor header"""
+    try:
+        items, next_cursor = await fetch_page(
+            collection, query, sort_field, clamp_page_size(limit), cursor, projection,
+            legacy_strings=LEGACY_STRING_TIMESTAMPS
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return items
+
+@api_router.get("/calories/history", response_model=List[MealHistoryResponse], response_model_exclude_none=True)
 async def get_meal_history(
+    response: Response,
     date: Optional[str] = None,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    include_analysis: bool = False,
     user: dict = Depends(get_current_user)
 ):
-    """Get meal history for the current user"""
+    """Get meal history for the current user, newest first (pass X-Next-Cursor back as ?cursor=)"""
     query = {"user_id": user["id"]}
     
     if date:
         # Filter by date (YYYY-MM-DD)
-        start = f"{date}T00:00:00"
-        end = f"{date}T23:59:59"
-        query["created_at"] = {"$gte": start, "$lte": end}
-    
-    meals = await db.meal_history.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(limit)
-    
-    return meals
+        try:
+            start, end = day_bounds(date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Date invalide (format AAAA-MM-JJ)")
+        query.update(range_filter("created_at", start, end, legacy_strings=LEGACY_STRING_TIMESTAMPS))
+    
+    projection = {"_id": 0, "image_phash": 0}
+    if not include_analysis:
+        projection["analysis_text"] = 0
+    return await history_page(response, db.meal_history, query, "created_at", limit, cursor, projection)
+
+async def aggregate_meal_totals(user_id: str, start: datetime, end: datetime) -> dict:
+    """Sum a user's meal totals in [start, end) in a single aggregation"""
+    match = {"user_id": user_id, **range_filter("created_at", start, end, legacy_strings=LEGACY_STRING_TIMESTAMPS)}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": None,
+            "meals_count": {"$sum": 1},
+            "calories": {"$sum": "$total_calories"},
+            "proteins": {"$sum": "$total_proteins"},
+            "carbs": {"$sum": "$total_carbs"},
+            "fats": {"$sum": "$total_fats"}
+        }}
+    ]
+    result = await db.meal_history.aggregate(pipeline).to_list(1)
+    if not result:
+        return {"meals_count": 0, "calories": 0, "proteins": 0, "carbs": 0, "fats": 0}
+    totals = result[0]
+    totals.pop("_id")
+    return totals
 
 @api_router.get("/calories/today")
 async def get_today_summary(user: dict = Depends(get_current_user)):
     """Get today's calorie summary"""
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    start = f"{today}T00:00:00"
-    end = f"{today}T23:59:59"
-    
-    meals = await db.meal_history.find(
-        {
-            "user_id": user["id"],
-            "created_at": {"$gte": start, "$lte": end}
-        },
-        {"_id": 0}
-    ).to_list(100)
-    
-    total_calories = sum(m.get("total_calories", 0) for m in meals)
-    total_proteins = sum(m.get("total_proteins", 0) for m in meals)
-    total_carbs = sum(m.get("total_carbs", 0) for m in meals)
-    total_fats = sum(m.get("total_fats", 0) for m in meals)
-    
-    # Get user's daily goal
-    user_data = await db.users.find_one({"id": user["id"]}, {"_id": 0})
-    daily_goal = user_data.get("daily_goal", {
+    today = utc_day(utc_now())
+    start, end = day_bounds(today)
+    
+    totals = await nutrition_rollups.get_day_totals(db, user["id"], today)
+    if totals is None:
+        # No rollup yet (empty day, or history not backfilled)
+        totals = await aggregate_meal_totals(user["id"], start, end)
+    total_calories = totals["calories"]
+    total_proteins = totals["proteins"]
+    total_carbs = totals["carbs"]
+    total_fats = totals["fats"]
+    
+    # get_current_user already loaded the user document
+    daily_goal = user.get("daily_goal", {
         "calories": 2000,
         "proteins": 50.0,
         "carbs": 250.0,
@@ -1681,7 +2465,7 @@ async def get_today_summary(user: dict = Depends(get_current_user)):
     
     return {
         "date": today,
-        "meals_count": len(meals),
+        "meals_count": totals["meals_count"],
         "consumed": {
             "calories": total_calories,
             "proteins": round(total_proteins, 1),
@@ -1733,6 +2517,7 @@ async def update_daily_goal(
         {"id": user["id"]},
         {"$set": {"daily_goal": current_goal}}
     )
+    user_cache.invalidate(user["id"])
     
     return DailyGoal(**current_goal)
 
@@ -1742,14 +2527,16 @@ async def delete_meal(
     user: dict = Depends(get_current_user)
 ):
     """Delete a meal from history"""
-    result = await db.meal_history.delete_one({
-        "id": meal_id,
-        "user_id": user["id"]
-    })
+    meal = await db.meal_history.find_one_and_delete(
+        {"id": meal_id, "user_id": user["id"]},
+        {"_id": 0}
+    )
     
-    if result.deleted_count == 0:
+    if not meal:
         raise HTTPException(status_code=404, detail="Repas non trouvé")
     
+    await nutrition_rollups.apply_meal(db, meal, sign=-1)
+    
     return {"message": "Repas supprimé"}
 
 @api_router.post("/calories/calculate-needs", response_model=CalorieNeedsResponse)
@@ -1897,6 +2684,7 @@ async def calculate_calorie_needs(
                 }
             }}
         )
+        user_cache.invalidate(user["id"])
         
         return CalorieNeedsResponse(
             daily_calories=daily_calories,
@@ -1923,7 +2711,6 @@ async def complete_session(
     """Record a completed workout session"""
     try:
         session_id = str(uuid.uuid4())
-        now = datetime.now(timezone.utc)
         
         session_doc = {
             "id": session_id,
@@ -1933,7 +2720,7 @@ async def complete_session(
             "steps": request.steps,
             "duration_minutes": request.duration_minutes,
             "phases_completed": request.phases_completed,
-            "completed_at": now.isoformat()
+            "completed_at": utc_now()
         }
         
         await db.sessions.insert_one(session_doc)
@@ -1948,53 +2735,50 @@ async def complete_session(
         raise HTTPException(status_code=500, detail=str(e))
 
 async def update_user_stats(user_id: str, steps: int, minutes: int):
-    """Update user's cumulative stats and streak"""
+    """Update user's cumulative stats and streak
+    
+    Runs as a single aggregation-pipeline update so concurrent session
+    completions (e.g. an offline queue flush) never lose increments.
+    """
     now = datetime.now(timezone.utc)
     today = now.strftime("%Y-%m-%d")
+    yesterday = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    
+    last_day = {"$substrCP": [{"$ifNull": ["$stats.last_session_date", ""]}, 0, 10]}
+    current_streak = {"$ifNull": ["$stats.current_streak", 0]}
+    
+    # Expressions in a $set stage all see the document as it was before the stage
+    pipeline = [
+        {"$set": {
+            "stats.total_steps": {"$add": [{"$ifNull": ["$stats.total_steps", 0]}, steps]},
+            "stats.total_minutes": {"$add": [{"$ifNull": ["$stats.total_minutes", 0]}, minutes]},
+            "stats.sessions_completed": {"$add": [{"$ifNull": ["$stats.sessions_completed", 0]}, 1]},
+            "stats.current_streak": {"$switch": {
+                "branches": [
+                    # Same day, don't increment streak
+                    {"case": {"$eq": [last_day, today]}, "then": current_streak},
+                    # Consecutive day
+                    {"case": {"$eq": [last_day, yesterday]}, "then": {"$add": [current_streak, 1]}}
+                ],
+                # First session or streak broken
+                "default": 1
+            }},
+            "stats.last_session_date": today,
+            "stats.weekly_goal": {"$ifNull": ["$stats.weekly_goal", 20000]}
+        }},
+        {"$set": {
+            "stats.best_streak": {"$max": [{"$ifNull": ["$stats.best_streak", 0]}, "$stats.current_streak"]}
+        }}
+    ]
     
-    # Get current user stats
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    current_stats = user.get("stats", {})
-    
-    # Calculate streak
-    last_session_date = current_stats.get("last_session_date")
-    current_streak = current_stats.get("current_streak", 0)
-    best_streak = current_stats.get("best_streak", 0)
-    
-    if last_session_date:
-        last_date = datetime.fromisoformat(last_session_date.replace("Z", "+00:00")).date()
-        today_date = now.date()
-        diff = (today_date - last_date).days
-        
-        if diff == 0:
-            # Same day, don't increment streak
-            pass
-        elif diff == 1:
-            # Consecutive day
-            current_streak += 1
-        else:
-            # Streak broken
-            current_streak = 1
-    else:
-        current_streak = 1
-    
-    best_streak = max(best_streak, current_streak)
-    
-    # Update stats
-    new_stats = {
-        "total_steps": current_stats.get("total_steps", 0) + steps,
-        "total_minutes": current_stats.get("total_minutes", 0) + minutes,
-        "sessions_completed": current_stats.get("sessions_completed", 0) + 1,
-        "current_streak": current_streak,
-        "best_streak": best_streak,
-        "last_session_date": today,
-        "weekly_goal": current_stats.get("weekly_goal", 20000)
-    }
-    
-    await db.users.update_one(
+    updated = await db.users.find_one_and_update(
         {"id": user_id},
-        {"$set": {"stats": new_stats}}
+        pipeline,
+        projection={"_id": 0, "stats": 1},
+        return_document=ReturnDocument.AFTER
     )
+    user_cache.invalidate(user_id)
+    return updated.get("stats", {}) if updated else None
 
 @api_router.get("/progress/stats", response_model=UserStatsResponse)
 async def get_user_stats(user: dict = Depends(get_current_user)):
@@ -2005,12 +2789,11 @@ async def get_user_stats(user: dict = Depends(get_current_user)):
         stats = user_data.get("stats", {})
         
         # Calculate weekly steps (last 7 days)
-        now = datetime.now(timezone.utc)
-        week_ago = (now - timedelta(days=7)).isoformat()
+        week_ago = utc_now() - timedelta(days=7)
         
         weekly_sessions = await db.sessions.find({
             "user_id": user["id"],
-            "completed_at": {"$gte": week_ago}
+            **range_filter("completed_at", start=week_ago, legacy_strings=LEGACY_STRING_TIMESTAMPS)
         }, {"_id": 0}).to_list(100)
         
         weekly_steps = sum(s.get("steps", 0) for s in weekly_sessions)
@@ -2032,16 +2815,15 @@ async def get_user_stats(user: dict = Depends(get_current_user)):
 
 @api_router.get("/progress/sessions")
 async def get_session_history(
+    response: Response,
     limit: int = 20,
+    cursor: Optional[str] = None,
     user: dict = Depends(get_current_user)
 ):
-    """Get user's session history"""
-    sessions = await db.sessions.find(
-        {"user_id": user["id"]},
-        {"_id": 0}
-    ).sort("completed_at", -1).to_list(limit)
-    
-    return sessions
+    """Get user's session history, newest first (pass X-Next-Cursor back as ?cursor=)"""
+    return await history_page(
+        response, db.sessions, {"user_id": user["id"]}, "completed_at", limit, cursor, {"_id": 0}
+    )
 
 @api_router.get("/progress/weekly-activity")
 async def get_weekly_activity(user: dict = Depends(get_current_user)):
@@ -2055,7 +2837,7 @@ async def get_weekly_activity(user: dict = Depends(get_current_user)):
     # Get sessions for this week
     sessions = await db.sessions.find({
         "user_id": user["id"],
-        "completed_at": {"$gte": start_of_week.isoformat()}
+        **range_filter("completed_at", start=start_of_week, legacy_strings=LEGACY_STRING_TIMESTAMPS)
     }, {"_id": 0}).to_list(100)
     
     # Create activity map for each day
@@ -2065,7 +2847,7 @@ async def get_weekly_activity(user: dict = Depends(get_current_user)):
         activity[day_date] = False
     
     for session in sessions:
-        session_date = session["completed_at"][:10]  # Extract YYYY-MM-DD
+        session_date = utc_day(session["completed_at"])
         if session_date in activity:
             activity[session_date] = True
     
@@ -2092,6 +2874,7 @@ async def update_weekly_goal(
         {"id": user["id"]},
         {"$set": {"stats.weekly_goal": goal}}
     )
+    user_cache.invalidate(user["id"])
     return {"message": "Objectif mis à jour", "weekly_goal": goal}
 
 # ==================== APPLE IAP ROUTES ====================
@@ -2159,26 +2942,25 @@ async def verify_apple_purchase(
         if not course:
             raise HTTPException(status_code=404, detail="Course not found")
         
-        # Record the purchase
-        purchase_id = str(uuid.uuid4())
-        now = datetime.now(timezone.utc).isoformat()
-        
-        purchase_record = {
-            "id": purchase_id,
+        # Record the purchase (a repeated or concurrent verification maps to the same one)
+        result = await fulfillment.fulfill("apple_iap", request.transaction_id, {
             "user_id": user["id"],
             "course_id": course_id,
             "course_title": course["title"],
             "amount": course["price"],
-            "payment_method": "apple_iap",
             "apple_transaction_id": request.transaction_id,
-            "apple_product_id": request.product_id,
-            "status": "completed",
-            "created_at": now
-        }
+            "apple_product_id": request.product_id
+        }, event_id=request.transaction_id, event_type="transaction.verified")
         
-        await db.purchases.insert_one(purchase_record)
+        if not result.created:
+            return ApplePurchaseResponse(
+                success=True,
+                transaction_id=request.transaction_id,
+                product_id=request.product_id,
+                message="Achat déjà enregistré - Accès maintenu"
+            )
         
-        logger.info(f"Apple IAP recorded: {purchase_id} for user {user['id']}")
+        logger.info(f"Apple IAP recorded: {result.purchase_id} for user {user['id']}")
         
         return ApplePurchaseResponse(
             success=True,
@@ -2257,14 +3039,61 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Only thumbnails are static: videos are served by serve_video alone, so no
+# other spelling of their path (e.g. /uploads//videos/...) can skip its checks
+app.mount("/uploads/thumbnails", StaticFiles(directory=str(THUMBNAILS_DIR)), name="thumbnails")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+@app.on_event("startup")
+async def ensure_db_indexes():
+    result = await ensure_indexes(db)
+    if result["errors"]:
+        logger.error(f"Index bootstrap finished with errors: {result['errors']}")
+    else:
+        logger.info(f"Index bootstrap: {len(result['ensured'])} indexes ensured")
+
+@app.on_event("startup")
+async def start_analysis_workers():
+    analysis_workers.start()
+    logger.info(f"Started {ANALYSIS_JOB_WORKERS} analysis workers ({ANALYSIS_JOB_QUEUE} queue)")
+
+@app.on_event("startup")
+async def start_email_outbox():
+    logger.info(f"Compiled {email_templates.load()} email templates")
+    email_outbox.start()
+    logger.info(f"Started email outbox sender ({EMAIL_SENDER})")
+
+@app.on_event("startup")
+async def start_webhook_inbox():
+    if not STRIPE_WEBHOOK_SECRET:
+        if stripe_checkout.allow_unsigned_webhooks:
+            logger.warning("STRIPE_WEBHOOK_SECRET is not set: accepting unsigned Stripe webhooks, "
+                           "their checkout sessions are re-read from Stripe")
+        elif STRIPE_ALLOW_UNSIGNED_WEBHOOKS is None:
+            # A Stripe key without its webhook secret would answer 400 to every webhook
+            raise RuntimeError("STRIPE_WEBHOOK_SECRET is not set: set it, or STRIPE_ALLOW_UNSIGNED_WEBHOOKS=true, "
+                               "to receive Stripe webhooks")
+        else:
+            logger.error("STRIPE_WEBHOOK_SECRET is not set and STRIPE_ALLOW_UNSIGNED_WEBHOOKS=false: "
+                         "every Stripe webhook will be rejected")
+    webhook_inbox.start()
+    logger.info("Started webhook inbox consumer")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await analysis_workers.stop()
+    await email_outbox.stop()
+    await webhook_inbox.stop()
     client.close()
+    password_hasher.shutdown()
+    image_preprocessor.shutdown()
+    await apple_key_store.close()
+    await stripe_checkout.close()
@@ -0,0 +1,243 @@
+"""
+Test suite for the analysis job queue (analysis_jobs)
+Runs the in-memory backend and worker pool in-process, no server needed; the
+Mongo backend needs a MongoDB at MONGO_URL and is skipped without one.
+"""
+import asyncio
+import importlib
+import os
+import uuid
+
+import pytest
+
+from analysis_jobs import (
+    InMemoryJobQueue, MongoJobQueue, JobWorkerPool, JobFailed, QueueFull, new_job, DONE, FAILED
+)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestInMemoryJobQueue:
+    """Submit, run and wait for jobs with bounded concurrency"""
+
+    def test_jobs_complete_with_bounded_concurrency(self):
+        """Every job finishes and no more than `concurrency` run at once"""
+        async def scenario():
+            queue = InMemoryJobQueue()
+            running, peak = 0, 0
+
+            async def handler(job):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+                return {"echo": job["payload"]["n"]}
+
+            pool = JobWorkerPool(queue, handler, concurrency=3)
+            pool.start()
+            jobs = [new_job("user-1", {"n": n}) for n in range(10)]
+            for job in jobs:
+                await queue.submit(job)
+            results = [await queue.wait(job["id"], timeout=5) for job in jobs]
+            await pool.stop()
+            return results, peak, pool.stats()
+
+        results, peak, stats = run(scenario())
+        assert [r["status"] for r in results] == [DONE] * 10
+        assert [r["result"]["echo"] for r in results] == list(range(10))
+        assert all(r["payload"] is None for r in results)
+        assert peak == 3
+        assert stats["completed"] == 10
+        print("SUCCESS: Jobs completed with bounded concurrency")
+
+    def test_failed_job_reports_message(self):
+        """JobFailed messages reach the client, other errors are generic"""
+        async def scenario():
+            queue = InMemoryJobQueue()
+
+            async def handler(job):
+                if job["payload"]["kind"] == "expected":
+                    raise JobFailed("Image illisible")
+                raise RuntimeError("boom")
+
+            pool = JobWorkerPool(queue, handler, concurrency=1)
+            pool.start()
+            expected, unexpected = new_job("u", {"kind": "expected"}), new_job("u", {"kind": "other"})
+            await queue.submit(expected)
+            await queue.submit(unexpected)
+            results = [await queue.wait(j["id"], timeout=5) for j in (expected, unexpected)]
+            await pool.stop()
+            return results
+
+        expected, unexpected = run(scenario())
+        assert (expected["status"], expected["error"]) == (FAILED, "Image illisible")
+        assert (unexpected["status"], unexpected["error"]) == (FAILED, "Erreur lors de l'analyse")
+        print("SUCCESS: Failures reported")
+
+    def test_wait_times_out_on_pending_job(self):
+        """Long-poll returns the current state when the job is not done in time"""
+        async def scenario():
+            queue = InMemoryJobQueue()
+            job = new_job("u", {})
+            await queue.submit(job)
+            return await queue.wait(job["id"], timeout=0.05)
+
+        assert run(scenario())["status"] == "queued"
+        print("SUCCESS: Long-poll timed out with current status")
+
+    def test_queue_full(self):
+        """Submissions beyond max_pending are rejected"""
+        async def scenario():
+            queue = InMemoryJobQueue(max_pending=2)
+            await queue.submit(new_job("u", {}))
+            await queue.submit(new_job("u", {}))
+            with pytest.raises(QueueFull):
+                await queue.submit(new_job("u", {}))
+            return queue.stats()
+
+        assert run(scenario())["rejected"] == 1
+        print("SUCCESS: Full queue rejects new jobs")
+
+    def test_heartbeat_while_running(self):
+        """Workers renew the lease of a long job until it finishes"""
+        class LeasedMemoryQueue(InMemoryJobQueue):
+            heartbeat_seconds = 0.01
+
+            def __init__(self):
+                super().__init__()
+                self.heartbeats = 0
+
+            async def heartbeat(self, job):
+                self.heartbeats += 1
+                return True
+
+        async def scenario():
+            queue = LeasedMemoryQueue()
+
+            async def handler(job):
+                await asyncio.sleep(0.1)
+                return {}
+
+            pool = JobWorkerPool(queue, handler, concurrency=1)
+            pool.start()
+            job = new_job("u", {})
+            await queue.submit(job)
+            finished = await queue.wait(job["id"], timeout=5)
+            beats = queue.heartbeats
+            await asyncio.sleep(0.05)
+            await pool.stop()
+            return finished, beats, queue.heartbeats
+
+        finished, beats, beats_later = run(scenario())
+        assert finished["status"] == DONE
+        assert beats >= 3 and beats_later == beats  # stopped with the job
+        print(f"SUCCESS: {beats} heartbeats during the job")
+
+
+@pytest.fixture
+def jobs_collection():
+    motor = pytest.importorskip("motor.motor_asyncio")
+    if not os.environ.get("MONGO_URL"):
+        pytest.skip("MONGO_URL not set")
+    client = motor.AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    db = client[os.environ.get("DB_NAME", "test_database")]
+    name = f"analysis_jobs_test_{uuid.uuid4().hex[:8]}"
+    yield db[name]
+    run(db.drop_collection(name))
+    client.close()
+
+
+class TestMongoJobQueue:
+    """Leases of the Mongo backend"""
+
+    def test_expired_lease_is_taken_over(self, jobs_collection):
+        """A job whose lease expired goes to another worker; the first one cannot overwrite its result"""
+        async def scenario():
+            queue = MongoJobQueue(jobs_collection, lease_seconds=0, max_attempts=2, poll_interval=0.01)
+            job = new_job("u", {"n": 1})
+            await queue.submit(job)
+            first = await queue.claim()
+            await asyncio.sleep(0.01)
+            second = await queue.claim()
+            await queue.complete(first, {"worker": 1})
+            await queue.complete(second, {"worker": 2})
+            return first, second, await queue.get(job["id"]), queue.stats()
+
+        first, second, finished, stats = run(scenario())
+        assert first["claim"] != second["claim"] and second["attempts"] == 2
+        assert finished["status"] == DONE and finished["result"] == {"worker": 2}
+        assert stats["requeued"] == 1
+        print("SUCCESS: Stale worker cannot overwrite the retry")
+
+    def test_heartbeat_renews_lease(self, jobs_collection):
+        """A renewed lease is not expired; a job taken over cannot be renewed"""
+        async def scenario():
+            queue = MongoJobQueue(jobs_collection, lease_seconds=1, poll_interval=0.01)
+            job = new_job("u", {})
+            await queue.submit(job)
+            claimed = await queue.claim()
+            before = (await jobs_collection.find_one({"id": job["id"]}))["lease_until"]
+            await asyncio.sleep(0.05)
+            renewed = await queue.heartbeat(claimed)
+            after = (await jobs_collection.find_one({"id": job["id"]}))["lease_until"]
+            await queue.complete(claimed, {})
+            return renewed, before, after, await queue.heartbeat(claimed)
+
+        renewed, before, after, after_complete = run(scenario())
+        assert renewed and after > before
+        assert after_complete is False
+        print("SUCCESS: Lease renewed while running")
+
+
+@pytest.fixture
+def server(monkeypatch):
+    motor = pytest.importorskip("motor.motor_asyncio")
+    if not os.environ.get("MONGO_URL"):
+        pytest.skip("MONGO_URL not set")
+    monkeypatch.setenv("DB_NAME", os.environ.get("DB_NAME", "test_database"))
+    try:
+        server = importlib.import_module("server")
+    except ImportError as e:
+        pytest.skip(f"server dependencies missing: {e}")
+    client = motor.AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    name = f"analysis_jobs_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(server, "db", client[name])
+    yield server
+    run(client.drop_database(name))
+    client.close()
+
+
+class TestRunAnalysisJob:
+    """Meals logged by analysis jobs"""
+
+    def test_rerun_logs_meal_once(self, server, monkeypatch):
+        """Runs of one job, concurrent or after the fact, log a single meal counted once"""
+        calls = []
+
+        async def analyze_meal(user_id, meal_description=None, image=None, wait_for_user=False):
+            calls.append(meal_description)
+            await asyncio.sleep(0.05)
+            return {"foods": [], "total_calories": 300, "total_proteins": 20.0, "total_carbs": 30.0,
+                    "total_fats": 10.0, "analysis_text": f"run {len(calls)}"}
+
+        monkeypatch.setattr(server, "analyze_meal", analyze_meal)
+        job = new_job("user-1", {"meal_type": "dejeuner", "meal_description": "2 oeufs"})
+
+        async def scenario():
+            # Two workers on the same job (the first one's lease expired), then a third run
+            concurrent = await asyncio.gather(server.run_analysis_job(job), server.run_analysis_job(job))
+            later = await server.run_analysis_job(job)
+            meals = await server.db.meal_history.find({"user_id": "user-1"}).to_list(None)
+            rollups = await server.db.daily_nutrition.find({"user_id": "user-1"}).to_list(None)
+            return [*concurrent, later], meals, rollups
+
+        results, meals, rollups = run(scenario())
+        assert len(meals) == 1 and meals[0]["id"] == job["id"]
+        assert {result["id"] for result in results} == {job["id"]}
+        assert {result["analysis_text"] for result in results} == {meals[0]["analysis_text"]}
+        assert len(calls) == 2  # the later run did not analyze again
+        assert len(rollups) == 1 and rollups[0]["meals_count"] == 1 and rollups[0]["calories"] == 300
+        print("SUCCESS: Job re-runs log one meal")
@@ -0,0 +1,162 @@
+"""
+Test suite for the Sign in with Apple key store (apple_keys.AppleKeyStore)
+Runs against a local stub JWKS server, no network access needed.
+"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from apple_keys import AppleKeyStore, UnknownKeyId
+
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    return private_key, jwk
+
+
+class StubJWKSServer:
+    """Serves {"keys": [...]} like https://appleid.apple.com/auth/keys"""
+
+    def __init__(self):
+        self.keys = []
+        self.cache_control = "public, max-age=3600"
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                body = json.dumps({"keys": stub.keys}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", stub.cache_control)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/auth/keys"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+@pytest.fixture
+def jwks_server():
+    server = StubJWKSServer()
+    yield server
+    server.stop()
+
+
+def run_with_store(jwks_server, scenario, **kwargs):
+    async def main():
+        store = AppleKeyStore(jwks_url=jwks_server.url, **kwargs)
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+    return asyncio.run(main())
+
+
+class TestAppleKeyStore:
+    """Caching, rotation and Cache-Control handling"""
+
+    def test_keys_are_cached(self, jwks_server):
+        """Repeated lookups hit the stub server only once"""
+        _, jwk = make_key("kid-1")
+        jwks_server.keys = [jwk]
+
+        async def scenario(store):
+            for _ in range(5):
+                await store.get_key("kid-1")
+
+        run_with_store(jwks_server, scenario)
+        assert jwks_server.requests == 1
+        print("SUCCESS: JWKS fetched once for 5 lookups")
+
+    def test_verifies_identity_token(self, jwks_server):
+        """A token signed with a served key decodes with the cached key"""
+        private_key, jwk = make_key("kid-1")
+        jwks_server.keys = [jwk]
+        token = jwt.encode(
+            {"sub": "apple-user-1", "aud": "com.beautyfit.amel"},
+            private_key,
+            algorithm="RS256",
+            headers={"kid": "kid-1"}
+        )
+
+        async def scenario(store):
+            key = await store.get_key(jwt.get_unverified_header(token)["kid"])
+            return jwt.decode(token, key, algorithms=["RS256"], audience="com.beautyfit.amel")
+
+        decoded = run_with_store(jwks_server, scenario)
+        assert decoded["sub"] == "apple-user-1"
+
+    def test_unknown_kid_refetches_once(self, jwks_server):
+        """A rotated key is picked up by a single refetch"""
+        _, old_jwk = make_key("kid-old")
+        _, new_jwk = make_key("kid-new")
+        jwks_server.keys = [old_jwk]
+
+        async def scenario(store):
+            await store.get_key("kid-old")
+            jwks_server.keys = [old_jwk, new_jwk]
+            return await store.get_key("kid-new")
+
+        assert run_with_store(jwks_server, scenario, min_refetch_interval=0) is not None
+        assert jwks_server.requests == 2
+
+    def test_unknown_kid_does_not_hammer_apple(self, jwks_server):
+        """Bogus kids inside the refetch interval fail without new requests"""
+        _, jwk = make_key("kid-1")
+        jwks_server.keys = [jwk]
+
+        async def scenario(store):
+            await store.get_key("kid-1")
+            for _ in range(3):
+                with pytest.raises(UnknownKeyId):
+                    await store.get_key("kid-bogus")
+
+        run_with_store(jwks_server, scenario, min_refetch_interval=30)
+        assert jwks_server.requests == 1
+
+    def test_honours_cache_control(self, jwks_server):
+        """The key set lives for the max-age sent by the server"""
+        _, jwk = make_key("kid-1")
+        jwks_server.keys = [jwk]
+        jwks_server.cache_control = "public, max-age=120"
+
+        async def scenario(store):
+            await store.get_key("kid-1")
+            return store.stats()
+
+        stats = run_with_store(jwks_server, scenario, default_ttl=3600)
+        assert 100 <= stats["expires_in_seconds"] <= 120
+
+    def test_refreshes_in_background(self, jwks_server):
+        """Close to expiry, lookups return immediately and refresh in the background"""
+        _, jwk = make_key("kid-1")
+        jwks_server.keys = [jwk]
+        jwks_server.cache_control = "max-age=2"
+
+        async def scenario(store):
+            await store.get_key("kid-1")
+            await asyncio.sleep(1.2)
+            await store.get_key("kid-1")
+            assert jwks_server.requests == 1
+            await asyncio.sleep(0.5)
+
+        run_with_store(jwks_server, scenario, min_ttl=1, refresh_ahead=1)
+        assert jwks_server.requests == 2
@@ -0,0 +1,183 @@
+"""
+Test suite for the in-process caches (caching)
+Runs in-process, no server needed.
+"""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from starlette.requests import Request
+
+from caching import TTLCache, ResponseCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_request(path="/api/courses", query="", headers=None):
+    return Request({
+        "type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    })
+
+
+class TestTTLCache:
+    """Expiry, invalidation and eviction of TTLCache"""
+
+    def test_entries_expire(self):
+        """An entry is served until its TTL runs out, then it is a miss"""
+        cache = TTLCache(ttl=0.05)
+        cache.set("user-1", {"id": "user-1"})
+        cache.set("user-2", {"id": "user-2"}, ttl=10)
+        assert cache.get("user-1") == {"id": "user-1"}
+        time.sleep(0.06)
+        assert cache.get("user-1") is None
+        assert cache.get("user-2") == {"id": "user-2"}  # per-entry TTL
+        assert len(cache) == 1
+        assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+        print("SUCCESS: Entries expire after their TTL")
+
+    def test_zero_ttl_disables(self):
+        """With a TTL of 0 nothing is ever served from the cache"""
+        cache = TTLCache(ttl=0)
+        cache.set("user-1", {"id": "user-1"})
+        assert cache.get("user-1") is None
+        print("SUCCESS: TTL 0 disables the cache")
+
+    def test_invalidate(self):
+        """invalidate drops one key; invalidate_where drops every matching key"""
+        cache = TTLCache()
+        for user_id in ("u1", "u2"):
+            for course_id in ("c1", "c2"):
+                cache.set((user_id, course_id), True)
+        cache.set("u3", True)
+        cache.invalidate("u3")
+        cache.invalidate("missing")  # unknown keys are ignored
+        dropped = cache.invalidate_where(lambda key: key[0] == "u1")
+        assert dropped == 2
+        assert cache.get(("u1", "c1")) is None and cache.get("u3") is None
+        assert cache.get(("u2", "c1")) is True and cache.get(("u2", "c2")) is True
+        print("SUCCESS: Invalidated entries are gone")
+
+    def test_lru_eviction(self):
+        """Past maxsize the least recently used entry is evicted"""
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+        assert cache.stats()["evictions"] == 1
+        print("SUCCESS: Least recently used entry evicted")
+
+
+class TestResponseCache:
+    """ETags, 304s, clearing and collapsed misses of ResponseCache"""
+
+    def test_etag_and_304(self):
+        """The body is built once; a matching If-None-Match gets an empty 304"""
+        calls = []
+
+        async def build():
+            calls.append(1)
+            return {"courses": [{"id": "c1", "price": 29.9}]}
+
+        async def scenario():
+            cache = ResponseCache()
+            first = await cache.serve(make_request(), build, "public, max-age=60")
+            etag = first.headers["etag"]
+            responses = [await cache.serve(make_request(headers={"If-None-Match": value}), build, "public, max-age=60")
+                         for value in (etag, f"W/{etag}", f'"other", {etag}', '"other"')]
+            other_query = await cache.serve(make_request(query="page=2"), build, "public, max-age=60")
+            return first, responses, other_query
+
+        first, responses, other_query = run(scenario())
+        assert first.status_code == 200 and first.body == b'{"courses":[{"id":"c1","price":29.9}]}'
+        assert first.headers["cache-control"] == "public, max-age=60"
+        assert [r.status_code for r in responses] == [304, 304, 304, 200]
+        assert responses[0].body == b"" and responses[0].headers["etag"] == first.headers["etag"]
+        assert len(calls) == 2  # the URL with another query string has its own entry
+        assert other_query.status_code == 200
+        print("SUCCESS: ETag served, If-None-Match answered with 304")
+
+    def test_clear_on_mutation(self):
+        """After clear() the next request renders the new data under a new ETag"""
+        catalog = {"price": 29.9}
+
+        async def build():
+            return dict(catalog)
+
+        async def scenario():
+            cache = ResponseCache()
+            before = await cache.serve(make_request(), build, "public")
+            catalog["price"] = 19.9
+            cached = await cache.serve(make_request(), build, "public")
+            cache.clear()  # what the admin routes do after a write
+            after = await cache.serve(make_request(headers={"If-None-Match": before.headers["etag"]}), build, "public")
+            return before, cached, after
+
+        before, cached, after = run(scenario())
+        assert cached.body == before.body
+        assert after.status_code == 200 and b"19.9" in after.body
+        assert after.headers["etag"] != before.headers["etag"]
+        print("SUCCESS: Cleared cache serves fresh data")
+
+    def test_concurrent_misses_build_once(self):
+        """Simultaneous misses for one key share one build; other keys build on their own"""
+        calls = []
+
+        async def build(key):
+            calls.append(key)
+            await asyncio.sleep(0.05)
+            return key.encode()
+
+        async def scenario():
+            cache = ResponseCache()
+            entries = await asyncio.gather(
+                *(cache.get_or_build("/a", lambda: build("/a")) for _ in range(10)),
+                cache.get_or_build("/b", lambda: build("/b")),
+            )
+            return entries, cache.stats()
+
+        entries, stats = run(scenario())
+        assert sorted(calls) == ["/a", "/b"]
+        assert {entry.body for entry in entries[:10]} == {b"/a"} and entries[10].body == b"/b"
+        assert stats["builds"] == 2 and stats["coalesced"] == 9
+        print("SUCCESS: 11 concurrent misses, 2 builds")
+
+    def test_failed_and_stale_builds(self):
+        """A failed build fails its waiters and is retried; a build overtaken by clear() is not stored"""
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            await asyncio.sleep(0.02)
+            if len(attempts) == 1:
+                raise ConnectionError("database unavailable")
+            return b"ok"
+
+        async def scenario():
+            cache = ResponseCache()
+            results = await asyncio.gather(cache.get_or_build("/a", flaky), cache.get_or_build("/a", flaky),
+                                           return_exceptions=True)
+            retried = await cache.get_or_build("/a", flaky)
+
+            async def stale():
+                await asyncio.sleep(0.02)
+                return b"old"
+
+            building = asyncio.create_task(cache.get_or_build("/b", stale))
+            await asyncio.sleep(0)
+            cache.clear()
+            served = await building
+            return results, retried, served, cache.get("/b")
+
+        results, retried, served, stored = run(scenario())
+        assert all(isinstance(result, ConnectionError) for result in results)
+        assert retried.body == b"ok" and len(attempts) == 2
+        assert served.body == b"old" and stored is None
+        print("SUCCESS: Errors shared, stale builds dropped")
@@ -99,6 +99,31 @@ class TestCalorieTrackerAPIs:
             assert "total_calories" in meal
             assert "meal_type" in meal
             assert "created_at" in meal
+            # Heavy field left out unless requested
+            assert "analysis_text" not in meal
+
+    def test_meal_history_pagination(self):
+        """Test GET /api/calories/history with ?cursor= - pages do not overlap"""
+        # Make sure there are at least two meals to page through (resolved offline)
+        requests.post(f"{BASE_URL}/api/calories/analyze/batch", json={
+            "meals": [{"meal_description": "1 pomme"}, {"meal_description": "1 banane"}]
+        }, headers=self.headers)
+
+        first = requests.get(f"{BASE_URL}/api/calories/history?limit=1", headers=self.headers)
+        assert first.status_code == 200
+        cursor = first.headers.get("X-Next-Cursor")
+        assert cursor
+
+        second = requests.get(f"{BASE_URL}/api/calories/history?limit=1&cursor={cursor}&include_analysis=true",
+                              headers=self.headers)
+        assert second.status_code == 200
+        assert second.json()[0]["id"] != first.json()[0]["id"]
+        assert second.json()[0]["created_at"] <= first.json()[0]["created_at"]
+        assert "analysis_text" in second.json()[0]
+
+        bad = requests.get(f"{BASE_URL}/api/calories/history?cursor=not-a-cursor!", headers=self.headers)
+        assert bad.status_code == 400
+        print("SUCCESS: Meal history paginates with an opaque cursor")
     
     def test_get_daily_goal(self):
         """Test GET /api/calories/goal - returns user's daily goal"""
@@ -144,7 +169,51 @@ class TestCalorieTrackerAPIs:
             "meal_type": "dejeuner"
         })
         assert response.status_code in [401, 403]
-    
+
+    def test_analyze_upload_unauthorized(self):
+        """Test POST /api/calories/analyze/upload without auth - should fail"""
+        response = requests.post(
+            f"{BASE_URL}/api/calories/analyze/upload",
+            files={"image": ("meal.jpg", base64.b64decode(SAMPLE_IMAGE_BASE64), "image/jpeg")},
+            data={"meal_type": "dejeuner"}
+        )
+        assert response.status_code in [401, 403]
+
+    def test_analyze_upload_rejects_non_image(self):
+        """Test POST /api/calories/analyze/upload with a non-image file - should return 400"""
+        response = requests.post(
+            f"{BASE_URL}/api/calories/analyze/upload",
+            files={"image": ("meal.txt", b"not an image", "text/plain")},
+            data={"meal_type": "dejeuner"},
+            headers=self.headers
+        )
+        assert response.status_code == 400
+
+    def test_analyze_batch_partial_failure(self):
+        """Test POST /api/calories/analyze/batch - valid items saved, invalid ones reported"""
+        response = requests.post(f"{BASE_URL}/api/calories/analyze/batch", json={
+            "meals": [
+                {"meal_description": "2 oeufs et une tartine", "meal_type": "petit-dejeuner"},
+                {"meal_type": "dejeuner"},
+                {"meal_description": "150g riz, 120g poulet", "meal_type": "diner"}
+            ]
+        }, headers=self.headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["succeeded"] == 2
+        assert data["failed"] == 1
+        assert [r["status"] for r in data["results"]] == ["ok", "error", "ok"]
+        assert data["results"][0]["meal"]["total_calories"] > 0
+        assert data["results"][1]["error"]
+        print(f"SUCCESS: Batch analysis saved {data['succeeded']} meals, reported {data['failed']} failure")
+
+    def test_analyze_batch_too_many(self):
+        """Test POST /api/calories/analyze/batch above the size limit - should return 400"""
+        response = requests.post(f"{BASE_URL}/api/calories/analyze/batch", json={
+            "meals": [{"meal_description": "1 pomme"}] * 100
+        }, headers=self.headers)
+        assert response.status_code == 400
+
     def test_today_summary_unauthorized(self):
         """Test GET /api/calories/today without auth - should fail"""
         response = requests.get(f"{BASE_URL}/api/calories/today")
@@ -0,0 +1,116 @@
+"""
+Test suite for the transactional email outbox (email_outbox)
+Rate limiting, backoff and the fake sender run in-process; the outbox flow
+needs a MongoDB at MONGO_URL and is skipped without one.
+"""
+import asyncio
+import os
+import time
+import uuid
+
+import pytest
+
+from email_outbox import EmailOutbox, FakeEmailSender, PermanentEmailError, RateLimiter, SENT, DEAD, PENDING
+from leased_queue import retry_delay
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestSenderPieces:
+    """Rate limiter, backoff schedule and fake sender"""
+
+    def test_rate_limiter_paces_calls(self):
+        """Calls beyond the burst are spread at `rate` per second"""
+        async def scenario():
+            limiter = RateLimiter(rate=20, burst=1)
+            start = time.monotonic()
+            for _ in range(5):
+                await limiter.acquire()
+            return time.monotonic() - start
+
+        elapsed = run(scenario())
+        assert elapsed >= 4 / 20 * 0.9
+        print(f"SUCCESS: 5 calls at 20/s took {elapsed:.3f}s")
+
+    def test_retry_delay_grows_and_caps(self):
+        """Backoff doubles per attempt, with jitter, up to the cap"""
+        assert 15 <= retry_delay(1, 30, 3600) <= 30
+        assert 60 <= retry_delay(3, 30, 3600) <= 120
+        assert retry_delay(20, 30, 3600) <= 3600
+        print("SUCCESS: Backoff schedule")
+
+    def test_fake_sender(self):
+        """The fake sender records deliveries and simulates both failure kinds"""
+        async def scenario():
+            sender = FakeEmailSender(fail_times=1, reject=["bounce@example.com"])
+            message = {"to": ["a@example.com"], "subject": "Hi"}
+            with pytest.raises(ConnectionError):
+                await sender.send_batch([message])
+            await sender.send_batch([message])
+            with pytest.raises(PermanentEmailError):
+                await sender.send_batch([{"to": ["bounce@example.com"], "subject": "Hi"}])
+            return sender
+
+        sender = run(scenario())
+        assert [m["to"] for m in sender.sent] == [["a@example.com"]]
+        assert sender.stats()["calls"] == 3
+        print("SUCCESS: Fake sender behaves")
+
+
+@pytest.fixture
+def outbox_collection():
+    motor = pytest.importorskip("motor.motor_asyncio")
+    if not os.environ.get("MONGO_URL"):
+        pytest.skip("MONGO_URL not set")
+    client = motor.AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    name = f"email_outbox_test_{uuid.uuid4().hex[:8]}"
+    yield client[os.environ.get("DB_NAME", "test_database")][name]
+    run(client[os.environ.get("DB_NAME", "test_database")].drop_collection(name))
+    client.close()
+
+
+class TestEmailOutbox:
+    """Enqueue, batch, retry and dead-letter against MongoDB"""
+
+    def test_batches_and_retries(self, outbox_collection):
+        """A transient failure is retried; everything ends up sent in batches"""
+        async def scenario():
+            sender = FakeEmailSender(fail_times=1, max_batch_size=3)
+            outbox = EmailOutbox(outbox_collection, sender, batch_size=10, retry_base_seconds=0,
+                                 rate_per_second=0)
+            for n in range(7):
+                await outbox.enqueue([f"user{n}@example.com"], "Code", "<p>1234</p>")
+            await outbox.drain()  # first batch fails and is rescheduled
+            await outbox.drain()
+            statuses = await outbox_collection.distinct("status")
+            return sender, outbox.stats(), statuses
+
+        sender, stats, statuses = run(scenario())
+        assert statuses == [SENT]
+        assert len(sender.sent) == 7
+        assert sender.batches == 3
+        assert stats["retried"] == 3
+        print(f"SUCCESS: 7 emails sent in {sender.batches} batches after a retry")
+
+    def test_dead_letter_and_requeue(self, outbox_collection):
+        """A rejected recipient is isolated and dead-lettered; the rest of the batch is sent"""
+        async def scenario():
+            sender = FakeEmailSender(reject=["bounce@example.com"])
+            outbox = EmailOutbox(outbox_collection, sender, rate_per_second=0)
+            await outbox.enqueue(["ok@example.com"], "Code", "<p>1</p>")
+            dead_id = await outbox.enqueue(["bounce@example.com"], "Code", "<p>2</p>")
+            await outbox.drain()
+            dead = await outbox_collection.find_one({"id": dead_id})
+            sender.reject.clear()
+            requeued = await outbox.requeue_dead()
+            pending = await outbox_collection.find_one({"id": dead_id})
+            await outbox.drain()
+            return sender, dead, requeued, pending
+
+        sender, dead, requeued, pending = run(scenario())
+        assert dead["status"] == DEAD and "bounce@example.com" in dead["last_error"]
+        assert requeued == 1 and pending["status"] == PENDING
+        assert sorted(m["to"][0] for m in sender.sent) == ["bounce@example.com", "ok@example.com"]
+        print("SUCCESS: Bad recipient dead-lettered, then requeued")
@@ -0,0 +1,64 @@
+"""
+Test suite for transactional email templates (email_rendering)
+Renders the real templates in templates/email, no server needed.
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+jinja2 = pytest.importorskip("jinja2")
+
+import email_rendering
+from email_rendering import EmailTemplates, html_to_text
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "templates" / "email"
+STATIC_CONTEXT = {"brand_name": "Beautyfit By Amel", "brand_color": "#E37E7F"}
+
+
+class TestEmailTemplates:
+    """Compile once, render HTML, subject and the generated text alternative"""
+
+    def test_password_reset(self):
+        """The reset email carries the code in both parts and escapes user input in HTML"""
+        templates = EmailTemplates(TEMPLATE_DIR, STATIC_CONTEXT)
+        assert templates.load() >= 4  # base + password_reset, .html and generated .txt
+        email = templates.render("password_reset", first_name="<Léa>", reset_code="482913", expires_in="1 heure")
+        assert email.subject == "Réinitialisation de ton mot de passe - Beautyfit"
+        assert "482913" in email.html and "&lt;Léa&gt;" in email.html
+        assert "482913" in email.text and "Bonjour <Léa>" in email.text
+        assert "<" not in email.text.replace("<Léa>", "")
+        assert f"© {datetime.now(timezone.utc).year} Beautyfit By Amel" in email.text
+        print("SUCCESS: Password reset email rendered")
+
+    def test_year_per_render(self, monkeypatch):
+        """The footer year is the one at send time, not at startup"""
+        templates = EmailTemplates(TEMPLATE_DIR, STATIC_CONTEXT)
+        templates.load()
+        monkeypatch.setattr(email_rendering, "utc_now", lambda: datetime(2031, 1, 1, tzinfo=timezone.utc))
+        email = templates.render("password_reset", first_name="Léa", reset_code="1", expires_in="1 heure")
+        assert "© 2031 Beautyfit By Amel" in email.text and "© 2031" in email.html
+        print("SUCCESS: Year rendered per email")
+
+    def test_missing_variable_fails(self):
+        """A forgotten variable is an error, not an empty hole in the email"""
+        templates = EmailTemplates(TEMPLATE_DIR, STATIC_CONTEXT)
+        with pytest.raises(jinja2.UndefinedError):
+            templates.render("password_reset", first_name="Léa")
+        print("SUCCESS: Missing variable rejected")
+
+
+class TestHtmlToText:
+    """Plain-text generation from HTML template sources"""
+
+    def test_keeps_jinja_tags(self):
+        """Markup is dropped, Jinja tags (even with < or >) survive, layouts point at .txt"""
+        source = ('{% extends "base.html" %}<style>p {}</style>'
+                  '<p>{% if n > 1 %}Salut <a href="https://example.com">ici</a>{% endif %}</p>'
+                  '<ul><li>un</li><li>deux</li></ul><hr>fin')
+        text = html_to_text(source)
+        assert text.startswith('{% extends "base.txt" %}')
+        assert "{% if n > 1 %}Salut ici (https://example.com){% endif %}" in text
+        assert "- un\n- deux" in text
+        assert "p {}" not in text and "----------" in text
+        print("SUCCESS: Text alternative generated")
@@ -0,0 +1,98 @@
+"""
+Test suite for idempotent purchase fulfillment (fulfillment.PurchaseFulfillment)
+Needs a MongoDB at MONGO_URL (the unique indexes do the deduplication) and is
+skipped without one.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from fulfillment import PurchaseFulfillment, backfill_external_ids
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def collections():
+    motor = pytest.importorskip("motor.motor_asyncio")
+    if not os.environ.get("MONGO_URL"):
+        pytest.skip("MONGO_URL not set")
+    from db_indexes import INDEX_REGISTRY
+    client = motor.AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    db = client[os.environ.get("DB_NAME", "test_database")]
+    suffix = uuid.uuid4().hex[:8]
+    names = {"purchases": f"purchases_test_{suffix}", "payment_events": f"payment_events_test_{suffix}"}
+
+    async def setup():
+        for registry_name, name in names.items():
+            await db[name].create_indexes(INDEX_REGISTRY[registry_name])
+
+    run(setup())
+    yield db[names["purchases"]], db[names["payment_events"]]
+
+    async def teardown():
+        for name in names.values():
+            await db.drop_collection(name)
+
+    run(teardown())
+    client.close()
+
+
+def purchase_fields(session_id):
+    return {"user_id": "u1", "course_id": "c1", "course_title": "Programme", "amount": 29.9, "session_id": session_id}
+
+
+class TestPurchaseFulfillment:
+    """Concurrent duplicates, replays and legacy purchases against MongoDB"""
+
+    def test_concurrent_duplicate_events(self, collections):
+        """A burst of duplicate deliveries and status polls creates exactly one purchase"""
+        purchases, events = collections
+
+        async def scenario():
+            fulfillment = PurchaseFulfillment(purchases, events)
+            calls = []
+            for n in range(50):
+                # Webhook redeliveries of one event, racing the success page's status polls
+                event_id = "evt_1" if n % 2 else "status:cs_1"
+                calls.append(fulfillment.fulfill("stripe", "cs_1", purchase_fields("cs_1"), event_id=event_id))
+            results = await asyncio.gather(*calls)
+            replay = await fulfillment.fulfill("stripe", "cs_1", purchase_fields("cs_1"), event_id="evt_1")
+            return fulfillment, results, replay
+
+        fulfillment, results, replay = run(scenario())
+        stored = run(purchases.find({}, {"_id": 0}).to_list(None))
+        logged = run(events.find({}, {"_id": 0}).to_list(None))
+        assert len(stored) == 1 and stored[0]["external_id"] == "cs_1"
+        assert sum(result.created for result in results) == 1
+        assert {result.purchase_id for result in results} == {stored[0]["id"]}
+        assert replay.replayed and replay.purchase_id == stored[0]["id"]
+        assert {record["event_id"] for record in logged} == {"evt_1", "status:cs_1"}
+        assert sum(record["deliveries"] for record in logged) == 51
+        assert all(record["status"] == "done" for record in logged)
+        print(f"SUCCESS: 51 deliveries, 1 purchase, stats {fulfillment.stats()}")
+
+    def test_distinct_transactions_and_legacy_purchases(self, collections):
+        """Other transactions get their own purchase; a legacy one is matched by session_id"""
+        purchases, events = collections
+
+        async def scenario():
+            fulfillment = PurchaseFulfillment(purchases, events)
+            await purchases.insert_one({"id": "legacy", "payment_method": "stripe", "status": "completed",
+                                        **purchase_fields("cs_legacy")})
+            legacy, legacy_created = await fulfillment.upsert_purchase("stripe", "cs_legacy", purchase_fields("cs_legacy"))
+            first = await fulfillment.fulfill("stripe", "cs_2", purchase_fields("cs_2"))
+            apple = await fulfillment.fulfill("apple_iap", "cs_2", {"user_id": "u1", "course_id": "c1"})
+            backfilled = await backfill_external_ids(purchases)
+            return legacy, legacy_created, first, apple, backfilled
+
+        legacy, legacy_created, first, apple, backfilled = run(scenario())
+        assert legacy["id"] == "legacy" and not legacy_created
+        assert first.created and apple.created and first.purchase_id != apple.purchase_id
+        assert backfilled == {"stripe": 1, "apple_iap": 0}
+        assert run(purchases.count_documents({"external_id": {"$type": "string"}})) == 3
+        print("SUCCESS: Distinct and legacy purchases")
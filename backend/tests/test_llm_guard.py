@@ -0,0 +1,196 @@
+"""
+Test suite for LLM admission control (llm_guard.LlmGuard, CircuitBreaker)
+Pure asyncio, no server or provider needed.
+"""
+import asyncio
+
+import pytest
+
+from llm_guard import LlmGuard, CircuitBreaker, CircuitOpen, LlmBusy, LlmTimeout, UserBusy
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def respond(delay=0.05, value="ok"):
+    await asyncio.sleep(delay)
+    return value
+
+
+class TestLlmGuard:
+    """Concurrency caps, timeouts and circuit breaking"""
+
+    def test_per_user_limit(self):
+        """A second interactive call for the same user is rejected, queued work waits"""
+        async def scenario():
+            guard = LlmGuard(per_user_limit=1)
+            first = asyncio.create_task(guard.call("u1", respond))
+            await asyncio.sleep(0)
+            with pytest.raises(UserBusy):
+                await guard.call("u1", respond)
+            other_user = await guard.call("u2", respond)
+            queued = await guard.call("u1", respond, wait_for_user=True)
+            return await first, other_user, queued, guard
+
+        first, other_user, queued, guard = run(scenario())
+        assert (first, other_user, queued) == ("ok", "ok", "ok")
+        assert guard.stats()["rejected_user"] == 1
+        assert guard._user_slots == {}
+        print("SUCCESS: Per-user limit enforced")
+
+    def test_global_cap(self):
+        """Calls beyond the global cap wait, then fail with LlmBusy after queue_timeout"""
+        async def scenario():
+            guard = LlmGuard(max_concurrency=2, queue_timeout=0.02)
+            running = [asyncio.create_task(guard.call(f"u{i}", lambda: respond(0.2))) for i in range(2)]
+            await asyncio.sleep(0)
+            with pytest.raises(LlmBusy):
+                await guard.call("u3", respond)
+            await asyncio.gather(*running)
+            return guard.stats()
+
+        stats = run(scenario())
+        assert stats["rejected_busy"] == 1
+        assert stats["in_flight"] == 0
+        print("SUCCESS: Global concurrency cap enforced")
+
+    def test_timeout_and_breaker(self):
+        """Timeouts count as failures, open the breaker, and a probe closes it"""
+        async def scenario():
+            breaker = CircuitBreaker(error_rate=0.5, min_calls=2, window_seconds=10, cooldown_seconds=0.05)
+            guard = LlmGuard(call_timeout=0.01, breaker=breaker)
+            for _ in range(2):
+                with pytest.raises(LlmTimeout):
+                    await guard.call("u", lambda: respond(1))
+            assert breaker.state == "open"
+            with pytest.raises(CircuitOpen):
+                await guard.call("u", respond)
+            await asyncio.sleep(0.06)
+            probe = await guard.call("u", lambda: respond(0))
+            return probe, guard.stats()
+
+        probe, stats = run(scenario())
+        assert probe == "ok"
+        assert stats["timeouts"] == 2
+        assert stats["short_circuited"] == 1
+        assert stats["breaker"]["state"] == "closed"
+        assert stats["breaker"]["opened"] == 1
+        print("SUCCESS: Breaker opened on timeouts and closed after a probe")
+
+    def test_failed_probe_reopens(self):
+        """A failing half-open probe reopens the breaker"""
+        async def failing():
+            raise RuntimeError("provider down")
+
+        async def scenario():
+            breaker = CircuitBreaker(error_rate=0.5, min_calls=1, cooldown_seconds=0.01)
+            guard = LlmGuard(breaker=breaker)
+            with pytest.raises(RuntimeError):
+                await guard.call("u", failing)
+            await asyncio.sleep(0.02)
+            with pytest.raises(RuntimeError):
+                await guard.call("u", failing)
+            return breaker.stats()
+
+        stats = run(scenario())
+        assert stats["state"] == "open"
+        assert stats["opened"] == 2
+        print("SUCCESS: Failed probe reopened the breaker")
+
+    def test_late_call_does_not_decide_probe(self):
+        """A call admitted while closed that ends during half-open neither closes nor reopens the breaker"""
+        async def failing():
+            raise RuntimeError("provider down")
+
+        async def scenario():
+            breaker = CircuitBreaker(error_rate=0.5, min_calls=1, cooldown_seconds=0.01)
+            guard = LlmGuard(breaker=breaker)
+            slow = asyncio.create_task(guard.call("slow", lambda: respond(0.1)))
+            await asyncio.sleep(0.01)
+            with pytest.raises(RuntimeError):
+                await guard.call("u", failing)
+            await asyncio.sleep(0.02)
+            assert breaker.allow() == "half_open"  # this test holds the probe
+            assert await slow == "ok"
+            state_after_late_call = breaker.state
+            breaker.record(True, was_probe=True)
+            return state_after_late_call, breaker.stats()
+
+        state_after_late_call, stats = run(scenario())
+        assert state_after_late_call == "half_open"
+        assert stats["state"] == "closed" and stats["opened"] == 1
+        print("SUCCESS: Only the probe decides a half-open breaker")
+
+    def test_probe_released_when_not_sent(self):
+        """A call that cannot get a slot does not take the probe from the next call"""
+        async def failing():
+            raise RuntimeError("provider down")
+
+        async def scenario():
+            breaker = CircuitBreaker(error_rate=0.5, min_calls=1, cooldown_seconds=0.01)
+            guard = LlmGuard(per_user_limit=1, breaker=breaker)
+            with pytest.raises(RuntimeError):
+                await guard.call("u", failing)
+            await asyncio.sleep(0.02)
+            busy = asyncio.create_task(guard._acquire_user("u", wait=False))
+            slot = await busy
+            with pytest.raises(UserBusy):
+                await guard.call("u", respond)
+            guard._release_user("u", slot)
+            result = await guard.call("other", respond)
+            return result, breaker.stats()
+
+        result, stats = run(scenario())
+        assert result == "ok" and stats["state"] == "closed"
+        print("SUCCESS: Unsent probe released")
+
+    def test_probe_admitted_with_a_slot(self):
+        """Calls queued for a slot during half-open are not short-circuited by a waiting probe"""
+        async def failing():
+            raise RuntimeError("provider down")
+
+        async def scenario():
+            breaker = CircuitBreaker(error_rate=0.5, min_calls=1, cooldown_seconds=0.01)
+            guard = LlmGuard(max_concurrency=1, queue_timeout=1, breaker=breaker)
+            with pytest.raises(RuntimeError):
+                await guard.call("u", failing)
+            await asyncio.sleep(0.02)
+            await guard._slots.acquire()  # this test holds the only slot
+            queued = [asyncio.create_task(guard.call(f"u{i}", respond)) for i in range(3)]
+            await asyncio.sleep(0.02)
+            probe_taken_while_queued = breaker._probe_in_flight
+            guard._slots.release()
+            return probe_taken_while_queued, await asyncio.gather(*queued), guard.stats()
+
+        probe_taken_while_queued, results, stats = run(scenario())
+        assert not probe_taken_while_queued
+        assert results == ["ok", "ok", "ok"]
+        assert stats["short_circuited"] == 0 and stats["breaker"]["state"] == "closed"
+        print("SUCCESS: Probe admitted once it holds a slot")
+
+    def test_short_circuit_releases_slot(self):
+        """A call refused by the breaker after queueing gives its slot back"""
+        async def failing():
+            raise RuntimeError("provider down")
+
+        async def scenario():
+            breaker = CircuitBreaker(error_rate=0.5, min_calls=1, cooldown_seconds=10)
+            guard = LlmGuard(max_concurrency=1, queue_timeout=1, breaker=breaker)
+            running = asyncio.create_task(guard.call("u1", lambda: respond(0.05)))
+            await asyncio.sleep(0.01)
+            queued = asyncio.create_task(guard.call("u2", respond))
+            await asyncio.sleep(0.01)
+            breaker.record(False)  # the breaker opens while u2 waits for the slot
+            await running
+            with pytest.raises(CircuitOpen):
+                await queued
+            with pytest.raises(CircuitOpen):
+                await guard.call("u3", failing)  # refused before queueing
+            return guard
+
+        guard = run(scenario())
+        assert not guard._slots.locked() and guard._user_slots == {}
+        assert guard.stats()["short_circuited"] == 2
+        print("SUCCESS: Slot released on short-circuit")
+
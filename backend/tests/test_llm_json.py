@@ -0,0 +1,50 @@
+"""
+Test suite for LLM JSON extraction (llm_json.extract_json_object)
+Pure Python, no server needed.
+"""
+from llm_json import extract_json_object, coerce_number
+
+ANALYSIS = '{"foods": [{"name": "Oeuf", "quantity": "2", "calories": 143}], "total_calories": 143}'
+
+
+class TestExtractJsonObject:
+    """Balanced object extraction from chatty completions"""
+
+    def test_bare_and_fenced(self):
+        """Bare JSON and ```json fenced JSON both parse"""
+        assert extract_json_object(ANALYSIS)["total_calories"] == 143
+        assert extract_json_object(f"Voici l'analyse :\n```json\n{ANALYSIS}\n```\nBon appétit !")["total_calories"] == 143
+        print("SUCCESS: Bare and fenced JSON extracted")
+
+    def test_braces_in_prose(self):
+        """Braces before or after the object do not leak into it"""
+        text = f"Estimation {{portion moyenne}} :\n{ANALYSIS}\nNote: valeurs {{approximatives}}."
+        assert extract_json_object(text)["foods"][0]["name"] == "Oeuf"
+        print("SUCCESS: Prose braces ignored")
+
+    def test_braces_inside_strings(self):
+        """Braces and escaped quotes inside string values do not affect nesting"""
+        text = 'ok {"analysis_text": "repas {copieux} \\"maison\\"", "foods": []} fin }'
+        assert extract_json_object(text)["analysis_text"] == 'repas {copieux} "maison"'
+        print("SUCCESS: String contents ignored by the scanner")
+
+    def test_stray_open_brace_and_trailing_comma(self):
+        """An unclosed brace in prose and a trailing comma are tolerated"""
+        text = 'Attention { voici:\n{"foods": [{"name": "Riz", "calories": 195},], "total_calories": 195,}'
+        assert extract_json_object(text)["total_calories"] == 195
+        print("SUCCESS: Malformed output recovered")
+
+    def test_no_object(self):
+        """Truncated or missing JSON returns None"""
+        assert extract_json_object("Désolé, je ne peux pas analyser cette image.") is None
+        assert extract_json_object('{"foods": [{"name": "Riz"') is None
+        # A truncated answer must not yield one of its nested items
+        assert extract_json_object('{"foods": [{"name": "Riz", "calories": 195}, {"na', required_key="foods") is None
+        print("SUCCESS: Missing JSON reported as None")
+
+    def test_coerce_number(self):
+        """Units and French decimal commas are stripped from numbers"""
+        assert coerce_number("150 kcal") == 150.0
+        assert coerce_number("12,5 g") == 12.5
+        assert coerce_number(3) == 3
+        print("SUCCESS: Numbers coerced")
@@ -0,0 +1,172 @@
+"""
+Test suite for range-aware video responses (media_serving)
+Builds responses in-process and runs them against a captured ASGI send, no server needed.
+"""
+import asyncio
+import importlib
+import os
+import uuid
+from email.utils import formatdate
+
+import pytest
+
+pytest.importorskip("starlette")
+
+from starlette.requests import Request
+
+from media_serving import media_response, parse_range, RangeNotSatisfiable
+
+BODY = bytes(range(256)) * 8  # 2048 bytes
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(BODY)
+    return path
+
+
+def fetch(path, headers=None, method="GET"):
+    """Status, headers and body of media_response for a request with `headers`"""
+    scope = {
+        "type": "http", "method": method, "path": "/uploads/videos/clip.mp4", "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    }
+    response = media_response(Request(scope), path, "private, max-age=60")
+    messages = []
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    start = messages[0]
+    response_headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], response_headers, body
+
+
+class TestParseRange:
+    """Range header parsing"""
+
+    def test_ranges(self):
+        """Closed, open-ended and suffix ranges, clamped to the file"""
+        assert parse_range("bytes=0-99", 2048) == (0, 99)
+        assert parse_range("bytes=1000-", 2048) == (1000, 2047)
+        assert parse_range("bytes=2000-9999", 2048) == (2000, 2047)
+        assert parse_range("bytes=-500", 2048) == (1548, 2047)
+        assert parse_range("bytes=-5000", 2048) == (0, 2047)
+        print("SUCCESS: Ranges parsed")
+
+    def test_ignored_headers(self):
+        """Multi-range, other units, reversed ranges and garbage fall back to the full body"""
+        assert parse_range("bytes=0-10,20-30", 2048) is None
+        assert parse_range("items=0-10", 2048) is None
+        assert parse_range("bytes=abc-def", 2048) is None
+        assert parse_range("bytes=100", 2048) is None
+        assert parse_range("bytes=50-10", 2048) is None  # invalid, not unsatisfiable
+        print("SUCCESS: Unsupported ranges ignored")
+
+    def test_unsatisfiable(self):
+        """Ranges past the end, empty suffixes and empty files cannot be served"""
+        for header, size in (("bytes=2048-", 2048), ("bytes=4096-5000", 2048), ("bytes=-0", 2048), ("bytes=0-", 0)):
+            with pytest.raises(RangeNotSatisfiable):
+                parse_range(header, size)
+        print("SUCCESS: Unsatisfiable ranges rejected")
+
+
+class TestMediaResponse:
+    """Status codes, headers and bodies of media_response"""
+
+    def test_full_and_partial(self, video):
+        """No Range gives 200 with everything; a Range gives 206 with that slice"""
+        status, headers, body = fetch(video)
+        assert status == 200 and body == BODY and headers["content-length"] == "2048"
+        assert headers["accept-ranges"] == "bytes" and headers["content-type"] == "video/mp4"
+
+        status, headers, body = fetch(video, {"Range": "bytes=-500"})
+        assert status == 206 and body == BODY[-500:]
+        assert headers["content-range"] == "bytes 1548-2047/2048" and headers["content-length"] == "500"
+
+        status, headers, body = fetch(video, {"Range": "bytes=1000-"})
+        assert status == 206 and body == BODY[1000:]
+        print("SUCCESS: 200 and 206 responses")
+
+    def test_multi_range_and_unsatisfiable(self, video):
+        """Several ranges or an invalid one get the full body; a range past the end gets 416"""
+        status, _, body = fetch(video, {"Range": "bytes=0-10,20-30"})
+        assert status == 200 and body == BODY
+
+        status, headers, body = fetch(video, {"Range": "bytes=4096-"})
+        assert status == 416 and headers["content-range"] == "bytes */2048" and body == b""
+
+        status, _, body = fetch(video, {"Range": "bytes=5-3"})
+        assert status == 200 and body == BODY
+        print("SUCCESS: Multi-range, invalid range and 416")
+
+    def test_if_range(self, video):
+        """A current validator keeps the range; a stale one gets a 200 with the full body"""
+        _, headers, _ = fetch(video)
+        etag, last_modified = headers["etag"], headers["last-modified"]
+
+        for validator in (etag, last_modified):
+            status, _, body = fetch(video, {"Range": "bytes=0-99", "If-Range": validator})
+            assert status == 206 and body == BODY[:100]
+
+        stale_date = formatdate(video.stat().st_mtime - 3600, usegmt=True)
+        for validator in ('"stale-etag"', f"W/{etag}", stale_date):
+            status, _, body = fetch(video, {"Range": "bytes=0-99", "If-Range": validator})
+            assert status == 200 and body == BODY
+        print("SUCCESS: If-Range honoured")
+
+    def test_conditional_and_head(self, video):
+        """If-None-Match gives 304; HEAD sends headers only"""
+        _, headers, _ = fetch(video)
+        status, _, body = fetch(video, {"If-None-Match": headers["etag"]})
+        assert status == 304 and body == b""
+
+        status, headers, body = fetch(video, {"Range": "bytes=0-99"}, method="HEAD")
+        assert status == 206 and headers["content-length"] == "100" and body == b""
+        print("SUCCESS: 304 and HEAD")
+
+
+@pytest.fixture
+def server(monkeypatch):
+    pytest.importorskip("httpx")
+    # Routing only: no request in these tests reaches the database
+    monkeypatch.setenv("MONGO_URL", os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    monkeypatch.setenv("DB_NAME", os.environ.get("DB_NAME", "test_database"))
+    try:
+        return importlib.import_module("server")
+    except ImportError as e:
+        pytest.skip(f"server dependencies missing: {e}")
+
+
+class TestUploadRoutes:
+    """Videos are only reachable through serve_video"""
+
+    def test_no_static_path_to_videos(self, server):
+        """Other spellings of /uploads/videos/<file> (extra slashes, ..) do not serve the file"""
+        import httpx
+
+        filename = f"{uuid.uuid4().hex}.mp4"
+        path = server.VIDEOS_DIR / filename
+        path.write_bytes(BODY)
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                return [await http.get(url) for url in (
+                    f"/uploads//videos/{filename}", f"/uploads/videos//{filename}",
+                    f"/uploads/thumbnails/%2E%2E/videos/{filename}",
+                )]
+
+        try:
+            responses = asyncio.run(scenario())
+        finally:
+            path.unlink()
+        for response in responses:
+            assert response.status_code == 404 and response.content != BODY
+        print("SUCCESS: Videos not served as static files")
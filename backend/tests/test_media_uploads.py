@@ -0,0 +1,61 @@
+"""
+Test suite for streaming admin uploads (media_uploads.store_upload)
+Builds UploadFile objects in-process and stores them in a temporary directory.
+"""
+import asyncio
+import hashlib
+import io
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from media_uploads import store_upload, UploadTooLarge, UnsupportedUploadType
+
+
+def make_upload(body, content_type="video/mp4", declare_size=True):
+    return UploadFile(
+        io.BytesIO(body), size=len(body) if declare_size else None, filename="clip.mp4",
+        headers=Headers({"content-type": content_type}),
+    )
+
+
+def store(upload, tmp_path, max_bytes, **kwargs):
+    return asyncio.run(store_upload(upload, tmp_path, "stored.mp4", max_bytes, **kwargs))
+
+
+class TestStoreUpload:
+    """Size limit, type check and atomic writes"""
+
+    def test_stores_in_chunks(self, tmp_path):
+        """The file lands under its final name with its size and SHA-256"""
+        body = bytes(range(256)) * 40
+        stored = store(make_upload(body), tmp_path, 1_000_000, chunk_size=1000, content_type_prefix="video/")
+        assert stored.path.read_bytes() == body and stored.size == len(body)
+        assert stored.sha256 == hashlib.sha256(body).hexdigest()
+        assert [p.name for p in tmp_path.iterdir()] == ["stored.mp4"]
+        print("SUCCESS: Upload stored")
+
+    def test_size_limit(self, tmp_path):
+        """A declared or streamed size over the limit is rejected and leaves no file behind"""
+        body = b"x" * 5000
+        with pytest.raises(UploadTooLarge):
+            store(make_upload(body), tmp_path, 4999)
+        # Without a declared size the limit is enforced while streaming
+        with pytest.raises(UploadTooLarge):
+            store(make_upload(body, declare_size=False), tmp_path, 4999, chunk_size=1000)
+        assert list(tmp_path.iterdir()) == []
+        assert store(make_upload(body, declare_size=False), tmp_path, 5000).size == 5000
+        print("SUCCESS: Size limit enforced")
+
+    def test_type_check(self, tmp_path):
+        """An upload whose content type is not the expected kind is rejected before anything is written"""
+        for content_type in ("image/png", "application/octet-stream", ""):
+            with pytest.raises(UnsupportedUploadType):
+                store(make_upload(b"data", content_type), tmp_path, 100, content_type_prefix="video/")
+        assert list(tmp_path.iterdir()) == []
+        assert store(make_upload(b"data", "image/png"), tmp_path, 100, content_type_prefix="image/").size == 4
+        print("SUCCESS: Content type checked")
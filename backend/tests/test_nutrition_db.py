@@ -0,0 +1,83 @@
+"""
+Test suite for the local nutrition table (nutrition_db.NutritionIndex)
+Pure Python, no server or database needed.
+"""
+from nutrition_db import NutritionIndex, FOODS, summarize_foods, merge_analyses
+
+
+class TestNutritionIndex:
+    """Parsing of quantities, units and French aliases"""
+
+    def setup_method(self):
+        self.index = NutritionIndex(FOODS)
+
+    def test_counted_items(self):
+        """'2 oeufs et une tartine' resolves fully from the table"""
+        result = self.index.resolve("2 oeufs et une tartine")
+        assert result.complete
+        eggs, toast = result.foods
+        assert eggs["name"] == "Oeuf"
+        assert eggs["quantity"] == "2 (100g)"
+        assert eggs["calories"] == 143
+        assert toast["name"] == "Tartine"
+        print("SUCCESS: Counted items resolved locally")
+
+    def test_weights_and_units(self):
+        """Grams, household measures and accents are understood"""
+        result = self.index.resolve("150g riz, un bol de lait, 1 c à s d'huile d'olive")
+        assert result.complete
+        rice, milk, oil = result.foods
+        assert (rice["quantity"], rice["calories"]) == ("150g", 195)
+        assert (milk["name"], milk["quantity"]) == ("Lait demi-écrémé", "1 bol (250ml)")
+        assert oil["calories"] == 133
+        print("SUCCESS: Weights and units parsed")
+
+    def test_vague_quantities_and_elisions(self):
+        """"quelques" is a fraction of a portion, or a few pieces; the l of l'eau is not litres"""
+        almonds, ham, water, litre = self.index.resolve(
+            "quelques amandes, quelques tranches de jambon, l'eau, 1.5 l d'eau"
+        ).foods
+        assert (almonds["quantity"], almonds["calories"]) == ("quelques (15g)", 87)
+        assert ham["quantity"] == "quelques tranches (120g)"
+        assert (water["name"], water["quantity"]) == ("Eau", "1 (250ml)")
+        assert litre["quantity"] == "1500ml"
+        print("SUCCESS: Vague quantities and elisions parsed")
+
+    def test_decimal_commas(self):
+        """A comma between digits is a decimal comma, not an item separator"""
+        result = self.index.resolve("1,5 kg de pommes de terre, 0,5 l de lait, 2,5 dl de jus d'orange,2 oeufs")
+        assert result.complete
+        assert [f["quantity"] for f in result.foods] == ["1500g", "500ml", "250ml", "2 (100g)"]
+        assert result.foods[0]["calories"] == 1200
+        print("SUCCESS: Decimal commas parsed")
+
+    def test_unmatched_items_are_returned(self):
+        """Only unknown items are left for the LLM"""
+        result = self.index.resolve("3 dattes et une pizza 4 fromages")
+        assert not result.complete
+        assert [f["name"] for f in result.foods] == ["Datte"]
+        assert result.unmatched == ["une pizza 4 fromages"]
+        assert self.index.stats()["resolved_partially"] == 1
+        print("SUCCESS: Unmatched items reported")
+
+    def test_summary_matches_analysis_shape(self):
+        """Totals are the sum of the items"""
+        result = self.index.resolve("2 oeufs, 1 banane")
+        summary = summarize_foods(result.foods, "test")
+        assert summary["total_calories"] == sum(f["calories"] for f in result.foods)
+        assert set(summary) == {"foods", "total_calories", "total_proteins", "total_carbs", "total_fats", "analysis_text"}
+        print("SUCCESS: Summary has the analysis shape")
+
+    def test_merge_names_local_foods(self):
+        """The merged analysis adds up both sides and names the foods the table resolved"""
+        local = self.index.resolve("2 oeufs").foods
+        llm = {"foods": [{"name": "Pizza", "quantity": "1 part", "calories": 270, "proteins": 11.0,
+                          "carbs": 33.0, "fats": 10.0}],
+               "total_calories": 270, "total_proteins": 11.0, "total_carbs": 33.0, "total_fats": 10.0,
+               "analysis_text": "Repas riche en glucides."}
+        merged = merge_analyses(local, llm)
+        assert merged["total_calories"] == 413 and len(merged["foods"]) == 2
+        assert merged["analysis_text"] == (
+            "Estimation à partir de la table nutritionnelle : Oeuf (2 (100g)). Repas riche en glucides."
+        )
+        print("SUCCESS: Local foods named in the merged analysis")
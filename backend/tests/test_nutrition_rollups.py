@@ -0,0 +1,131 @@
+"""
+Test suite for daily nutrition rollups (nutrition_rollups)
+Needs a MongoDB at MONGO_URL (rollups are $inc upserts and a $merge rebuild)
+and is skipped without one. Each test runs in its own scratch database.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import nutrition_rollups
+
+TODAY = datetime(2025, 3, 14, 12, 0, tzinfo=timezone.utc)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def scratch_db():
+    motor = pytest.importorskip("motor.motor_asyncio")
+    if not os.environ.get("MONGO_URL"):
+        pytest.skip("MONGO_URL not set")
+    client = motor.AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    name = f"rollups_test_{uuid.uuid4().hex[:8]}"
+    nutrition_rollups.reset_backfill_state()
+    yield client[name]
+    nutrition_rollups.reset_backfill_state()
+    run(client.drop_database(name))
+    client.close()
+
+
+def make_meal(calories, created_at=TODAY, user_id="u1"):
+    return {
+        "id": str(uuid.uuid4()), "user_id": user_id, "created_at": created_at,
+        "total_calories": calories, "total_proteins": 10.0, "total_carbs": 20.0, "total_fats": 5.0,
+    }
+
+
+async def log_meal(db, meal):
+    # What save_meal does
+    await db.meal_history.insert_one(dict(meal))
+    await nutrition_rollups.apply_meal(db, meal)
+
+
+async def delete_meal(db, meal):
+    # What the delete route does
+    await db.meal_history.delete_one({"id": meal["id"]})
+    await nutrition_rollups.apply_meal(db, meal, sign=-1)
+
+
+class TestRollups:
+    """Create, delete, and trusting rollups only after the backfill"""
+
+    def test_create_and_delete(self, scratch_db):
+        """Meals logged after the backfill are added and removed from their day"""
+        async def scenario():
+            await nutrition_rollups.rebuild_rollups(scratch_db)
+            nutrition_rollups.reset_backfill_state()
+            first, second = make_meal(500), make_meal(300)
+            await log_meal(scratch_db, first)
+            await log_meal(scratch_db, second)
+            after_create = await nutrition_rollups.get_day_totals(scratch_db, "u1", "2025-03-14")
+            await delete_meal(scratch_db, first)
+            after_delete = await nutrition_rollups.get_day_totals(scratch_db, "u1", "2025-03-14")
+            await delete_meal(scratch_db, second)
+            emptied = await nutrition_rollups.get_day_totals(scratch_db, "u1", "2025-03-14")
+            return after_create, after_delete, emptied
+
+        after_create, after_delete, emptied = run(scenario())
+        assert after_create["meals_count"] == 2 and after_create["calories"] == 800
+        assert after_delete["meals_count"] == 1 and after_delete["calories"] == 300
+        assert emptied == nutrition_rollups.EMPTY_TOTALS
+        print("SUCCESS: Rollups follow creates and deletes")
+
+    def test_not_backfilled_day_is_not_trusted(self, scratch_db):
+        """Before the backfill, a rollup holding only today's newest meal is ignored"""
+        async def scenario():
+            # Logged before rollups were maintained: in meal_history only
+            early = make_meal(400, TODAY - timedelta(hours=3))
+            await scratch_db.meal_history.insert_one(dict(early))
+            await log_meal(scratch_db, make_meal(250))
+            partial = await scratch_db.daily_nutrition.find_one({"user_id": "u1", "day": "2025-03-14"})
+            before = await nutrition_rollups.get_day_totals(scratch_db, "u1", "2025-03-14")
+            ranged = await nutrition_rollups.get_range_totals(scratch_db, "u1", "2025-03-01", "2025-03-31")
+            # Deleting a meal from a day without a rollup must not create a negative one
+            await delete_meal(scratch_db, make_meal(100, TODAY - timedelta(days=2)))
+            negative = await scratch_db.daily_nutrition.find_one({"user_id": "u1", "day": "2025-03-12"})
+            return partial, before, ranged, negative
+
+        partial, before, ranged, negative = run(scenario())
+        assert partial["calories"] == 250  # the rollup alone would under-report
+        assert before is None and ranged is None  # callers aggregate meal_history instead
+        assert negative is None
+        print("SUCCESS: Rollups ignored until the backfill")
+
+    def test_backfilled_day(self, scratch_db):
+        """A full rebuild counts the earlier meals and marks rollups as trusted"""
+        async def scenario():
+            early = make_meal(400, TODAY - timedelta(hours=3))
+            await scratch_db.meal_history.insert_one(dict(early))
+            await log_meal(scratch_db, make_meal(250))
+            await log_meal(scratch_db, make_meal(600, TODAY - timedelta(days=1)))
+            result = await nutrition_rollups.rebuild_rollups(scratch_db)
+            nutrition_rollups.reset_backfill_state()
+            today = await nutrition_rollups.get_day_totals(scratch_db, "u1", "2025-03-14")
+            await delete_meal(scratch_db, early)
+            after_delete = await nutrition_rollups.get_day_totals(scratch_db, "u1", "2025-03-14")
+            ranged = await nutrition_rollups.get_range_totals(scratch_db, "u1", "2025-03-01", "2025-03-31")
+            return result, today, after_delete, ranged
+
+        result, today, after_delete, ranged = run(scenario())
+        assert result["rebuilt"] == 2
+        assert today["meals_count"] == 2 and today["calories"] == 650
+        assert after_delete["meals_count"] == 1 and after_delete["calories"] == 250
+        assert [(day["day"], day["calories"]) for day in ranged] == [("2025-03-13", 600), ("2025-03-14", 250)]
+        print("SUCCESS: Backfilled rollups trusted")
+
+    def test_user_rebuild_does_not_mark_backfill(self, scratch_db):
+        """Rebuilding a single user leaves the other users' rollups untrusted"""
+        async def scenario():
+            await log_meal(scratch_db, make_meal(250))
+            await nutrition_rollups.rebuild_rollups(scratch_db, "u1")
+            nutrition_rollups.reset_backfill_state()
+            return await nutrition_rollups.rollups_ready(scratch_db)
+
+        assert run(scenario()) is False
+        print("SUCCESS: Per-user rebuild is not a backfill")
@@ -0,0 +1,40 @@
+"""
+Test suite for history pagination cursors (pagination)
+Pure Python, no server needed.
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+from pagination import encode_cursor, decode_cursor, clamp_page_size, InvalidCursor, MAX_PAGE_SIZE
+
+
+class TestCursor:
+    """Opaque cursor round trips and page size clamping"""
+
+    def test_round_trip(self):
+        """String and datetime sort values survive encoding"""
+        assert decode_cursor(encode_cursor("2024-05-01T12:00:00+00:00", "abc")) == ("2024-05-01T12:00:00+00:00", "abc")
+        when = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+        assert decode_cursor(encode_cursor(when, "abc")) == (when, "abc")
+        print("SUCCESS: Cursors round trip")
+
+    def test_cursor_is_url_safe(self):
+        """Cursors can be passed as a query parameter without escaping"""
+        cursor = encode_cursor("2024-05-01T12:00:00+00:00", "c0ffee-??>>")
+        assert all(c.isalnum() or c in "-_" for c in cursor)
+        print("SUCCESS: Cursor is URL safe")
+
+    def test_invalid_cursor(self):
+        """Garbage cursors raise InvalidCursor"""
+        for cursor in ("not-a-cursor!", "e30", encode_cursor("x", "y")[:-3]):
+            with pytest.raises(InvalidCursor):
+                decode_cursor(cursor)
+        print("SUCCESS: Invalid cursors rejected")
+
+    def test_clamp_page_size(self):
+        """Page size is kept between 1 and the server maximum"""
+        assert clamp_page_size(0) == 1
+        assert clamp_page_size(20) == 20
+        assert clamp_page_size(10 ** 6) == MAX_PAGE_SIZE
+        print("SUCCESS: Page size clamped")
@@ -0,0 +1,174 @@
+"""
+Test suite for bcrypt hashing off the event loop (password_hasher)
+The hasher runs in-process with a low cost and a one-thread executor; the
+login tests drive the app in-process too and need a MongoDB at MONGO_URL.
+"""
+import asyncio
+import importlib
+import os
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip("bcrypt")
+
+from password_hasher import PasswordHasher, HasherBusy
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def tiny_hasher(**kwargs):
+    options = {"rounds": 4, "max_workers": 1, "max_queue": 0}
+    options.update(kwargs)
+    return PasswordHasher(**options)
+
+
+async def occupy(hasher, seconds):
+    """Keep every hashing slot busy for `seconds`; returns the blocking task"""
+    blocker = asyncio.create_task(hasher._run(time.sleep, seconds))
+    await asyncio.sleep(0.01)
+    return blocker
+
+
+class TestPasswordHasher:
+    """Counters, queue limit and cost checks"""
+
+    def test_counts_outcomes(self):
+        """Successful calls count as completed, raising ones as failed"""
+        async def scenario():
+            hasher = tiny_hasher()
+            hashed = await hasher.hash("secret")
+            assert await hasher.verify("secret", hashed)
+            with pytest.raises(ValueError):
+                await hasher.verify("secret", "not-a-bcrypt-hash")
+            stats = hasher.stats()
+            hasher.shutdown()
+            return stats
+
+        stats = run(scenario())
+        assert stats["completed"] == 2 and stats["failed"] == 1 and stats["in_flight"] == 0
+        print("SUCCESS: Outcomes counted")
+
+    def test_queue_full(self):
+        """With every slot taken, new calls fail fast with HasherBusy"""
+        async def scenario():
+            hasher = tiny_hasher()
+            blocker = await occupy(hasher, 0.2)
+            started = time.monotonic()
+            with pytest.raises(HasherBusy):
+                await hasher.hash("secret")
+            waited = time.monotonic() - started
+            await blocker
+            stats = hasher.stats()
+            hasher.shutdown()
+            return waited, stats
+
+        waited, stats = run(scenario())
+        assert waited < 0.1
+        assert stats["rejected"] == 1 and stats["completed"] == 1
+        print("SUCCESS: Full queue rejects at once")
+
+    def test_needs_rehash(self):
+        """Only hashes with another cost factor need rehashing"""
+        hasher = tiny_hasher()
+        assert not hasher.needs_rehash(hasher._hash("secret"))
+        assert tiny_hasher(rounds=5).needs_rehash(hasher._hash("secret"))
+        assert not hasher.needs_rehash("not-a-bcrypt-hash")
+        hasher.shutdown()
+        print("SUCCESS: Cost factor compared")
+
+
+@pytest.fixture
+def app(monkeypatch):
+    motor = pytest.importorskip("motor.motor_asyncio")
+    httpx = pytest.importorskip("httpx")
+    if not os.environ.get("MONGO_URL"):
+        pytest.skip("MONGO_URL not set")
+    monkeypatch.setenv("DB_NAME", os.environ.get("DB_NAME", "test_database"))
+    try:
+        server = importlib.import_module("server")
+    except ImportError as e:
+        pytest.skip(f"server dependencies missing: {e}")
+    client = motor.AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    name = f"hasher_test_{uuid.uuid4().hex[:8]}"
+    hasher = tiny_hasher()
+    monkeypatch.setattr(server, "db", client[name])
+    monkeypatch.setattr(server, "password_hasher", hasher)
+    server.user_cache.clear()
+    yield server, httpx
+    hasher.shutdown()
+    run(client.drop_database(name))
+    client.close()
+
+
+async def login(server, httpx, email, password):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+        return await http.post("/api/auth/login", json={"email": email, "password": password})
+
+
+async def add_user(server, email, password_hash):
+    user_id = str(uuid.uuid4())
+    await server.db.users.insert_one({
+        "id": user_id, "email": email, "first_name": "Test", "password_hash": password_hash,
+        "created_at": server.utc_now(),
+    })
+    return user_id
+
+
+class TestLogin:
+    """Login through the app, in-process"""
+
+    def test_busy_hasher_is_503(self, app):
+        """A login that cannot get a hashing slot gets a 503 with Retry-After"""
+        server, httpx = app
+
+        async def scenario():
+            await add_user(server, "busy@example.com", server.password_hasher._hash("secret"))
+            blocker = await occupy(server.password_hasher, 0.3)
+            response = await login(server, httpx, "busy@example.com", "secret")
+            await blocker
+            return response
+
+        response = run(scenario())
+        assert response.status_code == 503 and response.headers["retry-after"] == "1"
+        print("SUCCESS: Busy hasher answered 503")
+
+    def test_rehash_on_login(self, app):
+        """A password stored with an old cost is rehashed after a successful login"""
+        server, httpx = app
+
+        async def scenario():
+            old_hash = PasswordHasher(rounds=5)._hash("secret")
+            user_id = await add_user(server, "rehash@example.com", old_hash)
+            response = await login(server, httpx, "rehash@example.com", "secret")
+            await asyncio.gather(*server.background_tasks)
+            user = await server.db.users.find_one({"id": user_id})
+            return response, old_hash, user["password_hash"]
+
+        response, old_hash, new_hash = run(scenario())
+        assert response.status_code == 200
+        assert new_hash != old_hash and not server.password_hasher.needs_rehash(new_hash)
+        assert server.password_hasher._verify("secret", new_hash)
+        print("SUCCESS: Password rehashed on login")
+
+    def test_rehash_keeps_newer_password(self, app):
+        """A password changed while the rehash runs is not overwritten by it"""
+        server, _ = app
+
+        async def scenario():
+            old_hash = PasswordHasher(rounds=5)._hash("secret")
+            user_id = await add_user(server, "reset@example.com", old_hash)
+            reset_hash = server.password_hasher._hash("new-secret")
+            # The reset lands before the rehash writes its result
+            await server.db.users.update_one({"id": user_id}, {"$set": {"password_hash": reset_hash}})
+            await server.rehash_password(user_id, "secret", old_hash)
+            user = await server.db.users.find_one({"id": user_id})
+            return reset_hash, user["password_hash"]
+
+        reset_hash, stored_hash = run(scenario())
+        assert stored_hash == reset_hash
+        print("SUCCESS: Reset survives a concurrent rehash")
@@ -0,0 +1,271 @@
+"""
+Test suite for the app-scoped Stripe Checkout client (payments.StripeCheckoutClient)
+Runs against a local mock Stripe server, no network access needed.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from payments import (
+    StripeCheckoutClient, PaymentError, InvalidSignature, verify_webhook, encode_form, checkout_session_id,
+    STRIPE_API_BASE, EMERGENT_PROXY_BASE
+)
+
+
+class MockStripeServer:
+    """Minimal /v1/checkout/sessions endpoints with scripted failures"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.fail_next = []  # status codes returned before the real response
+        self.delay = 0.0
+        self.requests = []
+        self.connections = set()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out and hung up
+
+            def _handle(self, method):
+                mock.connections.add(self.client_address)
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode()) if length else {}
+                mock.requests.append((method, self.path, dict(self.headers), form))
+                if mock.delay:
+                    time.sleep(mock.delay)
+                if mock.fail_next:
+                    status = mock.fail_next.pop(0)
+                    return self._reply(status, {"error": {"message": f"mock {status}"}})
+                if self.headers.get("Authorization") != "Bearer sk_test_mock":
+                    return self._reply(401, {"error": {"message": "Invalid API key"}}, {"Stripe-Should-Retry": "false"})
+                if method == "POST" and self.path == "/v1/checkout/sessions":
+                    session_id = f"cs_test_{len(mock.sessions) + 1}"
+                    mock.sessions[session_id] = {
+                        "id": session_id, "object": "checkout.session", "status": "open",
+                        "payment_status": "unpaid", "url": f"https://checkout.test/{session_id}",
+                        "amount_total": int(form["line_items[0][price_data][unit_amount]"][0]),
+                        "currency": form["line_items[0][price_data][currency]"][0],
+                        "metadata": {key[9:-1]: values[0] for key, values in form.items() if key.startswith("metadata[")},
+                    }
+                    return self._reply(200, mock.sessions[session_id])
+                session = mock.sessions.get(self.path.rsplit("/", 1)[-1])
+                if method == "GET" and session:
+                    return self._reply(200, session)
+                return self._reply(404, {"error": {"message": "No such checkout session"}})
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+@pytest.fixture
+def stripe_server():
+    server = MockStripeServer()
+    yield server
+    server.stop()
+
+
+def make_client(server, **kwargs):
+    options = {"retry_base_seconds": 0.01, "retry_max_seconds": 0.05}
+    options.update(kwargs)
+    return StripeCheckoutClient("sk_test_mock", api_base=server.url, **options)
+
+
+def create(client):
+    return client.create_checkout_session(
+        amount=29.9, currency="eur", product_name="Programme", success_url="https://app/ok",
+        cancel_url="https://app/ko", metadata={"user_id": "u1", "course_id": "c1"}
+    )
+
+
+class TestStripeCheckoutClient:
+    """Pooled connections, retries and timeouts against the mock server"""
+
+    def test_connections_are_reused(self, stripe_server):
+        """Many calls from one client share a keep-alive connection"""
+        async def scenario():
+            client = make_client(stripe_server)
+            session = await create(client)
+            statuses = [await client.get_checkout_status(session.session_id) for _ in range(10)]
+            await client.close()
+            return session, statuses
+
+        session, statuses = asyncio.run(scenario())
+        assert session.url.endswith(session.session_id)
+        assert statuses[-1].amount_total == 2990 and statuses[-1].metadata == {"user_id": "u1", "course_id": "c1"}
+        assert len(stripe_server.requests) == 11
+        assert len(stripe_server.connections) == 1
+        print(f"SUCCESS: 11 requests over {len(stripe_server.connections)} connection")
+
+    def test_retries_keep_idempotency_key(self, stripe_server):
+        """5xx and 429 are retried with the same Idempotency-Key; 4xx is not"""
+        async def scenario():
+            client = make_client(stripe_server, max_retries=2)
+            stripe_server.fail_next = [503, 429]
+            session = await create(client)
+            with pytest.raises(PaymentError) as missing:
+                await client.get_checkout_status("cs_unknown")
+            stats = client.stats()
+            await client.close()
+            return session, missing.value, stats
+
+        session, missing, stats = asyncio.run(scenario())
+        keys = {headers["Idempotency-Key"] for method, _, headers, _ in stripe_server.requests if method == "POST"}
+        assert session.session_id == "cs_test_1" and len(keys) == 1
+        assert missing.status == 404
+        assert stats["retries"] == 2 and stats["errors"] == 1
+        print("SUCCESS: Retries are idempotent, 404 fails fast")
+
+    def test_gives_up_after_retries_and_timeouts(self, stripe_server):
+        """Exhausted retries and read timeouts surface as PaymentError"""
+        async def scenario():
+            client = make_client(stripe_server, max_retries=1)
+            stripe_server.fail_next = [500, 500]
+            with pytest.raises(PaymentError):
+                await create(client)
+            stripe_server.delay = 0.5
+            slow = make_client(stripe_server, max_retries=0, timeout=0.1)
+            with pytest.raises(PaymentError):
+                await slow.get_checkout_status("cs_test_1")
+            await client.close()
+            await slow.close()
+
+        asyncio.run(scenario())
+        print("SUCCESS: Failures surface as PaymentError")
+
+    def test_api_base_matches_key(self):
+        """The shared emergent key goes through the proxy; a key/base mismatch fails at construction"""
+        async def scenario():
+            emergent = StripeCheckoutClient("sk_test_emergent")
+            direct = StripeCheckoutClient("sk_live_real")
+            bases = emergent.api_base, direct.api_base
+            await emergent.close()
+            await direct.close()
+            for key, base in (("sk_test_emergent", STRIPE_API_BASE), ("sk_live_real", EMERGENT_PROXY_BASE + "/")):
+                with pytest.raises(ValueError):
+                    StripeCheckoutClient(key, api_base=base)
+            return bases
+
+        assert asyncio.run(scenario()) == (EMERGENT_PROXY_BASE, STRIPE_API_BASE)
+        print("SUCCESS: Base URL follows the key")
+
+
+class TestWebhooks:
+    """Stripe-Signature verification and form encoding"""
+
+    def test_verify_webhook(self):
+        """Valid signatures pass; tampered, stale or missing ones are rejected"""
+        payload = json.dumps({"id": "evt_1", "type": "checkout.session.completed"}).encode()
+        now = int(time.time())
+        signature = hmac.new(b"whsec_test", f"{now}.".encode() + payload, hashlib.sha256).hexdigest()
+        header = f"t={now},v1={signature}"
+        assert verify_webhook(payload, header, "whsec_test")["id"] == "evt_1"
+        for bad_payload, bad_header, at in (
+            (payload + b" ", header, now),
+            (payload, header, now + 3600),
+            (payload, None, now),
+            (payload, "t=abc", now),
+        ):
+            with pytest.raises(InvalidSignature):
+                verify_webhook(bad_payload, bad_header, "whsec_test", now=at)
+        print("SUCCESS: Webhook signatures verified")
+
+    def test_unsigned_events_are_resolved(self, stripe_server):
+        """Without a secret the event is stored as sent, and its session re-read from Stripe when processed"""
+        async def scenario():
+            client = make_client(stripe_server, allow_unsigned_webhooks=True)
+            session = await create(client)
+            payload = json.dumps({"id": "evt_2", "type": "checkout.session.completed", "data": {"object": {
+                "object": "checkout.session", "id": session.session_id, "payment_status": "paid"}}}).encode()
+            event = client.verify_event(payload, None)
+            resolved = await client.resolve_event(event)
+            await client.close()
+            return session, event, resolved
+
+        session, event, resolved = asyncio.run(scenario())
+        assert checkout_session_id(event) == session.session_id
+        assert resolved.payment_status == "unpaid"  # what Stripe says, not what the body claims
+        assert resolved.metadata == {"user_id": "u1", "course_id": "c1"}
+        print("SUCCESS: Unsigned event resolved against Stripe")
+
+    def test_unsigned_events_are_refused(self, stripe_server):
+        """Unsigned events need an explicit opt-in, id-less events are never accepted, unknown sessions are 404"""
+        async def scenario():
+            strict = make_client(stripe_server)
+            lenient = make_client(stripe_server, allow_unsigned_webhooks=True)
+            event = {"id": "evt_3", "type": "checkout.session.completed",
+                     "data": {"object": {"object": "checkout.session", "id": "cs_forged"}}}
+            with pytest.raises(InvalidSignature):
+                strict.verify_event(json.dumps(event).encode(), None)
+            with pytest.raises(InvalidSignature):
+                lenient.verify_event(json.dumps({**event, "id": None}).encode(), None)
+            with pytest.raises(PaymentError) as unknown:
+                await lenient.resolve_event(lenient.verify_event(json.dumps(event).encode(), None))
+            await strict.close()
+            await lenient.close()
+            return unknown.value
+
+        assert asyncio.run(scenario()).status == 404
+        print("SUCCESS: Unsigned and id-less events refused")
+
+    def test_proxy_key_accepts_unsigned_events(self, stripe_server):
+        """By default only the Emergent proxy key, which has no webhook secret, accepts unsigned events"""
+        event = json.dumps({"id": "evt_4", "type": "checkout.session.completed", "data": {"object": {}}}).encode()
+
+        async def scenario():
+            proxy = StripeCheckoutClient("sk_test_emergent", api_base=stripe_server.url)
+            signed = StripeCheckoutClient("sk_test_emergent", api_base=stripe_server.url, webhook_secret="whsec_test")
+            refused = StripeCheckoutClient("sk_test_emergent", api_base=stripe_server.url,
+                                           allow_unsigned_webhooks=False)
+            other_key = make_client(stripe_server)
+            accepted = proxy.verify_event(event, None)
+            for client in (signed, refused, other_key):
+                with pytest.raises(InvalidSignature):
+                    client.verify_event(event, None)
+            for client in (proxy, signed, refused, other_key):
+                await client.close()
+            return accepted
+
+        assert asyncio.run(scenario())["id"] == "evt_4"
+        print("SUCCESS: Proxy key accepts unsigned events")
+
+    def test_encode_form(self):
+        """Nested params use Stripe's bracket notation"""
+        pairs = encode_form({"mode": "payment", "line_items": [{"quantity": 1, "price_data": {"currency": "eur"}}],
+                             "payment_method_types": ["card", "link"], "metadata": {"user_id": "u1"}})
+        assert ("line_items[0][price_data][currency]", "eur") in pairs
+        assert ("payment_method_types[1]", "link") in pairs
+        assert ("metadata[user_id]", "u1") in pairs
+        print("SUCCESS: Form encoding")
@@ -0,0 +1,62 @@
+"""
+Test suite for progress stats:
+- POST /api/progress/session - Record a completed session
+- GET /api/progress/stats - Cumulative totals and streak
+
+Concurrent completions from the same user (e.g. an offline queue flush) must
+all be counted exactly once.
+"""
+import pytest
+import requests
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+PARALLEL_SESSIONS = 25
+
+
+class TestConcurrentSessionCompletion:
+    """Test that parallel session completions never lose increments"""
+
+    @pytest.fixture
+    def auth_headers(self):
+        """Register a fresh user so the stats start from zero"""
+        response = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"test_stats_{uuid.uuid4().hex[:10]}@amelfit.com",
+            "password": "test123",
+            "first_name": "Stats"
+        })
+        if response.status_code != 200:
+            pytest.skip("Registration failed")
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        yield headers
+        requests.delete(f"{BASE_URL}/api/user/account", headers=headers)
+
+    def test_parallel_completions_exact_totals(self, auth_headers):
+        """Fire N session completions at once and check the exact totals"""
+        def complete(i):
+            return requests.post(f"{BASE_URL}/api/progress/session", headers=auth_headers, json={
+                "week_id": 1,
+                "seance_id": i,
+                "steps": 1000 + i,
+                "duration_minutes": 10 + i,
+                "phases_completed": 3
+            })
+
+        with ThreadPoolExecutor(max_workers=PARALLEL_SESSIONS) as pool:
+            responses = list(pool.map(complete, range(PARALLEL_SESSIONS)))
+        assert all(r.status_code == 200 for r in responses)
+
+        response = requests.get(f"{BASE_URL}/api/progress/stats", headers=auth_headers)
+        assert response.status_code == 200
+        stats = response.json()
+
+        assert stats["sessions_completed"] == PARALLEL_SESSIONS
+        assert stats["total_steps"] == sum(1000 + i for i in range(PARALLEL_SESSIONS))
+        assert stats["total_minutes"] == sum(10 + i for i in range(PARALLEL_SESSIONS))
+        # All sessions happened today: a new streak of one day
+        assert stats["current_streak"] == 1
+        assert stats["best_streak"] == 1
+        print(f"SUCCESS: {PARALLEL_SESSIONS} parallel sessions counted exactly once")
@@ -0,0 +1,80 @@
+"""
+Test suite for timestamp helpers (timestamps) and the string-to-date migration (migrate_dates)
+Pure Python, no server needed.
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+from timestamps import utc_now, to_utc, to_iso, utc_day, day_bounds, range_filter, day_expression
+
+
+class TestTimestamps:
+    """Conversions between BSON dates, legacy ISO strings and API strings"""
+
+    def test_utc_now_millisecond_precision(self):
+        """utc_now is aware and already at the precision BSON stores"""
+        now = utc_now()
+        assert now.tzinfo is not None
+        assert now.microsecond % 1000 == 0
+        print("SUCCESS: utc_now is BSON-exact")
+
+    def test_to_utc(self):
+        """Strings, naive and aware datetimes all become aware UTC datetimes"""
+        expected = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+        assert to_utc("2024-05-01T12:00:00+00:00") == expected
+        assert to_utc("2024-05-01T12:00:00Z") == expected
+        assert to_utc("2024-05-01T14:00:00+02:00") == expected
+        assert to_utc(datetime(2024, 5, 1, 12)) == expected
+        assert to_utc(None) is None
+        with pytest.raises(ValueError):
+            to_utc("hier")
+        print("SUCCESS: Timestamps normalized to UTC")
+
+    def test_to_iso_and_utc_day(self):
+        """API output stays an ISO string; the day is the same for both storage forms"""
+        when = datetime(2024, 5, 1, 23, 30, tzinfo=timezone.utc)
+        assert to_iso(when) == "2024-05-01T23:30:00+00:00"
+        assert to_iso("2024-05-01T23:30:00+00:00") == "2024-05-01T23:30:00+00:00"
+        assert utc_day(when) == utc_day(to_iso(when)) == "2024-05-01"
+        print("SUCCESS: ISO output and UTC day")
+
+    def test_day_bounds_and_range_filter(self):
+        """A day is a half-open range matching dates and, in legacy mode, strings"""
+        start, end = day_bounds("2024-05-01")
+        assert (end - start).days == 1
+        assert range_filter("created_at", start, end, legacy_strings=False) == {
+            "created_at": {"$gte": start, "$lt": end}
+        }
+        legacy = range_filter("created_at", start, end)
+        assert legacy["$or"][1] == {
+            "created_at": {"$gte": "2024-05-01T00:00:00+00:00", "$lt": "2024-05-02T00:00:00+00:00"}
+        }
+        assert range_filter("completed_at", start=start, legacy_strings=False) == {"completed_at": {"$gte": start}}
+        with pytest.raises(ValueError):
+            day_bounds("01/05/2024")
+        assert "$cond" in day_expression("$created_at")
+        print("SUCCESS: Range filters built")
+
+
+class TestDateMigration:
+    """Per-document conversion used by migrate_dates.py"""
+
+    def test_conversion_is_conditional(self):
+        """Only string fields are converted, guarded by their current value"""
+        from migrate_dates import conversion
+
+        doc = {"_id": 1, "created_at": "2024-05-01T12:00:00+00:00", "last_login": datetime(2024, 5, 2)}
+        change = conversion(doc, ["created_at", "last_login"])
+        assert change["filter"] == {"_id": 1, "created_at": "2024-05-01T12:00:00+00:00"}
+        assert change["update"] == {"$set": {"created_at": datetime(2024, 5, 1, 12, tzinfo=timezone.utc)}}
+        print("SUCCESS: Conditional conversion")
+
+    def test_nothing_to_convert(self):
+        """Already-migrated and unparseable documents yield no update"""
+        from migrate_dates import conversion
+
+        assert conversion({"_id": 1, "created_at": datetime(2024, 5, 1)}, ["created_at"]) is None
+        assert conversion({"_id": 2, "created_at": "bientôt"}, ["created_at"]) is None
+        assert conversion({"_id": 3}, ["created_at"]) is None
+        print("SUCCESS: Nothing to convert")
@@ -0,0 +1,124 @@
+"""
+Test suite for the webhook inbox (webhook_inbox.WebhookInbox)
+Needs a MongoDB at MONGO_URL and is skipped without one.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from leased_queue import PermanentError
+from webhook_inbox import WebhookInbox, DONE, DEAD
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def inbox_collection():
+    motor = pytest.importorskip("motor.motor_asyncio")
+    if not os.environ.get("MONGO_URL"):
+        pytest.skip("MONGO_URL not set")
+    from db_indexes import INDEX_REGISTRY
+    client = motor.AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    db = client[os.environ.get("DB_NAME", "test_database")]
+    name = f"webhook_inbox_test_{uuid.uuid4().hex[:8]}"
+    run(db[name].create_indexes(INDEX_REGISTRY["webhook_inbox"]))
+    yield db[name]
+    run(db.drop_collection(name))
+    client.close()
+
+
+class TestWebhookInbox:
+    """Deduplication, per-key ordering, retries and replay against MongoDB"""
+
+    def test_ordering_per_session_and_retries(self, inbox_collection):
+        """A failing event holds back its own session only; retries keep the order"""
+        processed = []
+        failures = {"evt_a1": 1}
+
+        async def handler(event):
+            await asyncio.sleep(0.01)
+            if failures.get(event["event_id"]):
+                failures[event["event_id"]] -= 1
+                raise ConnectionError("database unavailable")
+            processed.append(event["event_id"])
+
+        async def scenario():
+            inbox = WebhookInbox(inbox_collection, handler, retry_base_seconds=0, retry_max_seconds=0)
+            for event_id, session in (("evt_a1", "cs_a"), ("evt_b1", "cs_b"), ("evt_a2", "cs_a"),
+                                      ("evt_b2", "cs_b"), ("evt_a3", "cs_a")):
+                assert await inbox.receive("stripe", event_id, "checkout.session.completed", session, "{}")
+            assert not await inbox.receive("stripe", "evt_a1", "checkout.session.completed", "cs_a", "{}")
+            batch = await inbox.claim_batch()
+            first_batch = [event["event_id"] for event in batch]
+            await inbox.process(batch)
+            for _ in range(10):
+                if not await inbox.drain():
+                    break
+            return inbox, first_batch
+
+        inbox, first_batch = run(scenario())
+        assert sorted(first_batch) == ["evt_a1", "evt_b1"]  # one head per session
+        assert [e for e in processed if e.startswith("evt_a")] == ["evt_a1", "evt_a2", "evt_a3"]
+        assert [e for e in processed if e.startswith("evt_b")] == ["evt_b1", "evt_b2"]
+        assert run(inbox_collection.count_documents({"status": DONE})) == 5
+        stats = inbox.stats()
+        assert stats["duplicates"] == 1 and stats["retried"] >= 1
+        print(f"SUCCESS: Ordered per session, stats {stats}")
+
+    def test_dead_letter_and_replay(self, inbox_collection):
+        """An event that keeps failing is dead-lettered, unblocks its key and can be replayed"""
+        broken = {"on": True}
+        processed = []
+
+        async def handler(event):
+            if broken["on"] and event["event_id"] == "evt_1":
+                raise ValueError("bug in the handler")
+            processed.append((event["event_id"], event["replays"]))
+
+        async def scenario():
+            inbox = WebhookInbox(inbox_collection, handler, max_attempts=2, retry_base_seconds=0, retry_max_seconds=0)
+            await inbox.receive("stripe", "evt_1", "checkout.session.completed", "cs_1", "{}")
+            await inbox.receive("stripe", "evt_2", "checkout.session.expired", "cs_1", "{}")
+            for _ in range(5):
+                await inbox.drain()
+            dead = await inbox_collection.find_one({"event_id": "evt_1"}, {"_id": 0})
+            broken["on"] = False
+            replayed = await inbox.replay()
+            await inbox.drain()
+            forced = await inbox.replay(["evt_2"], include_done=True)
+            await inbox.drain()
+            return dead, replayed, forced, await inbox.counts()
+
+        dead, replayed, forced, counts = run(scenario())
+        assert dead["status"] == DEAD and "bug in the handler" in dead["last_error"]
+        assert replayed == 1 and forced == 1
+        assert processed == [("evt_2", 0), ("evt_1", 1), ("evt_2", 1)]
+        assert counts == {DONE: 2}
+        print("SUCCESS: Dead-lettered and replayed")
+
+    def test_permanent_errors_and_missing_ids(self, inbox_collection):
+        """Events without an id are refused; a permanent error dead-letters at once and expires"""
+        calls = []
+
+        async def handler(event):
+            calls.append(event["event_id"])
+            raise PermanentError("No such checkout session")
+
+        async def scenario():
+            inbox = WebhookInbox(inbox_collection, handler, max_attempts=5, retry_base_seconds=0, retry_max_seconds=0)
+            with pytest.raises(ValueError):
+                await inbox.receive("stripe", None, "checkout.session.completed", "cs_1", "{}")
+            await inbox.receive("stripe", "evt_1", "checkout.session.completed", "cs_forged", "{}")
+            for _ in range(3):
+                await inbox.drain()
+            return await inbox_collection.find_one({"event_id": "evt_1"}, {"_id": 0})
+
+        dead = run(scenario())
+        assert calls == ["evt_1"]
+        assert dead["status"] == DEAD and dead["expires_at"] and "No such checkout session" in dead["last_error"]
+        assert run(inbox_collection.count_documents({})) == 1
+        print("SUCCESS: Permanent errors not retried")
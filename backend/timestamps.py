@@ -0,0 +1,79 @@
+"""Timestamp helpers: BSON dates in MongoDB, ISO strings in the API.
+
+Timestamps used to be stored as ISO strings, so range queries compared
+strings and date operators were unavailable. They are now written as native
+BSON datetimes (`utc_now()`). Documents written before the switch are
+converted by `migrate_dates.py`. Until that migration has finished,
+`range_filter` and `day_expression` also match the legacy string form, and
+`to_iso` keeps every API field an ISO 8601 string whichever form was
+read.
+"""
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+
+def utc_now() -> datetime:
+    """Current UTC time at BSON (millisecond) precision, so it reads back unchanged"""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def to_utc(value: Any) -> Optional[datetime]:
+    """Aware UTC datetime from a BSON date or a legacy ISO string (naive values are UTC)"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_iso(value: Any) -> Any:
+    """ISO 8601 string for API output; strings (legacy data) pass through untouched"""
+    if isinstance(value, datetime):
+        return to_utc(value).isoformat()
+    return value
+
+
+def utc_day(value: Any) -> str:
+    """UTC calendar day (YYYY-MM-DD) of a timestamp in either storage form"""
+    if isinstance(value, str):
+        return value[:10]
+    return to_utc(value).strftime("%Y-%m-%d")
+
+
+def day_bounds(day: str) -> Tuple[datetime, datetime]:
+    """[start, end) of a YYYY-MM-DD UTC day"""
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def range_filter(field: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 legacy_strings: bool = True) -> Dict[str, Any]:
+    """Query on start <= field < end matching BSON dates and, optionally, legacy ISO strings
+
+    BSON comparisons never cross types, so the date bounds only match dates
+    and the string bounds only match strings.
+    """
+    def bounds(convert):
+        condition = {}
+        if start is not None:
+            condition["$gte"] = convert(start)
+        if end is not None:
+            condition["$lt"] = convert(end)
+        return condition
+
+    date_filter = {field: bounds(lambda value: value)}
+    if not legacy_strings:
+        return date_filter
+    return {"$or": [date_filter, {field: bounds(lambda value: value.astimezone(timezone.utc).isoformat())}]}
+
+
+def day_expression(field_path: str) -> Dict[str, Any]:
+    """Aggregation expression for the UTC day of `field_path` (e.g. "$created_at") in either form"""
+    return {"$cond": [
+        {"$eq": [{"$type": field_path}, "date"]},
+        {"$dateToString": {"format": "%Y-%m-%d", "date": field_path}},
+        {"$substrCP": [field_path, 0, 10]},
+    ]}
@@ -0,0 +1,231 @@
+"""Webhook inbox.
+
+The webhook route only verifies the signature and stores the raw event in the
+`webhook_inbox` collection with `WebhookInbox.receive`, then acknowledges it.
+Everything else (reading the transaction, fulfilling the purchase) happens in
+a background consumer, so the route's latency does not depend on how busy the
+database is during a sale, and a failure surfaces as a retry here instead of
+an error body the provider ignores. If the event cannot even be stored the
+route fails and the provider redelivers it.
+
+- Deliveries are deduplicated on (provider, event_id) when they are stored.
+- Events with the same `ordering_key` (the checkout session) are processed
+  one at a time, in the order they were received: only the oldest
+  unfinished event of a key can be claimed. Different keys run concurrently.
+- A failing event is retried with exponential backoff and holds back the
+  later events of its key; after `max_attempts` it is dead-lettered and the
+  key moves on. A handler that raises `PermanentError` (the event names
+  something the provider does not know) is dead-lettered at once, and like
+  processed events it expires after the retention period.
+- `replay` puts dead (or, explicitly, processed) events back in the queue:
+
+    python webhook_inbox.py                  # events per status
+    python webhook_inbox.py --replay-dead
+    python webhook_inbox.py --replay evt_123 evt_456
+
+Processed events expire after `retention_seconds` through a TTL index on
+`expires_at`. Claims, leases, backoff and the consumer loop come from
+`leased_queue`.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import uuid
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from leased_queue import LeasedConsumer, PermanentError
+from timestamps import utc_now
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+DEAD = "dead"
+
+
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class WebhookInbox(LeasedConsumer):
+    pending_status = PENDING
+    processing_status = PROCESSING
+    dead_status = DEAD
+    name = "Webhook inbox"
+
+    def __init__(self, collection, handler: EventHandler, batch_size: int = 20, max_attempts: int = 8,
+                 retry_base_seconds: float = 10, retry_max_seconds: float = 1800, lease_seconds: int = 120,
+                 poll_interval: float = 5.0, retention_seconds: int = 30 * 24 * 3600):
+        super().__init__(collection, max_attempts, poll_interval=poll_interval, lease_seconds=lease_seconds,
+                         retry_base_seconds=retry_base_seconds, retry_max_seconds=retry_max_seconds)
+        self.handler = handler
+        self.batch_size = batch_size
+        self.retention = timedelta(seconds=retention_seconds)
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.retried = 0
+
+    async def receive(self, provider: str, event_id: str, event_type: str,
+                      ordering_key: Optional[str], payload: str) -> bool:
+        """Store a verified event for processing; False when it was already received"""
+        if not event_id:
+            # Without an id redeliveries cannot be deduplicated
+            raise ValueError("Webhook events need an id")
+        now = utc_now()
+        try:
+            await self.collection.insert_one({
+                "id": str(uuid.uuid4()),
+                "provider": provider,
+                "event_id": event_id,
+                "event_type": event_type,
+                # Events that belong to nothing in particular are not ordered against each other
+                "ordering_key": f"{provider}:{ordering_key or event_id}",
+                "payload": payload,
+                "status": PENDING,
+                "attempts": 0,
+                "replays": 0,
+                "next_attempt_at": now,
+                "last_error": None,
+                "received_at": now,
+                "updated_at": now,
+            })
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        self.received += 1
+        self.notify()
+        return True
+
+    def _requeue_fields(self, now) -> Dict[str, Any]:
+        # The consumer died mid-event: it goes back to the head of its key
+        return {**super()._requeue_fields(now), "last_error": self.interrupted_error}
+
+    async def claim_batch(self) -> List[Dict[str, Any]]:
+        """Lease the oldest unfinished event of up to `batch_size` keys, when it is due"""
+        now = utc_now()
+        await self.expire_leases(now)
+        heads = await self.collection.aggregate([
+            {"$match": {"status": {"$in": [PENDING, PROCESSING]}}},
+            {"$sort": {"ordering_key": 1, "received_at": 1, "_id": 1}},
+            {"$group": {"_id": "$ordering_key", "id": {"$first": "$id"}, "status": {"$first": "$status"},
+                        "next_attempt_at": {"$first": "$next_attempt_at"},
+                        "received_at": {"$first": "$received_at"}}},
+            # A key whose head is being processed or backing off has nothing to claim
+            {"$match": {"status": PENDING, "next_attempt_at": {"$lte": now}}},
+            {"$sort": {"received_at": 1}},
+            {"$limit": self.batch_size},
+        ]).to_list(self.batch_size)
+        if not heads:
+            return []
+        return await self.claim_ids({"status": PENDING}, [head["id"] for head in heads], now)
+
+    async def _mark_done(self, event: Dict[str, Any]) -> None:
+        now = utc_now()
+        await self.release([event], {"status": DONE, "last_error": None, "processed_at": now, "updated_at": now,
+                                     "expires_at": now + self.retention})
+        self.processed += 1
+
+    async def _mark_failed(self, event: Dict[str, Any], error: str, permanent: bool = False) -> None:
+        now = utc_now()
+        fields = {"last_error": error[:500], "updated_at": now}
+        if permanent:
+            fields.update(status=DEAD, expires_at=now + self.retention)
+            self.dead += 1
+            logger.warning(f"Webhook {event['provider']} {event['event_id']} dropped: {error}")
+        elif event["attempts"] >= self.max_attempts:
+            fields["status"] = DEAD
+            self.dead += 1
+            logger.error(f"Webhook {event['provider']} {event['event_id']} dead-lettered "
+                         f"after {event['attempts']} attempts: {error}")
+        else:
+            delay = self.retry_delay(event["attempts"])
+            fields.update(status=PENDING, next_attempt_at=now + timedelta(seconds=delay))
+            self.retried += 1
+            logger.warning(f"Webhook {event['provider']} {event['event_id']} failed, retrying in {delay:.0f}s: {error}")
+        await self.release([event], fields)
+
+    async def _process_one(self, event: Dict[str, Any]) -> None:
+        try:
+            await self.handler(event)
+        except asyncio.CancelledError:
+            raise
+        except PermanentError as e:
+            await self._mark_failed(event, f"{e.__class__.__name__}: {e}", permanent=True)
+        except Exception as e:
+            await self._mark_failed(event, f"{e.__class__.__name__}: {e}")
+        else:
+            await self._mark_done(event)
+
+    async def process(self, batch: List[Dict[str, Any]]) -> None:
+        """Run the handler on a claimed batch; its events all have different keys"""
+        await asyncio.gather(*(self._process_one(event) for event in batch))
+
+    async def replay(self, event_ids: Optional[List[str]] = None, include_done: bool = False) -> int:
+        """Queue dead events (or the given provider event ids) again with a fresh set of attempts
+
+        Processed events are only replayed when `include_done` is set, and
+        the handler sees `replays > 0` on them.
+        """
+        statuses = [DEAD, DONE] if include_done else [DEAD]
+        query: Dict[str, Any] = {"status": {"$in": statuses}}
+        if event_ids:
+            query["event_id"] = {"$in": event_ids}
+        now = utc_now()
+        result = await self.collection.update_many(
+            query,
+            {"$set": {"status": PENDING, "attempts": 0, "next_attempt_at": now, "updated_at": now},
+             "$inc": {"replays": 1},
+             "$unset": {"expires_at": ""}}
+        )
+        if result.modified_count:
+            self.notify()
+        return result.modified_count
+
+    async def counts(self) -> Dict[str, int]:
+        rows = await self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]).to_list(None)
+        return {row["_id"]: row["count"] for row in rows}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead": self.dead,
+        }
+
+
+async def _main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Inspect and replay stored webhook events")
+    parser.add_argument("--replay-dead", action="store_true", help="queue every dead event again")
+    parser.add_argument("--replay", nargs="+", metavar="EVENT_ID",
+                        help="queue these events again, even if they were processed")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    # The running API's consumer picks replayed events up on its next poll
+    inbox = WebhookInbox(client[os.environ['DB_NAME']].webhook_inbox, handler=None)
+    try:
+        if args.replay_dead:
+            print(f"Replayed {await inbox.replay()} dead events")
+        if args.replay:
+            print(f"Replayed {await inbox.replay(args.replay, include_done=True)} events")
+        for status, count in sorted((await inbox.counts()).items()):
+            print(f"{status}: {count}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -58,6 +58,23 @@ export const api = {
     return response.json();
   },
   
+  // multipart/form-data: the browser sets the Content-Type with its boundary
+  upload: async (endpoint, formData, token = null) => {
+    const headers = {};
+    if (token) {
+      headers["Authorization"] = `Bearer ${token}`;
+    }
+    const response = await fetch(`${API_URL}/api${endpoint}`, {
+      method: "POST",
+      headers,
+      body: formData,
+    });
+    if (!response.ok) {
+      throw new Error(await getErrorMessage(response));
+    }
+    return response.json();
+  },
+  
   delete: async (endpoint, token = null) => {
     const headers = {
       "Content-Type": "application/json",
@@ -85,6 +102,7 @@ const getErrorMessage = async (response) => {
     403: "Accès non autorisé",
     404: "Ressource non trouvée",
     409: "Cet email est déjà utilisé",
+    413: "Fichier trop volumineux",
     422: "Données invalides",
     500: "Erreur serveur",
   };
@@ -109,6 +127,18 @@ export const formatDuration = (minutes) => {
   return mins > 0 ? `${hours}h ${mins}min` : `${hours}h`;
 };
 
+// Protected course videos are served by the backend, which needs a token in
+// the URL because <video> elements cannot send an Authorization header. Pass
+// the short-lived media token from POST /courses/:id/media-token, never the
+// session token: URLs end up in logs, history and Referer headers.
+export const mediaUrl = (url, token) => {
+  if (!url || !token || !url.includes("/uploads/videos/")) {
+    return url;
+  }
+  const separator = url.includes("?") ? "&" : "?";
+  return `${url}${separator}token=${encodeURIComponent(token)}`;
+};
+
 export const getLevelColor = (level) => {
   switch (level?.toLowerCase()) {
     case "débutant":
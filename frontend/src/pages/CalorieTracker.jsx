@@ -48,6 +48,13 @@ const CalorieTracker = () => {
     }
   }, [isAuthenticated, isGuest, token]);
 
+  // Release the preview object URL when it is replaced or cleared
+  useEffect(() => {
+    return () => {
+      if (selectedImage) URL.revokeObjectURL(selectedImage);
+    };
+  }, [selectedImage]);
+
   const fetchData = async () => {
     try {
       const [summary, history] = await Promise.all([
@@ -73,23 +80,18 @@ const CalorieTracker = () => {
       return;
     }
 
-    // Convert to base64
-    const reader = new FileReader();
-    reader.onload = async (e) => {
-      const base64 = e.target.result.split(",")[1];
-      setSelectedImage(e.target.result);
-      await analyzeImage(base64);
-    };
-    reader.readAsDataURL(file);
+    // Preview locally, send the raw file (no base64 round trip)
+    setSelectedImage(URL.createObjectURL(file));
+    await analyzeImage(file);
   };
 
-  const analyzeImage = async (base64) => {
+  const analyzeImage = async (file) => {
     setAnalyzing(true);
     try {
-      const result = await api.post("/calories/analyze", {
-        image_base64: base64,
-        meal_type: getMealType()
-      }, token);
+      const formData = new FormData();
+      formData.append("image", file);
+      formData.append("meal_type", getMealType());
+      const result = await api.upload("/calories/analyze/upload", formData, token);
       
       setShowResult(result);
       toast.success("Analyse terminée !");
@@ -3,7 +3,7 @@ import { useParams, useNavigate } from "react-router-dom";
 import { Button } from "@/components/ui/button";
 import { Progress } from "@/components/ui/progress";
 import { useAuth } from "@/context/AuthContext";
-import { api, formatDuration } from "@/lib/utils";
+import { api, formatDuration, mediaUrl } from "@/lib/utils";
 import { toast } from "sonner";
 import { 
   Play, 
@@ -27,6 +27,8 @@ const VideoPlayer = () => {
   
   const [course, setCourse] = useState(null);
   const [hasAccess, setHasAccess] = useState(false);
+  const [mediaToken, setMediaToken] = useState(null);
+  const resumeAt = useRef(null);
   const [loading, setLoading] = useState(true);
   const [playing, setPlaying] = useState(false);
   const [muted, setMuted] = useState(false);
@@ -60,6 +62,8 @@ const VideoPlayer = () => {
         if (!accessData.has_access) {
           toast.error("Tu n'as pas accès à ce cours");
           navigate(`/courses/${courseId}`);
+        } else {
+          await refreshMediaToken();
         }
       } else {
         navigate("/login");
@@ -72,6 +76,26 @@ const VideoPlayer = () => {
     }
   };
 
+  // The video URL carries a short-lived media token, never the session token
+  const refreshMediaToken = async () => {
+    const data = await api.post(`/courses/${courseId}/media-token`, {}, token);
+    setMediaToken(data.token);
+  };
+
+  // A range request after the media token expired fails: get a new one and resume where we were
+  const handleVideoError = async () => {
+    if (!videoRef.current || resumeAt.current !== null) {
+      return;
+    }
+    resumeAt.current = videoRef.current.currentTime;
+    try {
+      await refreshMediaToken();
+    } catch (error) {
+      resumeAt.current = null;
+      toast.error("Impossible de charger la vidéo");
+    }
+  };
+
   const togglePlay = () => {
     if (videoRef.current) {
       if (playing) {
@@ -106,6 +130,13 @@ const VideoPlayer = () => {
   const handleLoadedMetadata = () => {
     if (videoRef.current) {
       setDuration(videoRef.current.duration);
+      if (resumeAt.current !== null) {
+        videoRef.current.currentTime = resumeAt.current;
+        resumeAt.current = null;
+        if (playing) {
+          videoRef.current.play();
+        }
+      }
     }
   };
 
@@ -203,11 +234,12 @@ const VideoPlayer = () => {
       >
         <video
           ref={videoRef}
-          src={course.video_url}
+          src={mediaUrl(course.video_url, mediaToken)}
           poster={course.thumbnail_url}
           className="w-full h-full object-contain"
           onTimeUpdate={handleTimeUpdate}
           onLoadedMetadata={handleLoadedMetadata}
+          onError={handleVideoError}
           onEnded={() => {
             setPlaying(false);
             setCompleted(true);